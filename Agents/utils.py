@@ -14,7 +14,19 @@ class ActionParsingError(Exception):
         super().__init__(message)
 
 
+# LLM clients only hold their settings, so a process keeps one per name
+_llms: Dict[str, Any] = {}
+
+
 def get_llm(llm_name: str, *args, **kwargs):
+    if args or kwargs:
+        return new_llm(llm_name, *args, **kwargs)
+    if llm_name not in _llms:
+        _llms[llm_name] = new_llm(llm_name)
+    return _llms[llm_name]
+
+
+def new_llm(llm_name: str, *args, **kwargs):
     if llm_name == "gpt3":
         return gpt3(*args, **kwargs)
     elif llm_name == "gpt4":
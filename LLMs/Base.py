@@ -28,6 +28,25 @@ def chat_completion_with_backoff(**kwargs):
     return response
 
 
+def clip_text(text: str, limit: int) -> str:
+    '''
+    Shorten a prompt to at most `limit` characters by dropping whole lines from its middle.
+    The end of a prompt usually holds the task and the action format, so it is kept.
+    '''
+    if len(text) <= limit:
+        return text
+    marker = "\n...\n"
+    head_len = max(limit - len(marker), 0) // 2
+    tail_len = max(limit - len(marker) - head_len, 0)
+    head = text[:head_len]
+    if "\n" in head:
+        head = head[:head.rfind("\n")]
+    tail = text[len(text) - tail_len:]
+    if "\n" in tail:
+        tail = tail[tail.find("\n") + 1:]
+    return head + marker + tail
+
+
 class llm_base:
 
     def __init__(self, *args, **kwargs):
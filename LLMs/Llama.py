@@ -1,7 +1,7 @@
 
 from typing import List, Dict, Union, Any
 from pathlib import Path
-from .Base import OpenAIFormatLLM, OpenAIFormatVLM
+from .Base import clip_text, OpenAIFormatLLM, OpenAIFormatVLM
 from copy import deepcopy
 # class llama3(OpenAIFormatLLM):
 
@@ -104,7 +104,7 @@ class llama32_11b_vision(OpenAIFormatVLM):
                 if isinstance(c, Path):
                     continue
                 else:
-                    p["content"][i] = p["content"][i][:20000]
+                    p["content"][i] = clip_text(p["content"][i], 20000)
         return super().call(new_prompt)
 
 
@@ -1,7 +1,7 @@
 from typing import List, Dict, Union, Any
 from pathlib import Path
 # import dashscope
-from .Base import OpenAIFormatLLM, vlm_base, OpenAIFormatVLM
+from .Base import clip_text, OpenAIFormatLLM, vlm_base, OpenAIFormatVLM
 from copy import deepcopy
 
 
@@ -101,7 +101,7 @@ class qwen_vl_plus(OpenAIFormatVLM):
                 if isinstance(c, Path):
                     continue
                 else:
-                    p["content"][i] = p["content"][i][:20000]
+                    p["content"][i] = clip_text(p["content"][i], 20000)
         return super().call(new_prompt, compress=True)
 
 
@@ -118,7 +118,7 @@ class qwen_vl_max(OpenAIFormatVLM):
                 if isinstance(c, Path):
                     continue
                 else:
-                    p["content"][i] = p["content"][i][:15000]
+                    p["content"][i] = clip_text(p["content"][i], 15000)
         return super().call(new_prompt, compress=True)
     
     
@@ -151,7 +151,7 @@ class qwen_vl_plus_latest(OpenAIFormatVLM):
                 if isinstance(c, Path):
                     continue
                 else:
-                    p["content"][i] = p["content"][i][:20000]
+                    p["content"][i] = clip_text(p["content"][i], 20000)
         return super().call(new_prompt)
 
 
@@ -1,4 +1,4 @@
-from infra import AndroidController, UIHierarchy, Element, center, parse_bound, MainEvaluator
+from infra import AndroidController, UIHierarchy, Element, load_hierarchy, center, parse_bound, MainEvaluator
 from infra import ActionType, Action, click_action, longclick_action, text_action, swipe_action, enter_action, back_action, stop_action
 from config import apk_info
 from pathlib import Path
@@ -162,9 +162,7 @@ def EvaluateTrace(trace_dir: Path) -> bool:
     activities = list(map(tuple, activities))
     hierarchies = []
     for i in range(len(meta_data)):
-        with open(trace_dir / f"{i}.xml", 'r', encoding="utf-8") as f:
-            xml = f.read()
-        hierarchies.append(UIHierarchy(ET.fromstring(xml)))
+        hierarchies.append(load_hierarchy(trace_dir / f"{i}.xml"))
     actions = [TranslateToAction(raw) for raw in meta_data]
     result = evaluator.evaluate(hierarchies, actions, activities)
 
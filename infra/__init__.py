@@ -1,5 +1,5 @@
 from .controller import AndroidController
-from .hierarchy import UIHierarchy, Element, Event, Widget
+from .hierarchy import UIHierarchy, CompactUIHierarchy, Element, Event, Widget, load_hierarchy
 from .context import Activity
 from .android_env import AndroidEnv
 from .hierarchy import Action, ActionType, none_action, back_action, enter_action, restart_action, stop_action, interact_action, click_action, swipe_action, text_action, longclick_action, get_description
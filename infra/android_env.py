@@ -9,8 +9,14 @@ import json
 from dominate import document, tags
 import re
 import copy
+from functools import lru_cache
 
 from .observation import ObservationHandler
+from .settle import Settle, SettleDetector
+from .recorder import TraceRecorder, write_text
+from .intern import pool
+from .snapshot import SnapshotReset
+from .capture import SYNC, DEFERRED, SKIP, capture_plan, parse_encoding, check_encodings, artifact_path, write_image, write_manifest, write_annotated
 from .hierarchy import Action, ActionType, parse_from_dict, none_action, back_action, enter_action, restart_action, stop_action, click_action, swipe_action, text_action, longclick_action
 from .controller import AndroidController
 from .hierarchy import Element, UIHierarchy, is_equal_action
@@ -20,6 +26,16 @@ from .evaluator import MainEvaluator
 from .config import apk_info
 
 
+@lru_cache(maxsize=1)
+def load_task_info() -> List[Any]:
+    with open("task_info.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# where the logged-in data directories of apps are kept on the device
+LOGIN_CACHE_DIR = "/data/local/tmp/sphinx_login"
+
+
 class ActionParseError(Exception):
     def __init__(self, message: str):
         self.message = message
@@ -34,7 +50,7 @@ class EnvRuntimeError(Exception):
 
 class AndroidEnv():
 
-    def __init__(self, port: str = "emulator-5554", observation_mode: str = 'text', action_mode: str = 'id', max_steps: int = 20, wait_time: float = 2.0, trace_dir: Path = Path("./trace"), reinstall=True):
+    def __init__(self, port: str = "emulator-5554", observation_mode: str = 'text', action_mode: str = 'id', max_steps: int = 20, wait_time: float = 2.0, trace_dir: Path = Path("./trace"), reinstall=True, compact_hierarchy: bool = False, token_budget: int | None = None, list_keep: int | None = None, settle_quiet: float | None = 0.5, settle_timeout: float = 10.0, capture_profile: str = 'mode-only', screenshot_encoding: str = 'png', annotated_encoding: str = 'png', snapshot: str | None = None, login_cache: bool = True, controller: AndroidController | None = None, input_backend: str = 'rpc'):
         self.port = port
         self.observation_mode = observation_mode
         self.action_mode = action_mode
@@ -44,37 +60,93 @@ class AndroidEnv():
             raise EnvRuntimeError("Invalid action mode")
         self.reset_finished = False
         self.pkg = None
-        self.controller = None
+        # a connected controller of this device to reuse, reset connects one otherwise
+        self.controller = controller
+        # how the controller injects gestures, see AndroidController
+        self.input_backend = input_backend
         self.max_steps = max_steps
         self.steps = 0
         self.reinstall = reinstall
-        self.observation_handler = ObservationHandler()
+        # which trace artifacts are written before a step returns, in the background or never
+        # encodings are "format[:quality][@scale]", see capture.parse_encoding
+        try:
+            self.capture_plan = capture_plan(capture_profile, self.observation_mode)
+            self.encodings = {"screenshot": parse_encoding(screenshot_encoding),
+                              "annotated": parse_encoding(annotated_encoding)}
+            check_encodings(self.capture_plan, self.encodings)
+        except ValueError as e:
+            raise EnvRuntimeError(str(e))
+        self.capture_profile = capture_profile
+        # name of a golden emulator snapshot with every app installed and logged in,
+        # restored before each task instead of reinstalling and logging in, see build_snapshot
+        try:
+            self.snapshot = SnapshotReset(port, snapshot) if snapshot is not None else None
+        except ValueError as e:
+            raise EnvRuntimeError(str(e))
+        self.observation_handler = ObservationHandler(
+            compact=compact_hierarchy,
+            screen=self.capture_plan["screenshot"] != SKIP or self.capture_plan["annotated"] != SKIP,
+            widgets=self.action_mode == 'id')
+        # approximate token limit of text and tree observations, None for no limit
+        self.token_budget = token_budget
+        # rows kept at each end of long runs of similar list rows in tree observations, None to keep all
+        self.list_keep = list_keep
         self.last_obs = None
         self.wait_time = wait_time
+        # wait until the UI is stable for settle_quiet seconds after each action,
+        # with settle_quiet=None sleep a fixed wait_time instead
+        self.settle = SettleDetector(settle_quiet, settle_timeout) if settle_quiet is not None else None
+        # one entry per step, how long the wait after its action took
+        self.settle_times = []
+        self.settle_time = {}
+        # the wait after the last action, its final sample is reused by the observation
+        self.settled: Settle | None = None
+        # keep each app's data directory on the device after a scripted login and
+        # restore it on later resets, the script only runs again if the check rejects it
+        self.login_cache = login_cache
         self.trace_dir = trace_dir
         self.actions = []
         self.activities = []
         self.hierarchies = []
+        # writes the trace artifacts that no observation reads in the background
+        self.recorder = TraceRecorder()
         self.trace_dir.mkdir(parents=True, exist_ok=True)
-        with open("task_info.json", "r", encoding="utf-8") as f:
-            self.task_info = json.load(f)
+        self.task_info = load_task_info()
+
+    def _path(self, artifact: str) -> Path:
+        return artifact_path(self.trace_path, artifact, self.steps, self.encodings[artifact])
 
     def _record(self) -> None:
+        plan = self.capture_plan
         screenshot = self.last_obs["screen"]
-        hierarchy = self.last_obs["hierarchy_str"]
-        with open(self.trace_path / f"{self.steps}.xml", "w", encoding="utf-8") as f:
-            f.write(hierarchy)
-        screenshot.save(self.trace_path / f"{self.steps}.png")
-        image = cv2.imread(str(self.trace_path / f"{self.steps}.png"))
-        image = self.last_obs["hierarchy"].dump_annotated_image(image)
-        cv2.imwrite(
-            str(self.trace_path / f"annotated_{self.steps}.png"), image)
+        self.recorder.submit(write_text, self.trace_path / f"{self.steps}.xml", self.last_obs["hierarchy_str"])
+        # observe() hands out the path of the screenshot the current mode reads,
+        # so only that one is written before the step returns
+        if plan["screenshot"] == SYNC:
+            write_image(self._path("screenshot"), screenshot, self.encodings["screenshot"])
+        elif plan["screenshot"] == DEFERRED:
+            self.recorder.submit(write_image, self._path("screenshot"), screenshot, self.encodings["screenshot"])
+        if plan["annotated"] == SYNC:
+            write_annotated(self._path("annotated"), screenshot, self.last_obs["hierarchy"], self.encodings["annotated"])
+        elif plan["annotated"] == DEFERRED:
+            # rendered from the frame and hierarchy in memory, not the stored copies,
+            # which may be lossy or downscaled; numbered here, so the recorder
+            # thread only reads the hierarchy
+            self.last_obs["hierarchy"].widgets()
+            self.recorder.submit(write_annotated, self._path("annotated"), screenshot,
+                                 self.last_obs["hierarchy"], self.encodings["annotated"])
 
     def reset(self, task_id: int, app: str) -> Any:
-        if self.controller is not None:
+        if self.controller is not None and self.pkg is not None:
             self.controller.stop_app(self.pkg)
+        if self.recorder.closed:
+            self.recorder = TraceRecorder()
+        # strings pooled for the last task's app, a worker runs many tasks in one process
+        pool.clear()
         self.actions = []
         self.activities = []
+        self.settle_times = []
+        self.settled = None
         self.task_id = task_id
         self.app = app
         self.apk_path = apk_info[self.app]["path"]
@@ -90,28 +162,33 @@ class AndroidEnv():
 
         self.gt_path = Path("./groundtruth") / str(task_id) / app
         self.trace_path.mkdir(parents=True, exist_ok=True)
+        write_manifest(self.trace_path, self.capture_profile, self.capture_plan, self.encodings)
         self.evaluator = MainEvaluator(self.gt_path / "evaluator.json")
-        self.controller = AndroidController(self.port, self.pkg)
-        self.controller.device.shell(
-            "ime enable com.wparam.nullkeyboard/.NullKeyboard")
-        self.controller.device.shell(
-            "ime set com.wparam.nullkeyboard/.NullKeyboard")
+        if self.snapshot is not None:
+            self.snapshot.restore()
+        if self.controller is None:
+            self.controller = AndroidController(self.port, self.pkg, self.input_backend)
+        self.controller.app_pkg_name = self.pkg
+        self.controller.input_backend = self.input_backend
+        self.controller.round_trips.clear()
+        self.controller.text_input.timings.clear()
+        # the uiautomator2 keyboard types the text of the whole task, close()
+        # gives the device back to the null keyboard, see TextInput
+        self.controller.text_input.select()
         if not self.login(self.app):
             raise EnvRuntimeError("Login failed.")
         self.reset_finished = True
         self.last_obs, _ = self.observation_handler.get_observation(
             self.controller)
-        self.hierarchies.append(UIHierarchy(
-            ET.fromstring(self.last_obs["hierarchy_str"])))
-        self.activities.append(self.controller.activity().info())
+        self.hierarchies.append(self.last_obs["hierarchy"])
+        self.activities.append(self.last_obs["activity"])
         self.steps = 0
         self._record()
         return self.observe()
 
     def login(self, app: str) -> bool:
-        if not self.reinstall:
-            self.controller.stop_app(self.pkg)
-            self.controller.start_app(self.pkg)
+        if not self.reinstall or self.snapshot is not None:
+            self.controller.restart_app(self.pkg)
             return True
 
         login_script_path = Path("./login_script") / f"{app}.json"
@@ -127,6 +204,17 @@ class AndroidEnv():
             login_script = json.load(f)
         login_actions = [parse_from_dict(action) for action in login_script]
         login_checker = MainEvaluator(login_check_path)
+        login_archive = f"{LOGIN_CACHE_DIR}/{self.pkg}.tgz"
+
+        if self.login_cache:
+            if not self.controller.is_installed(self.pkg):
+                self.controller.install_app(self.pkg, self.apk_path)
+            if self.controller.restore_app_data(self.pkg, login_archive):
+                self.controller.start_app(self.pkg)
+                self._wait()
+                if self._logged_in(login_checker):
+                    return True
+                self.controller.drop_app_data(login_archive)
 
         for _ in range(3):
             self.controller.reinstall_app(self.pkg, self.apk_path)
@@ -137,15 +225,45 @@ class AndroidEnv():
                 if action["action_type"] == ActionType.NONE:
                     time.sleep(5)
 
-            activity = self.controller.activity()
-            activity = activity.info()
-            ui_hierarchy = self.controller.dumpstr()
-            ui_hierarchy = UIHierarchy(ET.fromstring(ui_hierarchy))
-            if login_checker.evaluate([ui_hierarchy], [None], [activity]):
+            if self._logged_in(login_checker):
+                if self.login_cache:
+                    self.controller.save_app_data(self.pkg, login_archive)
+                    self.controller.start_app(self.pkg)
+                    self._wait()
                 return True
 
         return False
 
+    def _logged_in(self, login_checker: MainEvaluator) -> bool:
+        activity = self.controller.activity()
+        activity = activity.info()
+        ui_hierarchy = self.controller.dumpstr()
+        ui_hierarchy = UIHierarchy(ui_hierarchy)
+        return login_checker.evaluate([ui_hierarchy], [None], [activity])
+
+    def build_snapshot(self, apps: List[str]) -> None:
+        """Install and log in to every app, then save the golden snapshot that reset restores."""
+        if self.snapshot is None:
+            raise EnvRuntimeError("No snapshot name was given.")
+        snapshot, self.snapshot = self.snapshot, None
+        reinstall, self.reinstall = self.reinstall, True
+        try:
+            for app in apps:
+                self.app = app
+                self.apk_path = apk_info[app]["path"]
+                self.pkg = apk_info[app]["package"]
+                self.controller = AndroidController(self.port, self.pkg, self.input_backend)
+                self.controller.text_input.select()
+                if not self.login(app):
+                    raise EnvRuntimeError(f"Login to {app} failed.")
+                self.controller.stop_app(self.pkg)
+                # the snapshot is saved with the null keyboard, as close() leaves the device
+                self.controller.text_input.release()
+            self.controller.device.press("home")
+            snapshot.save()
+        finally:
+            self.snapshot, self.reinstall = snapshot, reinstall
+
     def get_instruction(self) -> str:
         if not self.reset_finished:
             raise EnvRuntimeError("You need to reset the environment first.")
@@ -153,6 +271,7 @@ class AndroidEnv():
 
     def act(self, action: Action) -> bool:
         terminated = False
+        settles: List[Settle] = []
         match action['action_type']:
             case ActionType.NONE:
                 pass
@@ -222,7 +341,7 @@ class AndroidEnv():
                     raise EnvRuntimeError(
                         "text action must have either an element or one coordinate.")
                 self.controller.click(x, y)
-                time.sleep(self.wait_time)
+                settles.append(self._wait())
                 clear = "clear" not in action or action['clear']
                 if action["message"] == "{username}":
                     message = self.username
@@ -253,30 +372,39 @@ class AndroidEnv():
                 self.controller.enter()
             case ActionType.RESTART:
                 self.controller.stop_app(self.pkg)
-                time.sleep(self.wait_time)
+                settles.append(self._wait())
                 self.controller.start_app()
             case ActionType.STOP:
                 self.controller.stop_app(self.pkg)
                 terminated = True
             case _:
                 raise EnvRuntimeError("Invalid action type.")
-        time.sleep(self.wait_time)
+        settles.append(self._wait())
+        self.settled = settles[-1]
+        # step() records it, login() acts too but its waits are not trace steps
+        self.settle_time = {"seconds": sum(settle.seconds for settle in settles),
+                            "polls": sum(settle.polls for settle in settles),
+                            "timed_out": any(settle.timed_out for settle in settles)}
         return terminated
 
+    def _wait(self) -> Settle:
+        """Wait for the UI to react to an action."""
+        if self.settle is None:
+            time.sleep(self.wait_time)
+            return Settle(self.wait_time, 0, False)
+        return self.settle.wait(self.controller)
+
     def observe(self) -> Any:
         if not self.reset_finished:
             raise EnvRuntimeError("You need to reset the environment first.")
         if self.observation_mode == 'text':
-            numbered_widgets = self.last_obs["numbered_widgets"]
-            numbered_widgets = [
-                f"[{i}] {str(widget)}" for i, widget in numbered_widgets.items()]
-            return "\n".join(numbered_widgets)
+            return self.last_obs["hierarchy"].dump_widget_list(self.token_budget)
         elif self.observation_mode == 'tree':
-            return self.last_obs["hierarchy"].dump_widget_tree()
+            return self.last_obs["hierarchy"].dump_widget_tree(self.token_budget, self.list_keep)
         elif self.observation_mode == 'image':
-            return self.trace_path / f"{self.steps}.png"
+            return self._path("screenshot")
         elif self.observation_mode == 'annotated_image':
-            return self.trace_path / f"annotated_{self.steps}.png"
+            return self._path("annotated")
         raise NotImplementedError("Only text observation mode is supported.")
 
     def parse_action_by_id(self, action_str: str) -> Action:
@@ -518,18 +646,27 @@ class AndroidEnv():
         else:
             raise EnvRuntimeError("Invalid action mode.")
 
+        if "coords" in action:
+            # record which widget a coordinate action actually lands on
+            x, y = action["coords"][0]
+            target = self.last_obs["hierarchy"].topmost_interactable_at(x, y)
+            action["target"] = target.to_widget() if target is not None else None
+
         self.actions.append(action)
 
         terminated = self.act(action)
+        self.settle_times.append(self.settle_time)
 
         self.steps += 1
 
         if action['action_type'] != ActionType.STOP:
+            # a settled wait ended on a state that stayed the same for the quiet
+            # window, what its last sample captured need not be captured again
+            settled = self.settled.captured if self.settled is not None and not self.settled.timed_out else None
             self.last_obs, terminated_by_observation = self.observation_handler.get_observation(
-                self.controller)
-            self.hierarchies.append(UIHierarchy(
-                ET.fromstring(self.last_obs["hierarchy_str"])))
-            self.activities.append(self.controller.activity().info())
+                self.controller, self.last_obs["hierarchy"], settled)
+            self.hierarchies.append(self.last_obs["hierarchy"])
+            self.activities.append(self.last_obs["activity"])
             self._record()
 
         terminated_by_action = len(
@@ -547,10 +684,14 @@ class AndroidEnv():
         return self.observe(), float(reward), terminated, truncated, None
 
     def dump_meta(self, reward, error_message: str) -> None:
-        dump_actions = copy.deepcopy(self.actions)
+        # meta.json marks the trace as complete, so the queued artifacts go first
+        self.recorder.flush()
+        dump_actions = [dict(action) for action in self.actions]
         for action in dump_actions:
             if "element" in action:
                 action['element'] = action['element']._attrib
+            if "target" in action:
+                action['target'] = action['target']._attrib if action['target'] is not None else None
             action["action_type"] = action["action_type"].name
         with open(self.trace_path / "meta.json", "w", encoding="utf-8") as f:
             json.dump({"success": bool(reward), "length": len(
@@ -559,16 +700,30 @@ class AndroidEnv():
             json.dump(dump_actions, f, indent=4)
         with open(self.trace_path / "activities.json", "w", encoding="utf-8") as f:
             json.dump(self.activities, f, indent=4)
+        with open(self.trace_path / "settle_times.json", "w", encoding="utf-8") as f:
+            json.dump(self.settle_times, f, indent=4)
+        with open(self.trace_path / "text_inputs.json", "w", encoding="utf-8") as f:
+            json.dump([timing._asdict() for timing in self.controller.text_input.timings]
+                      if self.controller is not None else [], f, indent=4)
+        with open(self.trace_path / "round_trips.json", "w", encoding="utf-8") as f:
+            json.dump(self.controller.round_trip_stats() if self.controller is not None else {}, f, indent=4)
 
     def visualize(self, annotate=True) -> None:
         if not self.reset_finished:
             raise EnvRuntimeError("You need to reset the environment first.")
+        if self.capture_plan["screenshot"] == SKIP:
+            raise EnvRuntimeError("The capture profile does not keep screenshots.")
         font_size = 20
         font_name = "arial.ttf"
         font = ImageFont.truetype(font_name, font_size)
-        pairs = [(Image.open(self.trace_path / f"{i}.png"), event)
+        self.recorder.flush()
+        encoding = self.encodings["screenshot"]
+        pairs = [(Image.open(artifact_path(self.trace_path, "screenshot", i, encoding)), event)
                  for (i, event) in enumerate(self.actions)]
         for i, (img, event) in enumerate(pairs):
+            if encoding.scale != 1:
+                # back to device coordinates, which the events use
+                img = img.convert("RGB").resize((round(img.width / encoding.scale), round(img.height / encoding.scale)))
             draw = ImageDraw.Draw(img)
             if "element" in event:
                 element = event["element"]
@@ -600,7 +755,16 @@ class AndroidEnv():
             f.write(doc.render())
 
     def close(self) -> None:
-        if self.controller is not None:
-            self.controller.stop_app(self.pkg)
-            self.controller = None
-            self.reset_finished = False
+        # stop the writer and capture threads, a later reset starts them again;
+        # a failed trace write is raised once the device is given back too
+        try:
+            self.recorder.close()
+        finally:
+            self.observation_handler.close()
+            if self.controller is not None:
+                try:
+                    self.controller.stop_app(self.pkg)
+                    self.controller.text_input.release()
+                finally:
+                    self.controller = None
+                    self.reset_finished = False
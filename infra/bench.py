@@ -0,0 +1,242 @@
+"""
+Micro benchmarks for the hierarchy / observation pipeline.
+
+Usage: python -m infra.bench observation --nodes 250 500 1000 2000
+       python -m infra.bench annotated_image --nodes 250 1000
+       python -m infra.bench memory --nodes 1000 --steps 20
+       python -m infra.bench input --port emulator-5554 --repeat 20
+"""
+from .hierarchy import UIHierarchy, ActionType
+from .intern import pool
+from .controller import AndroidController, INPUT_BACKENDS
+from typing import Callable, Dict, List
+from xml.sax.saxutils import quoteattr
+import argparse
+import cProfile
+import pstats
+import random
+import time
+import tracemalloc
+import numpy as np
+import pyshine as ps
+import cv2
+
+
+CLASSES = ["android.widget.FrameLayout", "android.widget.LinearLayout", "android.widget.TextView",
+           "android.widget.ImageView", "android.widget.Button", "android.widget.EditText",
+           "androidx.recyclerview.widget.RecyclerView"]
+
+
+def synthetic_hierarchy(nodes: int = 1000, seed: int = 0, package: str = "com.tencent.mm") -> str:
+    """Generate a uiautomator2-like dump with roughly `nodes` nodes."""
+    rnd = random.Random(seed)
+    count = 0
+
+    def node(depth: int, bounds, out: List[str]):
+        nonlocal count
+        count += 1
+        x1, y1, x2, y2 = bounds
+        attrib = {
+            "index": str(rnd.randint(0, 5)),
+            "text": rnd.choice(["", "", "", f"Item {rnd.randint(0, 99)}", "微信"]),
+            "resource-id": rnd.choice(["", f"{package}:id/title", f"{package}:id/row"]),
+            "class": rnd.choice(CLASSES),
+            "package": package,
+            "content-desc": rnd.choice(["", "", "", "More"]),
+            "checkable": "false", "checked": "false",
+            "clickable": rnd.choice(["true", "false", "false"]),
+            "enabled": "true", "focusable": "false", "focused": "false",
+            "scrollable": rnd.choice(["true"] + ["false"] * 9),
+            "long-clickable": rnd.choice(["true"] + ["false"] * 4),
+            "password": "false", "selected": "false", "visible-to-user": "true",
+            "bounds": f"[{x1},{y1}][{x2},{y2}]",
+        }
+        attrs = " ".join(f"{k}={quoteattr(v)}" for k, v in attrib.items())
+        k = 0 if depth >= 15 else rnd.randint(1, 4)
+        if k == 0 or count >= nodes:
+            out.append(f"<node {attrs} />")
+            return
+        out.append(f"<node {attrs}>")
+        h = max(1, (y2 - y1) // k)
+        for i in range(k):
+            if count >= nodes:
+                break
+            node(depth + 1, (x1, y1 + i * h, x2, min(y2, y1 + (i + 1) * h)), out)
+        out.append("</node>")
+
+    out = ["<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>", '<hierarchy rotation="0">']
+    while count < nodes:
+        node(1, (0, 0, 1440, 3200), out)
+    out.append("</hierarchy>")
+    return "\n".join(out)
+
+
+def measure(fn: Callable[[], object], repeat: int = 5) -> float:
+    """Best wall time of `repeat` runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def profiled_share(fn: Callable[[], object], name: str) -> float:
+    """Fraction of the cumulative time of `fn` spent in functions called `name`."""
+    profiler = cProfile.Profile()
+    profiler.runcall(fn)
+    stats = pstats.Stats(profiler).stats  # type: ignore
+    total = sum(tt for (_, _, tt, _, _) in stats.values())
+    spent = max([ct for (_, _, func), (_, _, _, ct, _) in stats.items() if func == name], default=0.0)
+    return spent / total if total > 0 else 0.0
+
+
+def bench_observation(sizes: List[int], repeat: int = 5) -> List[Dict[str, float]]:
+    """Time what ObservationHandler/observe() do per step: parse, widgets and widget tree."""
+    results = []
+    for size in sizes:
+        xml = synthetic_hierarchy(size)
+
+        def build():
+            hierarchy = UIHierarchy(xml)
+            hierarchy.widgets()
+            hierarchy.dump_widget_tree()
+        results.append({
+            "nodes": len(UIHierarchy(xml)._nodes),
+            "seconds": measure(build, repeat),
+            "deepcopy_share": profiled_share(build, "deepcopy"),
+        })
+    return results
+
+
+def reference_annotated_image(hierarchy: UIHierarchy, image: np.ndarray) -> np.ndarray:
+    """The per-label pyshine renderer that UIHierarchy.dump_annotated_image replaced."""
+    hierarchy._numbered_nodes()
+    background = {ActionType.CLICK: (255, 0, 0), ActionType.SWIPE: (0, 255, 0),
+                  ActionType.TEXT: (0, 0, 255), ActionType.LONGCLICK: (255, 0, 255)}
+    bound = {ActionType.CLICK: (0, 0, 255), ActionType.SWIPE: (0, 255, 0),
+             ActionType.TEXT: (255, 0, 0), ActionType.LONGCLICK: (255, 0, 255)}
+
+    def dfs(node):
+        for child in node:
+            dfs(child)
+        if node.is_interactable():
+            actions = node._available_actions()
+            x1, y1, x2, y2 = node._bounds
+            for action in bound:
+                if action in actions:
+                    cv2.rectangle(image, (x1, y1), (x2, y2), bound[action], 2)
+                    break
+            for i, action in enumerate(actions):
+                offset_x = (x1 * (i + 1) + x2 * (len(actions) - i)) // (len(actions) + 1) + 5
+                offset_y = (y1 + y2) // 2 + 5
+                ps.putBText(image, f"{node._output_index}", text_offset_x=offset_x, text_offset_y=offset_y, vspace=5, hspace=5,
+                            font_scale=1, background_RGB=background[action], text_RGB=(255, 250, 250), thickness=2, alpha=0.7)
+    for child in hierarchy._children:
+        dfs(child)
+    return image
+
+
+def bench_annotated_image(sizes: List[int], repeat: int = 5, pixel_tolerance: int = 8) -> List[Dict[str, float]]:
+    """Time the annotated screenshot renderer against the reference one and diff their pixels.
+
+    diff_ratio is the fraction of pixels where any channel differs by more than
+    pixel_tolerance.
+    """
+    results = []
+    screen = np.random.default_rng(0).integers(0, 256, (3200, 1440, 3), dtype=np.uint8)
+    for size in sizes:
+        hierarchy = UIHierarchy(synthetic_hierarchy(size))
+        reference = reference_annotated_image(hierarchy, screen.copy())
+        rendered = hierarchy.dump_annotated_image(screen.copy())
+        diff = np.abs(reference.astype(np.int16) - rendered.astype(np.int16)).max(axis=2)
+        results.append({
+            "nodes": len(hierarchy._nodes),
+            "labels": len(hierarchy._numbered_nodes()),
+            "reference_seconds": measure(lambda: reference_annotated_image(hierarchy, screen.copy()), repeat),
+            "seconds": measure(lambda: hierarchy.dump_annotated_image(screen.copy()), repeat),
+            "diff_ratio": float((diff > pixel_tolerance).mean()),
+        })
+    return results
+
+
+def bench_memory(sizes: List[int], steps: int = 20) -> List[Dict[str, float]]:
+    """Memory held by the hierarchies of a `steps`-long trace, as the evaluation loaders keep them.
+
+    Every step is a fresh dump of the same screen, so all strings repeat across steps.
+    """
+    results = []
+    for size in sizes:
+        xml = synthetic_hierarchy(size)
+        pool.clear()
+        tracemalloc.start()
+        hierarchies = [UIHierarchy(xml) for _ in range(steps)]
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({
+            "nodes": len(hierarchies[0]._nodes),
+            "bytes_per_step": retained / steps,
+            **pool.stats(),
+        })
+    return results
+
+
+def bench_input(port: str, repeat: int = 20) -> List[Dict[str, float]]:
+    """Latency of injecting gestures with each input backend, on a connected device.
+
+    The gestures are meant to do nothing: taps and a short swipe on the status
+    bar and KEYCODE_UNKNOWN. Median seconds per call.
+    """
+    controller = AndroidController(port, None)
+    gestures: Dict[str, Callable[[], object]] = {
+        "tap": lambda: controller.click(5, 5),
+        "swipe": lambda: controller.swipe(5, 5, 60, 5),
+        "key": lambda: controller.keyevent(0),
+    }
+    results = []
+    for backend in INPUT_BACKENDS:
+        controller.input_backend = backend
+        for name, gesture in gestures.items():
+            gesture()  # warm up
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                gesture()
+                times.append(time.perf_counter() - start)
+            results.append({"backend": backend, "gesture": name, "seconds": float(np.median(times))})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hierarchy micro benchmarks")
+    parser.add_argument("bench", choices=["observation", "annotated_image", "memory", "input"], help="benchmark to run")
+    parser.add_argument("--nodes", type=int, nargs="+",
+                        default=[250, 500, 1000, 2000], help="screen sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per size or gesture")
+    parser.add_argument("--port", type=str, default="emulator-5554", help="device to inject gestures into (input)")
+    parser.add_argument("--steps", type=int, default=20, help="hierarchies per trace (memory)")
+    parser.add_argument("--tolerance", type=int, default=8,
+                        help="per-channel difference allowed against the reference renderer")
+    parser.add_argument("--max_diff_ratio", type=float, default=0.05,
+                        help="fraction of pixels allowed to exceed the tolerance")
+    args = parser.parse_args()
+
+    if args.bench == "observation":
+        for result in bench_observation(args.nodes, args.repeat):
+            print(f"{result['nodes']:>6} nodes  {result['seconds'] * 1000:8.2f} ms  "
+                  f"deepcopy {result['deepcopy_share'] * 100:5.1f}%")
+    elif args.bench == "annotated_image":
+        for result in bench_annotated_image(args.nodes, args.repeat, args.tolerance):
+            verdict = "ok" if result["diff_ratio"] <= args.max_diff_ratio else "FAIL"
+            print(f"{result['nodes']:>6} nodes {result['labels']:>5} labels  "
+                  f"reference {result['reference_seconds'] * 1000:8.2f} ms  "
+                  f"composite {result['seconds'] * 1000:8.2f} ms  "
+                  f"diff {result['diff_ratio'] * 100:6.3f}% {verdict}")
+    elif args.bench == "memory":
+        for result in bench_memory(args.nodes, args.steps):
+            print(f"{result['nodes']:>6} nodes  {result['bytes_per_step'] / 1024:9.1f} KiB/step  "
+                  f"pool {result['strings']} strings {result['bytes'] / 1024:.1f} KiB  "
+                  f"hits {result['hits']}/{result['lookups']}")
+    elif args.bench == "input":
+        for result in bench_input(args.port, args.repeat):
+            print(f"{result['backend']:>6} {result['gesture']:>6}  {result['seconds'] * 1000:8.2f} ms")
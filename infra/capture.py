@@ -0,0 +1,185 @@
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Union
+import argparse
+import json
+import numpy as np
+import cv2
+from PIL import Image
+
+from .hierarchy import UIHierarchy, load_hierarchy
+
+
+# what happens to an artifact of a step
+SYNC = "sync"  # produced before the step returns, the observation reads it
+DEFERRED = "deferred"  # written by the trace recorder, off the step's critical path
+SKIP = "skip"  # not produced at all
+
+ARTIFACTS = ["xml", "screenshot", "annotated"]
+PROFILES = ["minimal", "mode-only", "full-archive"]
+# the artifact each observation mode reads, text and tree only need the hierarchy
+MODE_ARTIFACT = {"image": "screenshot", "annotated_image": "annotated"}
+
+MANIFEST = "manifest.json"
+FORMATS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+QUALITY_FLAGS = {"png": cv2.IMWRITE_PNG_COMPRESSION, "webp": cv2.IMWRITE_WEBP_QUALITY, "jpeg": cv2.IMWRITE_JPEG_QUALITY}
+QUALITY_RANGES = {"png": (0, 9), "webp": (1, 101), "jpeg": (0, 100)}
+
+
+class Encoding(NamedTuple):
+    """How a screenshot artifact is stored.
+
+    quality is the PNG compression level (0-9) or the WebP/JPEG quality
+    (WebP 101 is lossless), None for the encoder's default. scale below 1
+    stores a downscaled copy; readers scale it back to the device resolution.
+    """
+    format: str = "png"
+    quality: int | None = None
+    scale: float = 1.0
+
+    @property
+    def suffix(self) -> str:
+        return FORMATS[self.format]
+
+    def params(self) -> List[int]:
+        return [QUALITY_FLAGS[self.format], self.quality] if self.quality is not None else []
+
+
+# OpenCV's default PNG settings encode a screen about 2.5x faster than PIL's,
+# and than OpenCV itself once a compression level is given
+DEFAULT_ENCODING = Encoding("png")
+
+
+def parse_encoding(spec: str) -> Encoding:
+    """Parse "format[:quality][@scale]", e.g. "png:1", "webp:80" or "jpeg:90@0.5"."""
+    spec, _, scale = spec.partition("@")
+    format, _, quality = spec.partition(":")
+    if format not in FORMATS:
+        raise ValueError(f"unknown image format {format}, should be one of {list(FORMATS)}")
+    encoding = Encoding(format, int(quality) if quality else None, float(scale) if scale else 1.0)
+    low, high = QUALITY_RANGES[format]
+    if encoding.quality is not None and not low <= encoding.quality <= high:
+        raise ValueError(f"{format} quality should be in [{low}, {high}], got {encoding.quality}")
+    if not 0 < encoding.scale <= 1:
+        raise ValueError(f"scale should be in (0, 1], got {encoding.scale}")
+    return encoding
+
+
+def capture_plan(profile: str, observation_mode: str) -> Dict[str, str]:
+    """What to do with every artifact of a step under a capture profile.
+
+    minimal: the artifact the observation reads, plus the hierarchy XML that evaluation reads
+    mode-only: minimal plus the raw screenshot, the annotated one can be regenerated from it
+    full-archive: every artifact, the annotated screenshot is rendered by the recorder
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"unknown capture profile {profile}, should be one of {PROFILES}")
+    plan = {"xml": DEFERRED, "screenshot": SKIP, "annotated": SKIP}
+    if profile in ["mode-only", "full-archive"]:
+        plan["screenshot"] = DEFERRED
+    if profile == "full-archive":
+        plan["annotated"] = DEFERRED
+    if observation_mode in MODE_ARTIFACT:
+        plan[MODE_ARTIFACT[observation_mode]] = SYNC
+    return plan
+
+
+def check_encodings(plan: Dict[str, str], encodings: Dict[str, Encoding]) -> None:
+    """Raise ValueError if an artifact the observation reads would be downscaled.
+
+    The agent's coordinate actions are in device pixels, so only archive
+    copies (DEFERRED) may be stored below the device resolution.
+    """
+    for artifact, encoding in encodings.items():
+        if plan[artifact] == SYNC and encoding.scale != 1:
+            raise ValueError(f"the {artifact} is the observation of this mode and is kept at the device "
+                             f"resolution, scale should be 1, got {encoding.scale}")
+
+
+def artifact_path(trace_path: Path, artifact: str, step: int, encoding: Encoding) -> Path:
+    prefix = "annotated_" if artifact == "annotated" else ""
+    return trace_path / f"{prefix}{step}{encoding.suffix}"
+
+
+def write_image(path: Path, image: Union[np.ndarray, Image.Image], encoding: Encoding) -> None:
+    """Encode a BGR array, or a PIL image, to path."""
+    if isinstance(image, Image.Image):
+        image = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    if encoding.scale != 1:
+        image = cv2.resize(image, None, fx=encoding.scale, fy=encoding.scale, interpolation=cv2.INTER_AREA)
+    if not cv2.imwrite(str(path), image, encoding.params()):
+        raise ValueError(f"cannot write {path} as {encoding.format}")
+
+
+def write_manifest(trace_path: Path, profile: str, plan: Dict[str, str], encodings: Dict[str, Encoding]) -> None:
+    with open(trace_path / MANIFEST, "w", encoding="utf-8") as f:
+        json.dump({"profile": profile, "plan": plan,
+                   "encodings": {artifact: encoding._asdict() for artifact, encoding in encodings.items()}}, f, indent=4)
+
+
+def load_encodings(trace_path: Path) -> Dict[str, Encoding]:
+    """Encodings of the screenshots of a trace; traces without a manifest hold PNGs."""
+    encodings = {"screenshot": DEFAULT_ENCODING, "annotated": DEFAULT_ENCODING}
+    if (trace_path / MANIFEST).exists():
+        with open(trace_path / MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        for artifact, encoding in manifest["encodings"].items():
+            encodings[artifact] = Encoding(**encoding)
+    return encodings
+
+
+def screenshot_path(trace_path: Path, step: int, artifact: str = "screenshot") -> Path:
+    return artifact_path(trace_path, artifact, step, load_encodings(trace_path)[artifact])
+
+
+def read_screenshot(trace_path: Path, step: int, artifact: str = "screenshot") -> np.ndarray:
+    """Decode a stored screenshot to a BGR array at the device resolution."""
+    encoding = load_encodings(trace_path)[artifact]
+    path = artifact_path(trace_path, artifact, step, encoding)
+    image = cv2.imread(str(path))
+    if image is None:
+        raise FileNotFoundError(f"cannot read {path}")
+    if encoding.scale != 1:
+        height, width = image.shape[:2]
+        size = (round(width / encoding.scale), round(height / encoding.scale))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def write_annotated(path: Path, screenshot: Image.Image, hierarchy: UIHierarchy, encoding: Encoding) -> None:
+    """Render the annotated screenshot of a step from its in-memory frame and hierarchy, and encode it to path."""
+    image = cv2.cvtColor(np.asarray(screenshot.convert("RGB")), cv2.COLOR_RGB2BGR)
+    write_image(path, hierarchy.dump_annotated_image(image), encoding)
+
+
+def render_annotated(trace_path: Path, step: int) -> None:
+    """Render the annotated screenshot of a step from its stored screenshot and hierarchy.
+
+    For traces that skipped it, a running task renders it with write_annotated.
+    """
+    image = read_screenshot(trace_path, step)
+    image = load_hierarchy(trace_path / f"{step}.xml").dump_annotated_image(image)
+    encoding = load_encodings(trace_path)["annotated"]
+    write_image(artifact_path(trace_path, "annotated", step, encoding), image, encoding)
+
+
+def regenerate(root: Union[str, Path]) -> List[Path]:
+    """Render the missing annotated screenshots of every trace under root. Returns the traces touched."""
+    touched = []
+    for xml_path in sorted(Path(root).rglob("*.xml")):
+        if not xml_path.stem.isdigit():
+            continue
+        trace_path, step = xml_path.parent, int(xml_path.stem)
+        if screenshot_path(trace_path, step, "annotated").exists() or not screenshot_path(trace_path, step).exists():
+            continue
+        render_annotated(trace_path, step)
+        if trace_path not in touched:
+            touched.append(trace_path)
+    return touched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the annotated screenshots that traces deferred or skipped")
+    parser.add_argument("roots", nargs="+", help="trace directories, e.g. trace")
+    args = parser.parse_args()
+    for root in args.roots:
+        print(f"{root}: {len(regenerate(root))} traces regenerated")
@@ -6,8 +6,16 @@ from pathlib import Path
 from .context import Activity
 from .hierarchy import Event, ActionType, UIHierarchy
 from .util import Timer, center
+from .text_input import TextInput, INPUT_ERRORS
 import logging
-from typing import Tuple, Union, cast
+from typing import Deque, Dict, List, NamedTuple, Tuple, Union, cast
+from collections import deque
+from uiautomator2.abstract import ShellResponse
+from uiautomator2.exceptions import RPCError
+import numpy as np
+import cv2
+import base64
+import re
 import uiautomator2 as u2
 import os, time, random, subprocess, json
 import xml.etree.ElementTree as ET
@@ -29,6 +37,10 @@ def rand_pos(bound: Tuple[int, int, int, int], zoom: float) -> Tuple[int, int]:
 def sanitize(x: float, y: float) -> Tuple[float, float]:
     return max(x,5), max(y,5)
 
+KEYCODE_BACK = 4
+# the server moves 5 ms per step, the same 100 ms as `input swipe ... 100`
+SWIPE_STEPS = 20
+
 STR_MIN_LEN, STR_MAX_LEN = 5, 10
 DRAG_MIN_STEP, DRAG_MAX_STEP = 1, 10
 character_list = ['\$','\%','\&','\*','\.','\/','\<','\>','\?','\@','\_'] # type: ignore
@@ -56,6 +68,57 @@ def find_bottom(root, default):
     return default
         
 
+class RoundTrip(NamedTuple):
+    label: str  # first word of a shell command, the name of a batch, or rpc.<method>
+    commands: int  # commands run in the round trip
+    seconds: float
+
+
+INPUT_BACKENDS = ["rpc", "shell"]
+
+
+class ShellBatch:
+    """Shell commands chained into a single `adb shell` round trip.
+
+    The exit code of every command is echoed after it, so run() still returns
+    one ShellResponse per command. With stop_on_error a failing command ends
+    the chain like `&&`, and the commands after it get no response.
+    """
+    MARK = "__sphinx_rc_"
+
+    def __init__(self, controller: "AndroidController", label: str = "batch"):
+        self.controller = controller
+        self.label = label
+        self.commands: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def add(self, command: str) -> "ShellBatch":
+        self.commands.append(command)
+        return self
+
+    def script(self, stop_on_error: bool = False) -> str:
+        parts = []
+        for i, command in enumerate(self.commands):
+            parts.append(f'{command}; rc=$?; echo "{self.MARK}{i}:$rc"')
+            if stop_on_error:
+                parts.append('[ $rc -eq 0 ] || exit $rc')
+        return "; ".join(parts)
+
+    def run(self, stop_on_error: bool = False, timeout: float = 60) -> List[ShellResponse]:
+        if len(self.commands) == 0:
+            return []
+        output = self.controller.shell(self.script(stop_on_error), timeout=timeout,
+                                       label=self.label, commands=len(self.commands)).output
+        responses = []
+        start = 0
+        for match in re.finditer(rf"{self.MARK}(\d+):(\d+)\n?", output):
+            responses.append(ShellResponse(output[start:match.start()], int(match.group(2))))
+            start = match.end()
+        return responses
+
+
 class AndroidController:
     """Controller class for performing actions and retrieving response on AUT.
     安卓手机控制
@@ -82,15 +145,20 @@ class AndroidController:
     magic_offset: int
     popup_name: str
 
-    def __init__(self, port: str, target_app):
+    def __init__(self, port: str, target_app, input_backend: str = "rpc"):
         device = u2.connect_usb(port)
         if not device:
             logging.error('init Android opr failed!')
         else:
             logging.info('init Android opr success!')
 
+        if input_backend not in INPUT_BACKENDS:
+            raise ValueError(f"unknown input backend {input_backend}, should be one of {INPUT_BACKENDS}")
         self.port = port
         self.device = device
+        # rpc: gestures go through the uiautomator2 server that is already running on the device
+        # shell: every gesture starts the `input` command, a new Java process, on the device
+        self.input_backend = input_backend
         # self.device_url = self.device._get_atx_agent_url()
         self.device_info = cast(dict, self.device.device_info)
         # self.magic_bound = self.device.info['displayHeight']
@@ -105,9 +173,47 @@ class AndroidController:
 
         # os.environ['BOTTOM_LOWER_BOUND'] = str(self.magic_bound+self.magic_offset)
         self.popup_name = 'PopupWindow'
+        # the input method of the uiautomator2 app, it types the text sent by broadcast
+        self.adb_ime = "com.github.uiautomator/.AdbKeyboard"
+        # recent shell and rpc round trips, see round_trip_stats
+        self.round_trips: Deque[RoundTrip] = deque(maxlen=4096)
+        # whether adbd runs as root, checked by the first root_shell
+        self.adbd_root: bool | None = None
+        # types through the uiautomator2 keyboard, selected for a whole task
+        self.text_input = TextInput(self)
+
+    def shell(self, command: str, timeout: float = 60, label: str | None = None, commands: int = 1) -> ShellResponse:
+        """Run a shell command on the device and record how long the round trip took."""
+        start = time.perf_counter()
+        try:
+            return self.device.shell(command, timeout=timeout)
+        finally:
+            label = command.split(maxsplit=1)[0] if label is None else label
+            self.round_trips.append(RoundTrip(label, commands, time.perf_counter() - start))
+
+    def rpc(self, method: str, *args):
+        """Call a method of the uiautomator2 server and record the round trip."""
+        start = time.perf_counter()
+        try:
+            return getattr(self.device.jsonrpc, method)(*args)
+        finally:
+            self.round_trips.append(RoundTrip(f"rpc.{method}", 1, time.perf_counter() - start))
+
+    def batch(self, label: str = "batch") -> ShellBatch:
+        return ShellBatch(self, label)
+
+    def round_trip_stats(self) -> Dict[str, Dict[str, float]]:
+        """Round trips, commands and seconds per label of the recorded shell and rpc calls."""
+        stats: Dict[str, Dict[str, float]] = {}
+        for timing in list(self.round_trips):
+            entry = stats.setdefault(timing.label, {"calls": 0, "commands": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["commands"] += timing.commands
+            entry["seconds"] += timing.seconds
+        return stats
 
     def disable_soft_keyboard(self, null_ime_path: str):
-        shell_reponse = self.device.shell('ime list -s | grep {}'.format(self.null_ime))
+        shell_reponse = self.shell('ime list -s | grep {}'.format(self.null_ime))
         null_ime_exist = shell_reponse.output.strip()
         err_code = shell_reponse.exit_code
         time.sleep(2)
@@ -130,9 +236,9 @@ class AndroidController:
             logging.error('null keyboard already installed')
         logging.error(f'activating null keyboard ime on device {self.port}')
         
-        self.device.shell('ime enable {}'.format(self.null_ime))
+        self.shell('ime enable {}'.format(self.null_ime))
         time.sleep(3)
-        self.device.shell(f"ime set {self.null_ime}")
+        self.shell(f"ime set {self.null_ime}")
         time.sleep(3)
         with self.device.watch_context() as ctx:
             ctx.when("继续").click()
@@ -154,6 +260,14 @@ class AndroidController:
         time.sleep(wait)
         logging.debug('start app end...')
 
+    def restart_app(self, app_pkg_name: Union[str, None] = None, wait: int = 2):
+        """Stop and launch an app in one round trip, as stop_app then start_app would."""
+        app_pkg_name = self.app_pkg_name if app_pkg_name is None else app_pkg_name
+        self.batch("restart_app") \
+            .add(f'am force-stop {app_pkg_name}') \
+            .add(f'monkey -p {app_pkg_name} -c android.intent.category.LAUNCHER 1').run()
+        time.sleep(wait)
+
     def uninstall_app(self, app_pkg_name: str):
         """Uninstall apk with the given name on device.
         卸载app
@@ -195,7 +309,10 @@ class AndroidController:
 
     def click(self, x: float, y: float, wait_time: float = 0.0):
         """Tap the device screen at position (x,y)."""
-        self.device.shell(f'input tap {int(x)} {int(y) + self.upperbar}')
+        if self.input_backend == "rpc":
+            self.rpc("click", int(x), int(y) + self.upperbar)
+        else:
+            self.shell(f'input tap {int(x)} {int(y) + self.upperbar}')
         time.sleep(wait_time)
 
     def doubleclick(self, x: int, y: int, wait_time: float = 0.0):
@@ -208,7 +325,14 @@ class AndroidController:
 
     def back(self):
         """Go back on device."""
-        self.device.shell('input keyevent KEYCODE_BACK')
+        self.keyevent(KEYCODE_BACK)
+
+    def keyevent(self, keycode: int):
+        """Press the key with the given Android keycode."""
+        if self.input_backend == "rpc":
+            self.rpc("pressKeyCode", keycode)
+        else:
+            self.shell(f'input keyevent {keycode}')
 
     def enter(self):
         """Activate device enter button."""
@@ -216,7 +340,11 @@ class AndroidController:
 
     def tap_hold(self, x: float, y: float, t: float):
         """Tap and hold the screen at position (x,y) for t seconds."""
-        self.device.shell(f'input swipe {int(x)} {int(y) + self.upperbar} {int(x)} {int(y) + self.upperbar} {int(t*1000)}')
+        if self.input_backend == "rpc":
+            # the server's click takes how long to hold in milliseconds
+            self.rpc("click", int(x), int(y) + self.upperbar, int(t*1000))
+        else:
+            self.shell(f'input swipe {int(x)} {int(y) + self.upperbar} {int(x)} {int(y) + self.upperbar} {int(t*1000)}')
 
     def horizontal_scroll(self, start: int = 200, end: int = 800, pos: int = 500, direction: int = 1):
         if direction==1:
@@ -225,18 +353,25 @@ class AndroidController:
             self.swipe(end, pos, start, pos)
 
     def swipe(self, fx: float, fy: float, tx: float, ty: float, wait_time: float = 0.0):
-        self.device.shell(f"input swipe {int(fx)} {int(fy)} {int(tx)} {int(ty)} 100")
+        if self.input_backend == "rpc":
+            self.rpc("swipe", int(fx), int(fy), int(tx), int(ty), SWIPE_STEPS)
+        else:
+            self.shell(f"input swipe {int(fx)} {int(fy)} {int(tx)} {int(ty)} 100")
         time.sleep(wait_time)
 
     def input(self, text: str = "PKU", clear: bool = True, wait_time: float = 0.0):
+        """Type text into the focused field, see TextInput."""
         try:
-            self.device.shell(f"ime set {self.fast_ime}")
-            self.device.send_keys(text,clear = clear)
-            self.device.shell(f"ime set {self.null_ime}")
-            time.sleep(wait_time)
-            return True
-        except:
+            ok = self.text_input.type(text, clear)
+        except INPUT_ERRORS as e:
+            logging.error(f'typing into the focused field failed: {e!r}')
             return False
+        time.sleep(wait_time)
+        return ok
+
+    def clear_text(self) -> bool:
+        """Empty the focused field."""
+        return self.text_input.clear()
 
     def capture_screen(self, format = "opencv"):
         """Take a screenshot of the device screen.
@@ -245,12 +380,25 @@ class AndroidController:
         """
         return self.device.screenshot(format=format)
 
+    def capture_thumbnail(self, scale: float = 0.1, quality: int = 50) -> np.ndarray:
+        """A grayscale screenshot downscaled and JPEG-encoded by the uiautomator2 server.
+
+        At scale 0.1 it is a few KB instead of the megabytes of capture_screen.
+        """
+        try:
+            data = base64.b64decode(self.rpc("takeScreenshot", scale, quality))
+            return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        except RPCError:
+            logging.warning('takeScreenshot is not served, downscaling a full screenshot')
+            frame = cv2.cvtColor(self.capture_screen(format="opencv"), cv2.COLOR_BGR2GRAY)
+            return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
     def dumpstr(self) -> str:
         return self.device.dump_hierarchy()
     
     def dump(self) -> UIHierarchy:
         """Return a XML ElementTree from AUT."""
-        return UIHierarchy(ET.fromstring(self.device.dump_hierarchy()))
+        return UIHierarchy(self.device.dump_hierarchy())
 
     def fast_dump(self) -> Union[str, None]:
         raise NotImplementedError("This method is discarded since uiautomator2 3.x version. If you need to use it, check how to get device_url in the new version.")
@@ -278,7 +426,7 @@ class AndroidController:
             return Activity(cur_app['package'], cur_app['activity'])
         
         try:
-            response = self.device.shell('dumpsys window | grep mCurrentFocus').output.strip().split(' ')[-1]
+            response = self.shell('dumpsys window | grep mCurrentFocus').output.strip().split(' ')[-1]
             pkg_name, activity = response.split('/')
             activity = activity.strip('}')
         except:
@@ -289,7 +437,43 @@ class AndroidController:
         return Activity(pkg_name, activity)
 
     def clear_user_data(self):
-        self.device.shell('pm clear {}'.format(self.app_pkg_name))
+        self.shell('pm clear {}'.format(self.app_pkg_name))
+
+    def is_installed(self, app_pkg_name: str) -> bool:
+        return self.shell(f'pm path {app_pkg_name}').exit_code == 0
+
+    def root_shell(self, script: str, timeout: float = 120):
+        """Run a shell script as root, through su unless adbd already runs as root."""
+        if self.adbd_root is None:
+            self.adbd_root = self.shell('id -u').output.strip() == '0'
+        if not self.adbd_root:
+            script = "su 0 sh -c '{}'".format(script.replace("'", "'\\''"))
+        return self.shell(script, timeout=timeout)
+
+    def save_app_data(self, app_pkg_name: str, archive: str) -> bool:
+        """Archive the data directory of an app on the device, caches and the native lib link left out.
+
+        The app is stopped first, in the same round trip, so its databases are consistent.
+        """
+        data = f'/data/data/{app_pkg_name}'
+        response = self.root_shell(
+            f'am force-stop {app_pkg_name} && mkdir -p {os.path.dirname(archive)} && '
+            f'tar -czf {archive} -C {data} --exclude=./cache --exclude=./code_cache --exclude=./lib .')
+        return response.exit_code == 0
+
+    def restore_app_data(self, app_pkg_name: str, archive: str) -> bool:
+        """Replace the data directory of an installed app with an archive of save_app_data."""
+        data = f'/data/data/{app_pkg_name}'
+        # the app is stopped in the same round trip as the restore
+        # the archive may come from an earlier install with another uid
+        response = self.root_shell(
+            f'am force-stop {app_pkg_name}; test -f {archive} && owner=$(stat -c %u:%g {data}) && '
+            f'find {data} -mindepth 1 -maxdepth 1 ! -name lib -exec rm -rf {{}} + && '
+            f'tar -xzf {archive} -C {data} && chown -R $owner {data} && restorecon -R {data}')
+        return response.exit_code == 0
+
+    def drop_app_data(self, archive: str):
+        self.root_shell(f'rm -f {archive}')
 
     def restore_app(self):
         """TODO documentation"""
@@ -302,15 +486,19 @@ class AndroidController:
 
     def grant_permission(self, permissions):
         """TODO documentation"""
+        batch = self.batch("pm")
         for permission in permissions:
             logging.debug('grant permission {}'.format(permission))
-            self.device.shell('pm grant {} {}'.format(self.app_pkg_name,permission))
+            batch.add('pm grant {} {}'.format(self.app_pkg_name,permission))
+        batch.run()
 
     def revoke_permission(self, permissions):
         """TODO documentation"""
+        batch = self.batch("pm")
         for permission in permissions:
             logging.debug('revoke permission {}'.format(permission))
-            self.device.shell('pm revoke {} {}'.format(self.app_pkg_name, permission))
+            batch.add('pm revoke {} {}'.format(self.app_pkg_name, permission))
+        batch.run()
             
     def correct_pos(self, root:ET.Element) -> ET.Element:
         """TODO documentation"""
@@ -328,18 +516,15 @@ class AndroidController:
     def wifi_switch(self, switch: bool):
         """TODO documentation"""
         if switch:
-            self.device.shell('svc wifi enable')
+            self.shell('svc wifi enable')
         else:
-            self.device.shell('svc wifi disable')
+            self.shell('svc wifi disable')
             
     def air_mode_switch(self, switch: bool):
         """TODO documentation"""
-        if switch:
-            self.device.shell('settings put global airplane_mode_on 1')
-            self.device.shell('am broadcast -a android.intent.action.AIRPLANE_MODE')
-        else:
-            self.device.shell('settings put global airplane_mode_on 0')
-            self.device.shell('am broadcast -a android.intent.action.AIRPLANE_MODE')
+        self.batch("air_mode") \
+            .add('settings put global airplane_mode_on {}'.format(1 if switch else 0)) \
+            .add('am broadcast -a android.intent.action.AIRPLANE_MODE').run()
     
     def screen_wake(self, switch: bool):
         """Wake the screen and swipe to unlock the device.
@@ -0,0 +1,43 @@
+from typing import Dict, Iterable
+from hashlib import blake2b
+import re
+
+
+# attributes that make up the identity of a node. Volatile ones are left out:
+# "focused" moves while the user still sees the same screen
+KEY_ATTRIBS = ["index", "resource-id", "class", "package", "checkable", "checked", "clickable",
+               "enabled", "focusable", "scrollable", "long-clickable", "password", "selected",
+               "visible-to-user", "bounds"]
+# free-form attributes in which clearly volatile values are masked. Other
+# numbers stay: "Step 1 of 3" and "Step 2 of 3", or two amounts, are different screens
+MASKED_ATTRIBS = ["text", "content-desc"]
+# clock times, e.g. 9:41, 21:05:33 or 9:41 PM
+CLOCK = re.compile(r"\b\d{1,2}:\d{2}(:\d{2})?(\s?[AaPp][Mm])?\b")
+# unread counters, a badge holds nothing but a small number, e.g. 3 or 99+
+BADGE = re.compile(r"\d{1,3}\+?")
+# what the user typed is content, whatever it looks like
+UNMASKED_CLASSES = ["android.widget.EditText"]
+
+HASH_SIZE = 8
+
+
+def stable_key(attrib: Dict[str, str]) -> bytes:
+    """The attributes of one node that take part in its structural hash."""
+    get = attrib.get
+    parts = [get(key, "") for key in KEY_ATTRIBS]
+    masked = get("class", "") not in UNMASKED_CLASSES
+    for key in MASKED_ATTRIBS:
+        value = get(key, "")
+        if value and masked:
+            value = "#" if BADGE.fullmatch(value) else CLOCK.sub("#", value)
+        parts.append(value)
+    return "\x1f".join(parts).encode()
+
+
+def subtree_hash(key: bytes, children: Iterable[bytes]) -> bytes:
+    """Merkle hash of a node: its own key followed by the hashes of its children in order."""
+    return blake2b(key + b"".join(children), digest_size=HASH_SIZE).digest()
+
+
+def screen_hash(roots: Iterable[bytes]) -> str:
+    return subtree_hash(b"hierarchy", roots).hex()
@@ -1,15 +1,20 @@
 from __future__ import annotations
 
 from .util import cloneable, parse_bound
+from .intern import pool
+from .fingerprint import stable_key, subtree_hash, screen_hash
+from .index import AttributeIndex, SpatialIndex, contains, matches
+from .render import render_annotations, Rect, Label
+from .store import NodeStore, SUFFIX, COL_RESOURCE_ID, COL_CLASS, COL_PACKAGE, COL_CONTENT_DESC, COL_TEXT
 from copy import deepcopy, copy
 from enum import IntEnum
-from typing import Deque, Generator, List, Set, Tuple, Union, cast, Dict, Any, TypedDict
+from typing import Deque, Generator, Iterator, List, Set, Tuple, Union, cast, Dict, Any, TypedDict
 from collections import deque
 import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+from pathlib import Path
 import logging
 import numpy as np
-import pyshine as ps
-import cv2
 
 
 class ActionType(IntEnum):
@@ -27,6 +32,15 @@ class ActionType(IntEnum):
     STOP = 8
 
 
+# BGR colors of the bounds and labels in annotated screenshots
+ANNOTATION_COLORS = {
+    ActionType.CLICK: (0, 0, 255),
+    ActionType.SWIPE: (0, 255, 0),
+    ActionType.TEXT: (255, 0, 0),
+    ActionType.LONGCLICK: (255, 0, 255),
+}
+
+
 ACTION_MAP = {
     "NONE": ActionType.NONE,
     "CLICK": ActionType.CLICK,
@@ -258,6 +272,41 @@ def get_description(action: Action) -> str:
             raise Exception("Invalid action type for description.")
 
 
+def estimate_tokens(text: str) -> int:
+    """Rough token count of an observation: about 4 ASCII characters per token,
+    one token per other character (e.g. CJK)."""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def subtree_nodes(node: UIHierarchy.Node) -> List[UIHierarchy.Node]:
+    nodes = [node]
+    for n in nodes:
+        nodes.extend(n._children)
+    return nodes
+
+
+def format_ranges(indices: List[int]) -> str:
+    """Sorted indices as compact ranges, e.g. [3, 4, 5, 9] -> "3-5, 9"."""
+    ranges: List[str] = []
+    start = 0
+    for i in range(1, len(indices) + 1):
+        if i == len(indices) or indices[i] != indices[i - 1] + 1:
+            first, last = indices[start], indices[i - 1]
+            ranges.append(f"{first}-{last}" if last > first else f"{first}")
+            start = i
+    return ", ".join(ranges)
+
+
+# priorities of the lines of a budgeted widget tree, lower is kept first
+KEEP_INTERACTABLE = 0
+KEEP_TEXT = 1
+KEEP_LAYOUT = 2
+
+# attributes of UIHierarchy.Node that depend on its place in the hierarchy
+NODE_STATE = ["_depth", "_children", "_output_index"]
+
+
 class Element:
     _index: int
     _resource_id: str
@@ -289,11 +338,11 @@ class Element:
 
         get = (lambda x, y="": _from.get(x, default=y)) if isinstance(_from, ET.Element) else \
             (lambda x, y="": cast(dict, _from).get(x, y))
-        self._attrib = _from.attrib if type(_from) == ET.Element else _from
+        self._attrib = pool.attrib(_from.attrib if type(_from) == ET.Element else _from)
         self._index = int(get('index'))
-        self._resource_id = get('resource-id').split('/')[-1].strip()
-        self._class = get('class').strip()
-        self._package = get('package').strip()
+        self._resource_id = pool(get('resource-id').split('/')[-1].strip())
+        self._class = pool(get('class').strip())
+        self._package = pool(get('package').strip())
         self._checkable = get('checkable') == 'true'
         self._checked = get('checked') == 'true'
         self._clickable = get('clickable') == 'true'
@@ -319,6 +368,14 @@ class Element:
     def extract_static_text(text: str) -> str:
         return text
 
+    def _clone_state(self) -> Dict[str, Any]:
+        # shallow copy: _attrib is shared between clones and only replaced
+        # through set_attrib (copy-on-write), lists are copied
+        return {k: (copy(v) if isinstance(v, list) else v) for k, v in self.__dict__.items()}
+
+    def set_attrib(self, key: str, value: str):
+        self._attrib = {**self._attrib, key: value}
+
     def is_shown_to_user(self) -> bool:
         return self._visible_to_user
 
@@ -458,12 +515,27 @@ class UIHierarchy:
 
     _nodes: List[Node]
     _children: List[Node]
+    _attribute_index: Union[AttributeIndex, None]
+    _spatial_index: Union[SpatialIndex, None]
+    _numbered: Union[List[Node], None]
+    _widget_tree: Union[str, None]
+    _widget_list: Union[str, None]
+    _text_dump: Union[str, None]
+    _fingerprint: str
+    _lines: Dict[Tuple[int | None, bool], List[Tuple[str, int, int, int, int]]]
+    _dumps: Dict[Tuple[str, int | None, int | None], str]
+    _shapes: Dict[int, int]
 
     class Node(Element):
         _depth: int
         _children: List[Node]
         _output_index: int
 
+        _widget: Union[Widget, None]
+        _description: Union[str, None]
+        _key: Union[bytes, None]
+        _hash: bytes
+
         @cloneable
         def __init__(self, _from: Union[Node, Element, ET.Element], _children: List[Node] = [], _depth: int = 1):
             assert not isinstance(_from, Node)
@@ -471,6 +543,54 @@ class UIHierarchy:
             self._children = _children
             self._depth = _depth
             self._output_index = -1
+            self._widget = None
+            self._description = None
+            self._key = None
+            self._hash = b""
+
+        def _clone_state(self) -> Dict[str, Any]:
+            state = super()._clone_state()
+            state.pop("_widget", None)
+            state.pop("_description", None)
+            state.pop("_key", None)
+            state.pop("_hash", None)
+            return state
+
+        def _reuse(self, _depth: int) -> Node:
+            # a new node with the same attributes: share the parsed element
+            # data and the cached widget / description instead of re-parsing
+            node = type(self).__new__(type(self))
+            node.__dict__.update(self.__dict__)
+            node._children = []
+            node._depth = _depth
+            node._output_index = -1
+            return node
+
+        def to_widget(self) -> Union[Widget, None]:
+            # the widget is cached per node, callers must not mutate it
+            if self._widget is None:
+                widget = super().to_widget()
+                if widget is not None:
+                    # the widget is shared by the nodes that reuse this one in later
+                    # steps, so it keeps no depth, children or number of this node
+                    for key in NODE_STATE:
+                        widget.__dict__.pop(key, None)
+                self._widget = widget
+            return self._widget
+
+        def description(self) -> str:
+            # the text of the node in dump_widget_tree, without the index
+            if self._description is None:
+                self._description = str(self.to_widget()) if self.is_interactable() else str(self)
+            return self._description
+
+        def signature(self) -> Tuple[str, str, Tuple[int, int, int, int], str]:
+            return self._class, self._resource_id, self._bounds, self._text
+
+        def subtree_hash(self) -> bytes:
+            """Merkle hash of the subtree as built, ignoring volatile attributes
+            (see infra.fingerprint). Equal subtrees of any two hierarchies hash equal."""
+            return self._hash
 
         def add_child(self, child: Node):
             self._children.append(child)
@@ -493,22 +613,63 @@ class UIHierarchy:
             return result
 
     @cloneable
-    def __init__(self, _from: Union[UIHierarchy, ET.ElementTree, ET.Element]):
+    def __init__(self, _from: Union[UIHierarchy, ET.ElementTree, ET.Element, str, bytes], previous: UIHierarchy | None = None):
+        """previous: the hierarchy of the previous step, nodes with unchanged
+        attributes reuse its parsed element data and cached strings."""
         assert not isinstance(_from, UIHierarchy)
         if isinstance(_from, ET.ElementTree):
             _from = _from.getroot()
         self._nodes = []
-        self._children = self._build_children(_from)
-
-    def _build_children(self, _from) -> List[Node]:
-        return [self._build_from_element(ch) for ch in cast(ET.Element, _from) if ch.attrib.get("package") != "com.android.systemui"]
-
-    def _build_from_element(self, cur_elem: ET.Element) -> Node:
+        self._attribute_index = None
+        self._spatial_index = None
+        self._numbered = None
+        self._widget_tree = None
+        self._widget_list = None
+        self._text_dump = None
+        self._lines = {}
+        self._dumps = {}
+        self._shapes = {}
+        reuse = previous._reuse_map() if previous is not None else {}
+        if isinstance(_from, (str, bytes)):
+            self._children = self._build_from_string(_from, reuse)
+        else:
+            self._children = self._build_children(_from, reuse)
+        self._hash_subtrees()
+
+    def _hash_subtrees(self):
+        # _nodes is in BFS order, so walking it backwards hashes children first;
+        # reused nodes keep the key they were hashed with in the previous step
+        for node in reversed(self._nodes):
+            if node._key is None:
+                node._key = stable_key(node._attrib)
+            node._hash = subtree_hash(node._key, [child._hash for child in node._children])
+        self._fingerprint = screen_hash([child._hash for child in self._children])
+
+    def fingerprint(self) -> str:
+        """Identity of the screen: equal for dumps that differ only in volatile
+        attributes, such as focus, clocks and counters."""
+        return self._fingerprint
+
+    def _reuse_map(self) -> Dict[Tuple[Tuple[str, str], ...], Node]:
+        return {tuple(node._attrib.items()): node for node in self._nodes}
+
+    def _new_node(self, _from: Union[ET.Element, Dict[str, str]], attrib: Dict[str, str], depth: int,
+                  reuse: Dict[Tuple[Tuple[str, str], ...], Node]) -> Node:
+        if len(reuse) > 0:
+            old = reuse.get(tuple(attrib.items()))
+            if old is not None:
+                return old._reuse(depth)
+        return type(self).Node(_from, [], depth)
+
+    def _build_children(self, _from, reuse: Dict[Tuple[Tuple[str, str], ...], Node] = {}) -> List[Node]:
+        return [self._build_from_element(ch, reuse) for ch in cast(ET.Element, _from) if ch.attrib.get("package") != "com.android.systemui"]
+
+    def _build_from_element(self, cur_elem: ET.Element, reuse: Dict[Tuple[Tuple[str, str], ...], Node] = {}) -> Node:
         q: Deque[Tuple[Node, ET.Element]] = deque()
 
         def process_elem(elem, father: Node | None = None):
-            node = type(self).Node(elem, [], father._depth +
-                                   1 if father is not None else 1)
+            node = self._new_node(elem, elem.attrib, father._depth +
+                                  1 if father is not None else 1, reuse)
             self._nodes.append(node)
             for ch in elem:
                 q.append((node, ch))
@@ -520,78 +681,395 @@ class UIHierarchy:
             father.add_child(child)
         return ret
 
+    def _build_from_string(self, data: Union[str, bytes], reuse: Dict[Tuple[Tuple[str, str], ...], Node] = {}) -> List[Node]:
+        # build nodes straight from the dump in a single expat pass, without
+        # materializing an ElementTree first
+        children: List[Node] = []
+        stack: List[Node | None] = []
+        skipped = 0
+
+        def start(tag: str, attrib: Dict[str, str]):
+            nonlocal skipped
+            if skipped > 0:
+                skipped += 1
+                return
+            depth = len(stack)
+            if depth == 0:
+                # the <hierarchy> root itself is not a node
+                stack.append(None)
+                return
+            if depth == 1 and attrib.get("package") == "com.android.systemui":
+                skipped = 1
+                return
+            node = self._new_node(attrib, attrib, depth, reuse)
+            if depth == 1:
+                children.append(node)
+            else:
+                cast(Node, stack[-1]).add_child(node)
+            stack.append(node)
+
+        def end(tag: str):
+            nonlocal skipped
+            if skipped > 0:
+                skipped -= 1
+                return
+            stack.pop()
+
+        parser = expat.ParserCreate(intern=pool.table)
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.Parse(data, True)
+
+        # keep the same BFS order as _build_from_element
+        for child in children:
+            q: Deque[Node] = deque([child])
+            while len(q) > 0:
+                node = q.popleft()
+                self._nodes.append(node)
+                q.extend(node._children)
+        return children
+
+    def _interactable_nodes(self) -> List[Node]:
+        return [node for node in self._nodes if node.is_interactable()]
+
+    def _numbered_nodes(self) -> List[Node]:
+        # interactable nodes, numbered once per hierarchy and shared by
+        # widgets(), the widget tree and the annotated image
+        if self._numbered is None:
+            self._numbered = self._interactable_nodes()
+            for index, node in enumerate(self._numbered):
+                node._output_index = index
+        return self._numbered
+
+    def iter_widgets(self, action_type: ActionType | None = None, visible_only: bool = False,
+                     region: Tuple[int, int, int, int] | None = None) -> Iterator[Widget]:
+        """Widgets in numbering order, each built only when it is consumed.
+
+        action_type: only widgets offering this action.
+        visible_only: only widgets whose bounds have a non-empty area.
+        region: only widgets whose bounds overlap (x1, y1, x2, y2).
+        """
+        for node in self._numbered_nodes():
+            x1, y1, x2, y2 = node._bounds
+            if visible_only and (x1 >= x2 or y1 >= y2):
+                continue
+            if region is not None and not (x1 < region[2] and region[0] < x2 and y1 < region[3] and region[1] < y2):
+                continue
+            widget = cast(Widget, node.to_widget())
+            if action_type is not None and action_type not in widget._action_types:
+                continue
+            yield widget
+
+    def iter_events(self, action_type: ActionType | None = None, visible_only: bool = False,
+                    region: Tuple[int, int, int, int] | None = None) -> Iterator[Event]:
+        """Events of iter_widgets(), one per available action, built only when consumed."""
+        for widget in self.iter_widgets(action_type, visible_only, region):
+            for action in widget._action_types:
+                if action_type is None or action == action_type:
+                    yield Event(widget, action)
+
     def events(self) -> List[Event]:
-        return sum(map(lambda x: cast(Widget, x.to_widget()).to_events(),
-                   filter(lambda x: x.is_interactable(), self._nodes)), [])
+        return list(self.iter_events())
 
     def widgets(self) -> List[Widget]:
-        return [cast(Widget, node.to_widget()) for node in
-                filter(lambda x: x.is_interactable(), self._nodes)]
+        return list(self.iter_widgets())
 
     def __iter__(self):
         return iter(self._nodes)
 
     def __str__(self) -> str:
-        ret = ""
-        q: Deque[Node] = deque(self._children)
-        while len(q) > 0:
-            node = q.popleft()
-            ret += "\t"*node._depth + str(node) + '\n'
-            for child in reversed(list(node)):  # reverse to assure order
-                q.appendleft(child)
-        return ret
+        if self._text_dump is None:
+            lines: List[str] = []
+            stack: List[Node] = list(reversed(self._children))
+            while len(stack) > 0:
+                node = stack.pop()
+                lines.append("\t" * node._depth + str(node) + '\n')
+                stack.extend(reversed(node._children))  # reverse to assure order
+            self._text_dump = "".join(lines)
+        return self._text_dump
+
+    def _node_at(self, pos: int) -> Node:
+        return self._nodes[pos]
+
+    def attribute_index(self) -> AttributeIndex:
+        if self._attribute_index is None:
+            self._attribute_index = AttributeIndex(self._nodes)
+        return self._attribute_index
+
+    def spatial_index(self) -> SpatialIndex:
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex([node._bounds for node in self._nodes])
+        return self._spatial_index
+
+    def elements_at(self, x: float, y: float) -> List[Node]:
+        """All nodes whose bounds include (x, y), in node (BFS) order."""
+        return [self._node_at(pos) for pos in self.spatial_index().at(x, y)]
+
+    def topmost_interactable_at(self, x: float, y: float) -> Node | None:
+        """The interactable node a touch at (x, y) most likely lands on.
+
+        Android dispatches touches to the deepest view under the point, and among
+        overlapping siblings to the one drawn last, i.e. the later one. So the
+        path is walked down from the roots through the last child under the
+        point, and the deepest interactable node on it wins.
+        """
+        ret = None
+        children = self._children
+        while True:
+            node = next((child for child in reversed(children) if contains(child._bounds, x, y)), None)
+            if node is None:
+                return ret
+            if node.is_interactable():
+                ret = node
+            children = node._children
 
     def find_element(self, match_rule: Dict[str, str], match_type: str = "equal", must_include_point: Tuple[int, int] | None = None) -> Element | None:
-        if match_type == "equal":
-            for node in self._nodes:
-                if all([(key in node._attrib and node._attrib[key] == value) for key, value in match_rule.items()]):
-                    if must_include_point is not None:
-                        x, y = must_include_point
-                        if node._bounds[0] <= x <= node._bounds[2] and node._bounds[1] <= y <= node._bounds[3]:
-                            return node
-                    else:
-                        return node
-        elif match_type == "include":
-            for node in self._nodes:
-                if all([(key in node._attrib and value in node._attrib[key]) for key, value in match_rule.items()]):
-                    if must_include_point is not None:
-                        x, y = must_include_point
-                        if node._bounds[0] <= x <= node._bounds[2] and node._bounds[1] <= y <= node._bounds[3]:
-                            return node
-                    else:
-                        return node
-        else:
-            raise ValueError("match_type should be 'equal' or 'include'")
+        # first match in node (BFS) order, looked up through the spatial index
+        # when a point is given and through the attribute index otherwise
+        if must_include_point is not None:
+            for node in self.elements_at(*must_include_point):
+                if matches(node._attrib, match_rule, match_type):
+                    return node
+            if match_type not in ["equal", "include"]:
+                raise ValueError("match_type should be 'equal' or 'include'")
+            return None
+        for pos in self.attribute_index().match(match_rule, match_type):
+            return self._node_at(pos)
         return None
 
-    def dump_widget_tree(self):
-        index = 0
-        for node in self._nodes:
-            if node.is_interactable():
-                node._output_index = index
-                index += 1
+    def diff(self, previous: UIHierarchy) -> HierarchyDiff:
+        """Match this hierarchy against the one of the previous step.
+
+        Nodes are matched top-down among the children of matched parents,
+        first by their signature (class, resource-id, bounds, text), then the
+        rest by (class, resource-id) only, e.g. a row whose text was edited.
+        """
+        ret = HierarchyDiff()
+
+        def pair(old_nodes: List[Node], new_nodes: List[Node], key) -> Tuple[List[Tuple[Node, Node]], List[Node], List[Node]]:
+            pending: Dict[Tuple, Deque[Node]] = {}
+            for old in old_nodes:
+                pending.setdefault(key(old), deque()).append(old)
+            pairs, unmatched = [], []
+            for new in new_nodes:
+                candidates = pending.get(key(new))
+                if candidates:
+                    pairs.append((candidates.popleft(), new))
+                else:
+                    unmatched.append(new)
+            matched = set(id(old) for old, _ in pairs)
+            return pairs, [old for old in old_nodes if id(old) not in matched], unmatched
+
+        stack: List[Tuple[List[Node], List[Node]]] = [(previous._children, self._children)]
+        while len(stack) > 0:
+            old_nodes, new_nodes = stack.pop()
+            pairs, old_nodes, new_nodes = pair(old_nodes, new_nodes, lambda n: n.signature())
+            weak_pairs, old_nodes, new_nodes = pair(old_nodes, new_nodes, lambda n: (n._class, n._resource_id))
+            for old, new in pairs + weak_pairs:
+                if old._attrib != new._attrib:
+                    ret.changed.append((old, new))
+                else:
+                    ret.unchanged += 1
+                stack.append((old._children, new._children))
+            for new in new_nodes:
+                ret.inserted.extend(subtree_nodes(new))
+            for old in old_nodes:
+                ret.removed.extend(subtree_nodes(old))
+        return ret
 
-        def dfs(node: Node, indent: int) -> str:
-            if node.is_interactable():
-                ret = "\t" * indent + \
-                    f"[{node._output_index}] {node.to_widget()}\n"
+    def dump_widget_tree(self, token_budget: int | None = None, list_keep: int | None = None) -> str:
+        """The widget tree observation.
+
+        token_budget: approximate token limit, see _dump_budgeted_tree.
+        list_keep: summarise runs of similar rows in scrollable lists, see _list_items.
+        """
+        if token_budget is not None or list_keep is not None:
+            return self._cached_dump("tree", token_budget, list_keep)
+        if self._widget_tree is None:
+            self._numbered_nodes()
+            lines: List[str] = []
+            stack: List[Tuple[Node, int]] = [(child, 0) for child in reversed(self._children)
+                                             if child._package != "com.android.systemui"]
+            while len(stack) > 0:
+                node, indent = stack.pop()
+                if node.is_interactable():
+                    lines.append("\t" * indent + f"[{node._output_index}] {node.description()}\n")
+                else:
+                    lines.append("\t" * indent + f"{node.description()}\n")
+                stack.extend((child, indent + 1) for child in reversed(node._children))
+            self._widget_tree = "".join(lines)
+        return self._widget_tree
+
+    def dump_widget_list(self, token_budget: int | None = None) -> str:
+        """The numbered widgets, one per line, as shown in the text observation mode."""
+        if token_budget is not None:
+            return self._cached_dump("list", token_budget, None)
+        if self._widget_list is None:
+            self._widget_list = "\n".join(
+                f"[{i}] {node.description()}" for i, node in enumerate(self._numbered_nodes()))
+        return self._widget_list
+
+    def _cached_dump(self, kind: str, token_budget: int | None, list_keep: int | None) -> str:
+        key = (kind, token_budget, list_keep)
+        ret = self._dumps.get(key)
+        if ret is None:
+            if kind == "list":
+                ret = self._dump_budgeted_list(cast(int, token_budget))
+            elif token_budget is None:
+                ret = "".join("\t" * indent + text for text, indent, _, _, _ in self._tree_lines(list_keep, False))
             else:
-                ret = "\t" * indent + f"{node}\n"
-            for child in node:
-                ret += dfs(child, indent + 1)
-            return ret
-        ret = ""
-        for child in self._children:
-            if child._package != "com.android.systemui":
-                ret += dfs(child, 0)
+                ret = self._dump_budgeted_tree(token_budget, list_keep)
+            self._dumps[key] = ret
         return ret
 
-    def dump_annotated_image(self, image: np.ndarray) -> np.ndarray:
-        index = 0
-        for node in self._nodes:
+    def _shape(self, node: Node) -> int:
+        # structure of a subtree without its texts: rows of a list share it
+        shape = self._shapes.get(id(node))
+        if shape is None:
+            shape = self._shapes[id(node)] = hash((
+                node._class, node._resource_id, tuple(node._available_actions()),
+                tuple(self._shape(child) for child in node._children)))
+        return shape
+
+    def _list_items(self, node: Node, list_keep: int | None) -> List[Union[Node, str]]:
+        """The children of a node, where in a scrollable node every run of more
+        than 2 * list_keep + 1 structurally identical rows keeps its first and
+        last list_keep rows and the rest becomes one marker line. The marker
+        lists the widget indices of the rows it stands for, so they can still
+        be addressed."""
+        children = node._children
+        if list_keep is None or not node._scrollable or len(children) <= 2 * list_keep + 1:
+            return cast(List[Union[Node, str]], children)
+        items: List[Union[Node, str]] = []
+        shapes = [self._shape(child) for child in children]
+        start = 0
+        while start < len(children):
+            end = start + 1
+            while end < len(children) and shapes[end] == shapes[start]:
+                end += 1
+            if end - start > 2 * list_keep + 1:
+                hidden = children[start + list_keep:end - list_keep]
+                indices = sorted(n._output_index for row in hidden for n in subtree_nodes(row)
+                                 if n._output_index >= 0)
+                marker = f"... {len(hidden)} more similar items"
+                if len(indices) > 0:
+                    marker += f" (widgets {format_ranges(indices)})"
+                items.extend(children[start:start + list_keep])
+                items.append(marker)
+                items.extend(children[end - list_keep:end])
+            else:
+                items.extend(children[start:end])
+            start = end
+        return items
+
+    def _tree_lines(self, list_keep: int | None, compact: bool) -> List[Tuple[str, int, int, int, int]]:
+        """(text, indent, parent line, priority, tokens) of the lines of the widget tree.
+
+        With compact, lines that carry no information are left out:
+        non-interactable nodes without text are dropped when they have no
+        children and skipped when they only wrap a single child.
+        """
+        cache_key = (list_keep, compact)
+        ret = self._lines.get(cache_key)
+        if ret is not None:
+            return ret
+        self._numbered_nodes()
+        lines: List[Tuple[str, int, int, int, int]] = []
+        stack: List[Tuple[Union[Node, str], int, int]] = [
+            (child, 0, -1) for child in reversed(self._children) if child._package != "com.android.systemui"]
+        while len(stack) > 0:
+            node, indent, parent = stack.pop()
+            if isinstance(node, str):
+                lines.append((node + "\n", indent, parent, KEEP_TEXT, estimate_tokens("\t" * indent + node + "\n")))
+                continue
+            items = self._list_items(node, list_keep)
             if node.is_interactable():
-                node._output_index = index
-                index += 1
+                priority = KEEP_INTERACTABLE
+                text = f"[{node._output_index}] {node.description()}\n"
+            elif len(node._dynamic_text) > 0 or not compact:
+                priority = KEEP_TEXT
+                text = f"{node.description()}\n"
+            elif len(items) == 1:
+                stack.append((items[0], indent, parent))
+                continue
+            elif len(items) == 0:
+                continue
+            else:
+                priority = KEEP_LAYOUT
+                text = f"{node.description()}\n"
+            lines.append((text, indent, parent, priority, estimate_tokens("\t" * indent + text)))
+            stack.extend((item, indent + 1, len(lines) - 1) for item in reversed(items))
+
+        if compact:
+            # layouts whose children were all dropped carry no information either
+            has_children = [False] * len(lines)
+            for i in reversed(range(len(lines))):
+                parent, priority = lines[i][2], lines[i][3]
+                if (priority != KEEP_LAYOUT or has_children[i]) and parent >= 0:
+                    has_children[parent] = True
+            kept = [i for i in range(len(lines)) if lines[i][3] != KEEP_LAYOUT or has_children[i]]
+            renumber = {old: new for new, old in enumerate(kept)}
+            lines = [(text, indent, renumber.get(parent, -1), priority, tokens)
+                     for text, indent, parent, priority, tokens in (lines[i] for i in kept)]
+        self._lines[cache_key] = lines
+        return lines
+
+    def _dump_budgeted_tree(self, token_budget: int, list_keep: int | None = None) -> str:
+        """The widget tree in at most about token_budget tokens (see estimate_tokens).
+
+        Wrapper and empty layout nodes are left out first. If the tree is still
+        too long, lines are kept by priority: interactable widgets, then nodes
+        with text, then layouts, each in document order. The kept lines are
+        printed in document order, indented by their kept ancestors, and a last
+        line tells how many nodes were left out.
+        """
+        lines = self._tree_lines(list_keep, True)
+        omitted_line = "... {} more elements not shown\n"
+        budget = token_budget - estimate_tokens(omitted_line.format(len(lines)))
+        selected = [False] * len(lines)
+        if sum(line[4] for line in lines) <= token_budget:
+            selected = [True] * len(lines)
+        else:
+            for i in sorted(range(len(lines)), key=lambda i: (lines[i][3], i)):
+                if lines[i][4] <= budget:
+                    budget -= lines[i][4]
+                    selected[i] = True
+        out: List[str] = []
+        depth = [0] * len(lines)
+        for i, (text, _, parent, _, _) in enumerate(lines):
+            if not selected[i]:
+                continue
+            # indent below the closest kept ancestor
+            while parent >= 0 and not selected[parent]:
+                parent = lines[parent][2]
+            depth[i] = depth[parent] + 1 if parent >= 0 else 0
+            out.append("\t" * depth[i] + text)
+        omitted = len(lines) - len(out)
+        if omitted > 0:
+            out.append(omitted_line.format(omitted))
+        return "".join(out)
+
+    def _dump_budgeted_list(self, token_budget: int) -> str:
+        # widgets beyond the budget are left out from the end
+        omitted_line = "... {} more widgets not shown"
+        budget = token_budget - estimate_tokens(omitted_line.format(len(self._numbered_nodes())))
+        out: List[str] = []
+        for i, node in enumerate(self._numbered_nodes()):
+            line = f"[{i}] {node.description()}"
+            tokens = estimate_tokens(line + "\n")
+            if tokens > budget:
+                break
+            budget -= tokens
+            out.append(line)
+        omitted = len(self._numbered_nodes()) - len(out)
+        if omitted > 0:
+            out.append(omitted_line.format(omitted))
+        return "\n".join(out)
+
+    def dump_annotated_image(self, image: np.ndarray) -> np.ndarray:
+        self._numbered_nodes()
+        rects: List[Rect] = []
+        labels: List[Label] = []
 
         def dfs(node: Node):
             for child in node:
@@ -601,36 +1079,243 @@ class UIHierarchy:
                 label = f"{node._output_index}"
                 x1, y1, x2, y2 = node._bounds
                 # draw the bound
-                if ActionType.CLICK in actions:
-                    cv2.rectangle(image, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                elif ActionType.SWIPE in actions:
-                    cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                elif ActionType.TEXT in actions:
-                    cv2.rectangle(image, (x1, y1), (x2, y2), (255, 0, 0), 2)
-                elif ActionType.LONGCLICK in actions:
-                    cv2.rectangle(image, (x1, y1), (x2, y2), (255, 0, 255), 2)
+                for action in [ActionType.CLICK, ActionType.SWIPE, ActionType.TEXT, ActionType.LONGCLICK]:
+                    if action in actions:
+                        rects.append((x1, y1, x2, y2, ANNOTATION_COLORS[action]))
+                        break
                 for i, action in enumerate(actions):
                     offset_x = (x1 * (i + 1) + x2 * (len(actions) - i)
                                 ) // (len(actions) + 1) + 5
                     offset_y = (y1 + y2) // 2 + 5
-                    if action == ActionType.CLICK:
-                        ps.putBText(image, label, text_offset_x=offset_x, text_offset_y=offset_y, vspace=5, hspace=5,
-                                    font_scale=1, background_RGB=(255, 0, 0), text_RGB=(255, 250, 250), thickness=2, alpha=0.7)
-                    elif action == ActionType.SWIPE:
-                        ps.putBText(image, label, text_offset_x=offset_x, text_offset_y=offset_y, vspace=5, hspace=5,
-                                    font_scale=1, background_RGB=(0, 255, 0), text_RGB=(255, 250, 250), thickness=2, alpha=0.7)
-                    elif action == ActionType.TEXT:
-                        ps.putBText(image, label, text_offset_x=offset_x, text_offset_y=offset_y, vspace=5, hspace=5,
-                                    font_scale=1, background_RGB=(0, 0, 255), text_RGB=(255, 250, 250), thickness=2, alpha=0.7)
-                    elif action == ActionType.LONGCLICK:
-                        ps.putBText(image, label, text_offset_x=offset_x, text_offset_y=offset_y, vspace=5, hspace=5,
-                                    font_scale=1, background_RGB=(255, 0, 255), text_RGB=(255, 250, 250), thickness=2, alpha=0.7)
-                    else:
+                    if action not in ANNOTATION_COLORS:
                         raise NotImplementedError(
                             f"action {action} not supported")
+                    labels.append((offset_x, offset_y, label, ANNOTATION_COLORS[action]))
         for child in self._children:
             dfs(child)
-        return image
-
+        return render_annotations(image, rects, labels)
 
 Node = UIHierarchy.Node
+
+
+class HierarchyDiff:
+    """Result of UIHierarchy.diff: inserted nodes belong to the new hierarchy,
+    removed nodes to the previous one, changed holds (previous, new) pairs."""
+
+    inserted: List[Node]
+    removed: List[Node]
+    changed: List[Tuple[Node, Node]]
+    unchanged: int
+
+    def __init__(self):
+        self.inserted = []
+        self.removed = []
+        self.changed = []
+        self.unchanged = 0
+
+    def is_empty(self) -> bool:
+        return len(self.inserted) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+
+    def __str__(self) -> str:
+        return f"{len(self.inserted)} inserted, {len(self.removed)} removed, {len(self.changed)} changed, {self.unchanged} unchanged"
+
+
+class CompactUIHierarchy(UIHierarchy):
+    """A UIHierarchy whose nodes are lightweight views over a columnar NodeStore.
+
+    Nodes are only created when accessed, find_element and the interactable
+    filter run vectorized over the store arrays.
+    """
+
+    _store: NodeStore
+    _views: List[Union[Node, None]]
+    _hashes: Union[List[bytes], None]
+    _spatial_index: Union[SpatialIndex, None]
+
+    class Node(UIHierarchy.Node):
+        _hierarchy: CompactUIHierarchy
+        _row: int
+        _attrib_dict: Union[Dict[str, str], None]
+
+        def __init__(self, _hierarchy: CompactUIHierarchy, _row: int):
+            self._hierarchy = _hierarchy
+            self._row = _row
+            self._output_index = -1
+            self._widget = None
+            self._description = None
+            self._attrib_dict = None
+
+        @property
+        def _attrib(self) -> Dict[str, str]:
+            # built once per view, views live as long as their hierarchy
+            if self._attrib_dict is None:
+                self._attrib_dict = self._hierarchy._store.attrib(self._row)
+            return self._attrib_dict
+
+        @property
+        def _index(self) -> int:
+            return int(self._hierarchy._store.index[self._row])
+
+        @property
+        def _resource_id(self) -> str:
+            return self._hierarchy._store.text(self._row, COL_RESOURCE_ID)
+
+        @property
+        def _class(self) -> str:
+            return self._hierarchy._store.text(self._row, COL_CLASS)
+
+        @property
+        def _package(self) -> str:
+            return self._hierarchy._store.text(self._row, COL_PACKAGE)
+
+        @property
+        def _content_desc(self) -> str:
+            return self._hierarchy._store.text(self._row, COL_CONTENT_DESC)
+
+        @property
+        def _text(self) -> str:
+            return self._hierarchy._store.text(self._row, COL_TEXT)
+
+        @property
+        def _dynamic_text(self) -> str:
+            return self._content_desc if len(self._content_desc) > 0 else self._text
+
+        @property
+        def _static_text(self) -> str:
+            return type(self).extract_static_text(self._dynamic_text)
+
+        @property
+        def _bounds(self) -> Tuple[int, int, int, int]:
+            return cast(Tuple[int, int, int, int], tuple(self._hierarchy._store.bounds[self._row].tolist()))
+
+        @property
+        def _depth(self) -> int:
+            return int(self._hierarchy._store.depth[self._row])
+
+        @property
+        def _children(self) -> List[Node]:
+            return [self._hierarchy._view(row) for row in self._hierarchy._store.children(self._row)]
+
+        def _flag(name: str):
+            return property(lambda self: self._hierarchy._store.has_flag(self._row, name))
+        _checkable = _flag("checkable")
+        _checked = _flag("checked")
+        _clickable = _flag("clickable")
+        _focusable = _flag("focusable")
+        _focused = _flag("focused")
+        _enabled = _flag("enabled")
+        _scrollable = _flag("scrollable")
+        _long_clickable = _flag("long-clickable")
+        _password = _flag("password")
+        _selected = _flag("selected")
+        _visible_to_user = _flag("visible-to-user")
+        del _flag
+
+        def add_child(self, child: Node):
+            raise TypeError("nodes of a CompactUIHierarchy are read-only")
+
+        def _clone_state(self) -> Dict[str, Any]:
+            # copies (e.g. Widget(node)) are materialized from the store
+            return {k: getattr(self, k) for k in list(Element.__annotations__) + ["_attrib"] + NODE_STATE}
+
+        def __deepcopy__(self, memo):
+            result = UIHierarchy.Node.__new__(UIHierarchy.Node)
+            for k, v in self._clone_state().items():
+                setattr(result, k, v)
+            result._widget = None
+            result._description = None
+            result._key = None
+            result._hash = self.subtree_hash()
+            return result
+
+        def subtree_hash(self) -> bytes:
+            return self._hierarchy._subtree_hashes()[self._row]
+
+    @cloneable
+    def __init__(self, _from: Union[CompactUIHierarchy, NodeStore, ET.ElementTree, ET.Element, str, bytes], previous: UIHierarchy | None = None):
+        assert not isinstance(_from, CompactUIHierarchy)
+        if isinstance(_from, ET.ElementTree):
+            _from = _from.getroot()
+        if isinstance(_from, NodeStore):
+            self._store = _from
+        elif isinstance(_from, (str, bytes)):
+            self._store = NodeStore.from_string(_from)
+        else:
+            self._store = NodeStore.from_element(_from)
+        self._views = [None] * len(self._store)
+        self._attribute_index = None
+        self._spatial_index = None
+        self._numbered = None
+        self._widget_tree = None
+        self._widget_list = None
+        self._text_dump = None
+        self._lines = {}
+        self._dumps = {}
+        self._shapes = {}
+        self._hashes = None
+
+    def _node_at(self, pos: int) -> Node:
+        return self._view(pos)
+
+    def _subtree_hashes(self) -> List[bytes]:
+        # computed on first use, loading stored hierarchies stays free of it
+        if self._hashes is None:
+            store = self._store
+            hashes = [b""] * len(store)
+            for row in reversed(range(len(store))):
+                hashes[row] = subtree_hash(stable_key(store.attrib(row)),
+                                           [hashes[ch] for ch in store.children(row).tolist()])
+            self._hashes = hashes
+            self._fingerprint = screen_hash([hashes[row] for row in self._store.roots.tolist()])
+        return self._hashes
+
+    def fingerprint(self) -> str:
+        self._subtree_hashes()
+        return self._fingerprint
+
+    def _reuse_map(self) -> Dict[Tuple[Tuple[str, str], ...], Node]:
+        # views cannot be shared with another hierarchy
+        return {}
+
+    def spatial_index(self) -> SpatialIndex:
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(
+                cast(List[Tuple[int, int, int, int]], list(map(tuple, self._store.bounds.tolist()))))
+        return self._spatial_index
+
+    def _view(self, row: int) -> Node:
+        view = self._views[row]
+        if view is None:
+            view = self._views[row] = type(self).Node(self, int(row))
+        return view
+
+    @property
+    def _nodes(self) -> List[Node]:
+        return [self._view(row) for row in range(len(self._store))]
+
+    @property
+    def _children(self) -> List[Node]:
+        return [self._view(row) for row in self._store.roots]
+
+    def _interactable_nodes(self) -> List[Node]:
+        return [self._view(row) for row in np.flatnonzero(self._store.interactable_mask())]
+
+    def find_element(self, match_rule: Dict[str, str], match_type: str = "equal", must_include_point: Tuple[int, int] | None = None) -> Element | None:
+        mask = self._store.match_mask(match_rule, match_type)
+        if must_include_point is not None:
+            mask &= self._store.point_mask(must_include_point)
+        rows = np.flatnonzero(mask)
+        return self._view(rows[0]) if len(rows) > 0 else None
+
+
+def load_hierarchy(path: Union[str, Path]) -> CompactUIHierarchy:
+    """Load a saved hierarchy such as trace_dir / "3.xml".
+
+    The binary copy written by `python -m infra.store` (3.uih) is preferred
+    when it is at least as new as the XML, otherwise the XML is parsed.
+    """
+    xml_path = Path(path)
+    bin_path = xml_path.with_suffix(SUFFIX)
+    if bin_path.exists() and (not xml_path.exists() or bin_path.stat().st_mtime >= xml_path.stat().st_mtime):
+        return CompactUIHierarchy(NodeStore.load(bin_path))
+    return CompactUIHierarchy(xml_path.read_bytes())
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Iterator, List, Set, Tuple
+import heapq
+
+if TYPE_CHECKING:
+    from .hierarchy import Element
+
+
+GRAM = 3
+
+
+def ngrams(text: str, n: int = GRAM) -> Set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def matches(attrib: Dict[str, str], match_rule: Dict[str, str], match_type: str = "equal") -> bool:
+    if match_type == "equal":
+        return all(key in attrib and attrib[key] == value for key, value in match_rule.items())
+    elif match_type == "include":
+        return all(key in attrib and value in attrib[key] for key, value in match_rule.items())
+    raise ValueError("match_type should be 'equal' or 'include'")
+
+
+def contains(bounds: Tuple[int, int, int, int], x: float, y: float) -> bool:
+    return bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]
+
+
+class AttributeIndex:
+    """Lazily built attribute index over the nodes of one hierarchy.
+
+    For every queried attribute it keeps a hash map value -> node positions and
+    a trigram map trigram -> values, so that 'equal' and 'include' rules only
+    touch candidate nodes. Positions are kept in node order, so the first match
+    is the same node a linear scan would return.
+    """
+
+    def __init__(self, nodes: List[Element]):
+        self._nodes = nodes
+        self._values: Dict[str, Dict[str, List[int]]] = {}
+        self._grams: Dict[str, Dict[str, Set[str]]] = {}
+        self._positions_cache: Dict[Tuple[str, str, str], List[int]] = {}
+
+    def values(self, key: str) -> Dict[str, List[int]]:
+        values = self._values.get(key)
+        if values is None:
+            values = self._values[key] = {}
+            for pos, node in enumerate(self._nodes):
+                attrib = node._attrib
+                if key in attrib:
+                    values.setdefault(attrib[key], []).append(pos)
+        return values
+
+    def _grams_of(self, key: str) -> Dict[str, Set[str]]:
+        grams = self._grams.get(key)
+        if grams is None:
+            grams = self._grams[key] = {}
+            for value in self.values(key):
+                for gram in ngrams(value):
+                    grams.setdefault(gram, set()).add(value)
+        return grams
+
+    def _including(self, key: str, part: str) -> List[str]:
+        if len(part) < GRAM:
+            return [value for value in self.values(key) if part in value]
+        grams = self._grams_of(key)
+        candidates = None
+        for gram in ngrams(part):
+            values = grams.get(gram)
+            if values is None:
+                return []
+            candidates = values if candidates is None else candidates & values
+        return [value for value in candidates or () if part in value]
+
+    def positions(self, key: str, value: str, match_type: str = "equal") -> List[int]:
+        """Positions of the nodes matching a single rule, in node order."""
+        cache_key = (key, value, match_type)
+        ret = self._positions_cache.get(cache_key)
+        if ret is None:
+            values = self.values(key)
+            if match_type == "equal":
+                ret = values.get(value, [])
+            elif match_type == "include":
+                ret = list(heapq.merge(*[values[v] for v in self._including(key, value)]))
+            else:
+                raise ValueError("match_type should be 'equal' or 'include'")
+            self._positions_cache[cache_key] = ret
+        return ret
+
+    def match(self, match_rule: Dict[str, str], match_type: str = "equal") -> Iterator[int]:
+        """Positions of the nodes matching all rules, in node order."""
+        if match_type not in ["equal", "include"]:
+            raise ValueError("match_type should be 'equal' or 'include'")
+        if len(match_rule) == 0:
+            yield from range(len(self._nodes))
+            return
+        rules = sorted(match_rule.items(),
+                       key=lambda rule: len(self.positions(rule[0], rule[1], match_type)))
+        (key, value), others = rules[0], dict(rules[1:])
+        for pos in self.positions(key, value, match_type):
+            if matches(self._nodes[pos]._attrib, others, match_type):
+                yield pos
+
+
+class SpatialIndex:
+    """Uniform grid over node bounds for point-in-bounds queries.
+
+    Each node is registered in the grid cells its bounds cover; nodes covering
+    a large part of the screen (root containers) are kept in one separate list
+    instead. Query results are positions in node order.
+    """
+
+    GRID = 16
+
+    def __init__(self, bounds: List[Tuple[int, int, int, int]]):
+        self._bounds = bounds
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        self._large: List[int] = []
+        valid = [pos for pos, b in enumerate(bounds) if b[0] <= b[2] and b[1] <= b[3]]
+        if len(valid) == 0:
+            self._origin, self._cell_size = (0, 0), (1, 1)
+            return
+        x0 = min(bounds[pos][0] for pos in valid)
+        y0 = min(bounds[pos][1] for pos in valid)
+        x1 = max(bounds[pos][2] for pos in valid)
+        y1 = max(bounds[pos][3] for pos in valid)
+        self._origin = (x0, y0)
+        self._cell_size = ((x1 - x0) // self.GRID + 1, (y1 - y0) // self.GRID + 1)
+        max_cells = self.GRID * self.GRID // 4
+        for pos in valid:
+            cx1, cy1 = self._cell(bounds[pos][0], bounds[pos][1])
+            cx2, cy2 = self._cell(bounds[pos][2], bounds[pos][3])
+            if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > max_cells:
+                self._large.append(pos)
+                continue
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self._cells.setdefault((cx, cy), []).append(pos)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int((x - self._origin[0]) // self._cell_size[0]), int((y - self._origin[1]) // self._cell_size[1])
+
+    def at(self, x: float, y: float) -> List[int]:
+        """Positions of the nodes whose bounds include (x, y), in node order."""
+        cell = self._cells.get(self._cell(x, y), [])
+        return [pos for pos in heapq.merge(cell, self._large) if contains(self._bounds[pos], x, y)]
@@ -0,0 +1,76 @@
+from typing import Dict
+import sys
+
+
+# values that rarely repeat outside one screen, free-form texts and positions
+# that change with every scroll; they are not pooled so a long session does
+# not keep every one it has seen alive
+UNPOOLED_ATTRIBS = {"text", "content-desc", "bounds"}
+# the pool starts over once it holds this many strings, e.g. in loaders that
+# walk thousands of traces of different apps
+MAX_STRINGS = 100_000
+
+
+class StringPool:
+    """Process-wide pool that makes equal attribute strings share one object.
+
+    Hierarchies of the same app repeat resource ids, class and package names and
+    flag values on every node of every step; pooling them keeps one copy each.
+    The pool is bounded by max_strings and AndroidEnv.reset clears it per task.
+    """
+
+    def __init__(self, max_strings: int = MAX_STRINGS):
+        self._strings: Dict[str, str] = {}
+        self.max_strings = max_strings
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __call__(self, s: str) -> str:
+        if len(self._strings) >= self.max_strings:
+            self._strings.clear()
+        self.lookups += 1
+        pooled = self._strings.setdefault(s, s)
+        if pooled is not s:
+            self.hits += 1
+        return pooled
+
+    def attrib(self, attrib: Dict[str, str]) -> Dict[str, str]:
+        """Pool the values of a node's attributes in place; expat pools the names."""
+        table = self._strings
+        if len(table) >= self.max_strings:
+            # cleared in place, expat holds the same dict as its intern table
+            table.clear()
+        lookups = hits = 0
+        for key, value in attrib.items():
+            if key not in UNPOOLED_ATTRIBS:
+                lookups += 1
+                pooled = table.setdefault(value, value)
+                if pooled is not value:
+                    attrib[key] = pooled
+                    hits += 1
+        self.lookups += lookups
+        self.hits += hits
+        return attrib
+
+    @property
+    def table(self) -> Dict[str, str]:
+        # passed as expat's `intern` argument, so the parser pools attribute names
+        return self._strings
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "strings": len(self._strings),
+            "bytes": sum(sys.getsizeof(s) for s in self._strings),
+            "lookups": self.lookups,
+            "hits": self.hits,
+        }
+
+    def clear(self) -> None:
+        self._strings.clear()
+        self.lookups = self.hits = 0
+
+
+pool = StringPool()
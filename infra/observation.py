@@ -1,22 +1,88 @@
 from enum import Flag, auto
-from typing import List, Dict, Tuple
+from typing import Any, List, Dict, Tuple, cast
 import xml.etree.ElementTree as ET
 import numpy as np
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from .controller import AndroidController
-from .hierarchy import Event, UIHierarchy
+from .context import Activity
+from .hierarchy import Event, UIHierarchy, CompactUIHierarchy
+from .settle import SettleDetector
+
+# the cheap signals compared before and after a capture, see SettleDetector
+CHECK_SIGNALS = ["focus", "frame"]
     
 class ObservationHandler:
 
-    def __init__(self):
-        pass
-    
-    def get_observation(self, controller: AndroidController) -> Tuple[Dict, bool]:
+    def __init__(self, compact: bool = False, concurrent: bool = True,
+                 screen: bool = True, widgets: bool = True, check: bool = True):
+        # compact: keep hierarchies as CompactUIHierarchy to save memory
+        # concurrent: take the screenshot and the hierarchy dump in parallel
+        # screen: take a screenshot, obs["screen"] is None without it
+        # widgets: list the widgets, needed to resolve widget ids in actions
+        # check: sample the focused window and a thumbnail before and after the
+        # capture, and capture once more if the UI changed in between
+        self.hierarchy_class = CompactUIHierarchy if compact else UIHierarchy
+        self.concurrent = concurrent
+        self.executor = None
+        self.screen = screen
+        self.widgets = widgets
+        self.checker = SettleDetector(signals=CHECK_SIGNALS) if check else None
+
+    def _capture(self, controller: AndroidController, settled: Dict[str, Any]) -> Tuple[Image.Image | None, str, Activity | None]:
+        # settled: what the settle detector already captured of this UI state
+        # the activity is left to the check when there is one
+        with_activity = self.checker is None and "activity" not in settled
+        if not self.concurrent:
+            screen = controller.capture_screen(format="pillow") if self.screen else None
+            hierarchy_str = settled["hierarchy_str"] if "hierarchy_str" in settled else controller.dumpstr()
+            return screen, hierarchy_str, controller.activity() if with_activity else settled.get("activity")
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="observation")
+        screen = self.executor.submit(controller.capture_screen, format="pillow") if self.screen else None
+        hierarchy_str = self.executor.submit(controller.dumpstr) if "hierarchy_str" not in settled else None
+        activity = self.executor.submit(controller.activity) if with_activity else None
+        return (screen.result() if screen is not None else None,
+                hierarchy_str.result() if hierarchy_str is not None else settled["hierarchy_str"],
+                activity.result() if activity is not None else settled.get("activity"))
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def get_observation(self, controller: AndroidController, previous: UIHierarchy | None = None,
+                        settled: Dict[str, Any] | None = None) -> Tuple[Dict, bool]:
+        # previous: hierarchy of the last step, unchanged nodes are reused from it
+        # settled: Settle.captured of a settled wait, its sample is the one before
+        # the capture and its dump is reused
         obs = {}
-        obs["screen"] = controller.capture_screen(format="pillow")
-        obs["hierarchy_str"] = controller.dumpstr()
-        obs["hierarchy"] = UIHierarchy(ET.fromstring(obs["hierarchy_str"]))
-        obs["widgets"] = obs["hierarchy"].widgets()
-        obs['numbered_widgets'] = {i: widget for i, widget in enumerate(obs['widgets'])}
+        settled = settled or {}
+        consistent = True
+        for attempt in range(2):
+            if attempt > 0:
+                # the UI moved while it was captured, what the wait sampled is stale too
+                settled = {}
+            before = settled.get("state", {})
+            if self.checker is not None and any(signal not in before for signal in CHECK_SIGNALS):
+                before, _ = self.checker.sample(controller)
+            screen, hierarchy_str, activity = self._capture(controller, settled)
+            if self.checker is None:
+                break
+            after, captured = self.checker.sample(controller)
+            activity = captured["activity"]
+            consistent = self.checker.same(before, after)
+            if consistent:
+                break
+        obs["screen"] = screen
+        obs["hierarchy_str"] = hierarchy_str
+        obs["activity"] = cast(Activity, activity).info()
+        # False when the UI still changed during the second capture
+        obs["consistent"] = consistent
+        obs["hierarchy"] = self.hierarchy_class(obs["hierarchy_str"], previous)
+        obs["fingerprint"] = obs["hierarchy"].fingerprint()
+        if self.widgets:
+            obs["widgets"] = obs["hierarchy"].widgets()
+            obs['numbered_widgets'] = {i: widget for i, widget in enumerate(obs['widgets'])}
         # todo: judge when to terminate
         return obs, False
@@ -0,0 +1,60 @@
+from pathlib import Path
+from typing import Any, Callable, List, Tuple
+import queue
+import threading
+
+
+def write_text(path: Path, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+class TraceRecorder:
+    """Writes trace artifacts on a background thread.
+
+    Writes are queued with submit() and run in order by one writer thread.
+    The queue is bounded, so a slow disk blocks the caller instead of piling
+    up frames in memory. flush() waits for every queued write and re-raises
+    the first error one of them hit.
+    """
+
+    def __init__(self, max_pending: int = 16):
+        # (fn, args) items; None stops the writer
+        self._queue: "queue.Queue[Tuple[Callable[..., Any], Tuple[Any, ...]] | None]" = queue.Queue(maxsize=max_pending)
+        self._errors: List[Exception] = []
+        self._thread = threading.Thread(target=self._run, name="trace-recorder", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                fn, args = item
+                fn(*args)
+            except Exception as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    @property
+    def closed(self) -> bool:
+        return not self._thread.is_alive()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        if self.closed:
+            raise RuntimeError("the trace recorder is closed")
+        self._queue.put((fn, args))
+
+    def flush(self) -> None:
+        self._queue.join()
+        if len(self._errors) > 0:
+            errors, self._errors = self._errors, []
+            raise errors[0]
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import List, Tuple
+import numpy as np
+import cv2
+
+
+FONT = cv2.FONT_HERSHEY_DUPLEX
+FONT_SCALE = 1
+THICKNESS = 2
+SPACING = 5
+ALPHA = 0.7
+TEXT_COLOR = (250, 250, 255)  # BGR
+
+Color = Tuple[int, int, int]
+Rect = Tuple[int, int, int, int, Color]
+Label = Tuple[int, int, str, Color]
+
+
+# about 34 KB per entry; real screens use a few dozen labels
+@lru_cache(maxsize=2048)
+def label_glyph(text: str, color: Color) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]:
+    """Cached layer and blend weights of one label, with the offset of its top-left corner.
+
+    The label is the translucent box of `color` with the text drawn over it by
+    cv2.putText. Blending the image with the layer gives
+    image * w_image + layer * w_layer, where w_image is ALPHA inside the box and
+    1 outside it, scaled down by the anti-aliased text coverage.
+    """
+    (w, h), baseline = cv2.getTextSize(text, FONT, fontScale=FONT_SCALE, thickness=THICKNESS)
+    pad = max(2 * THICKNESS + 2, SPACING)
+    shape = (h + max(baseline, SPACING) + 2 * pad, w + 2 * pad)
+    coverage = np.zeros(shape, dtype=np.uint8)
+    cv2.putText(coverage, text, (pad, pad + h), FONT, fontScale=FONT_SCALE, color=255, thickness=THICKNESS)
+    text_weight = coverage.astype(np.float32) * np.float32(1 / 255)
+    box_weight = np.zeros(shape, dtype=np.float32)
+    box_weight[pad - SPACING:pad + h + SPACING, pad - SPACING:pad + w + SPACING] = 1 - ALPHA
+    box_weight *= 1 - text_weight
+    layer_weight = box_weight + text_weight
+    # layer = (box_weight * color + text_weight * TEXT_COLOR) / layer_weight
+    share = np.divide(text_weight, layer_weight, out=np.zeros(shape, dtype=np.float32), where=layer_weight > 0)
+    layer = np.asarray(color, dtype=np.float32) + share[..., None] * (
+        np.asarray(TEXT_COLOR, dtype=np.float32) - np.asarray(color, dtype=np.float32))
+    return np.rint(layer).astype(np.uint8), 1 - layer_weight, layer_weight, -pad, -pad
+
+
+def render_annotations(image: np.ndarray, rects: List[Rect], labels: List[Label]) -> np.ndarray:
+    """Draw widget bounds and numbered labels onto a BGR image in place.
+
+    Labels look like pyshine.putBText(alpha=0.7): a translucent box of the label
+    color behind the text, with the text at (x, y + text height). Box and text
+    of a label are precomposed into one cached layer, so each label costs a
+    single blend of its own pixels instead of the crop copies, overlay and
+    putText calls that putBText makes.
+    """
+    height, width = image.shape[:2]
+    for x, y, text, color in labels:
+        layer, image_weight, layer_weight, dx, dy = label_glyph(text, color)
+        gx, gy = x + dx, y + dy
+        cx1, cy1 = max(gx, 0), max(gy, 0)
+        cx2, cy2 = min(gx + layer.shape[1], width), min(gy + layer.shape[0], height)
+        if cx1 >= cx2 or cy1 >= cy2:
+            continue
+        crop = (slice(cy1 - gy, cy2 - gy), slice(cx1 - gx, cx2 - gx))
+        region = image[cy1:cy2, cx1:cx2]
+        region[:] = cv2.blendLinear(region, layer[crop], image_weight[crop], layer_weight[crop])
+
+    # bounds go on top, as the parents' bounds did in the per-node renderer
+    for x1, y1, x2, y2, color in rects:
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+    return image
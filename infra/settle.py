@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Tuple
+import time
+import numpy as np
+import cv2
+
+from .hierarchy import UIHierarchy
+
+if TYPE_CHECKING:
+    from .controller import AndroidController
+
+
+SIGNALS = ["focus", "frame", "hierarchy"]
+# the hierarchy dump is the slowest signal, it is only sampled when asked for
+DEFAULT_SIGNALS = ["focus", "frame"]
+FRAME_SCALE = 0.1  # scale of the screenshot the device encodes for the frame signal
+FRAME_SIZE = (36, 64)  # (width, height) of the downscaled frame
+FRAME_THRESHOLD = 2.0  # mean absolute gray-level change that counts as a change
+
+
+class Settle(NamedTuple):
+    seconds: float
+    polls: int
+    timed_out: bool
+    # what the last sample captured, "activity" and with the hierarchy signal
+    # "hierarchy_str", and "state", the values compared between polls; the
+    # observation after a settled wait reuses them
+    captured: Dict[str, Any] = {}
+
+
+class SettleDetector:
+    """Waits until the UI stops changing after an action.
+
+    Every `interval` seconds it samples signals of the device state:
+    focus: the focused window (dumpsys window)
+    frame: a screenshot downscaled and encoded on the device, compared in grayscale
+    hierarchy: the fingerprint of the UI hierarchy, see UIHierarchy.fingerprint;
+    a full dump per poll, so it is off by default
+    The UI is settled once no signal changed for `quiet` seconds, and waiting
+    stops after `timeout` seconds regardless.
+    """
+
+    def __init__(self, quiet: float = 0.5, timeout: float = 10.0, interval: float = 0.1,
+                 signals: List[str] = DEFAULT_SIGNALS):
+        for signal in signals:
+            if signal not in SIGNALS:
+                raise ValueError(f"unknown settle signal {signal}, should be one of {SIGNALS}")
+        self.quiet = quiet
+        self.timeout = timeout
+        self.interval = interval
+        self.signals = signals
+
+    def sample(self, controller: AndroidController) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """(values compared between polls, what was captured to get them)"""
+        state: Dict[str, Any] = {}
+        captured: Dict[str, Any] = {}
+        if "focus" in self.signals:
+            captured["activity"] = controller.activity()
+            state["focus"] = captured["activity"].info()
+        if "frame" in self.signals:
+            frame = controller.capture_thumbnail(FRAME_SCALE)
+            state["frame"] = cv2.resize(frame, FRAME_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+        if "hierarchy" in self.signals:
+            captured["hierarchy_str"] = controller.dumpstr()
+            state["hierarchy"] = UIHierarchy(captured["hierarchy_str"]).fingerprint()
+        return state, captured
+
+    @staticmethod
+    def same(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        """Whether two samples show the same UI, in the signals both have."""
+        for signal, value in a.items():
+            if signal not in b:
+                continue
+            if signal == "frame":
+                if np.abs(value - b[signal]).mean() > FRAME_THRESHOLD:
+                    return False
+            elif value != b[signal]:
+                return False
+        return True
+
+    def wait(self, controller: AndroidController) -> Settle:
+        start = time.perf_counter()
+        last = None
+        stable_since = start
+        polls = 0
+        while True:
+            sampled_at = time.perf_counter()
+            state, captured = self.sample(controller)
+            captured["state"] = state
+            polls += 1
+            if last is None or not self.same(last, state):
+                stable_since = sampled_at
+            elif sampled_at - stable_since >= self.quiet:
+                return Settle(time.perf_counter() - start, polls, False, captured)
+            last = state
+            if time.perf_counter() - start >= self.timeout:
+                return Settle(time.perf_counter() - start, polls, True, captured)
+            time.sleep(self.interval)
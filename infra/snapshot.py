@@ -0,0 +1,132 @@
+from pathlib import Path
+from typing import List
+import argparse
+import socket
+import subprocess
+import time
+
+
+TOKEN_PATH = Path.home() / ".emulator_console_auth_token"
+GOLDEN = "sphinx_golden"
+
+
+class ConsoleError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+def console_port(serial: str) -> int:
+    """Console port of an emulator serial, emulator-5554 listens on 5554."""
+    name, _, port = serial.partition("-")
+    if name != "emulator" or not port.isdigit():
+        raise ValueError(f"{serial} is not an emulator serial like emulator-5554")
+    return int(port)
+
+
+class EmulatorConsole:
+    """Client of the emulator console, the telnet interface on the emulator's port.
+
+    Every command answers with some lines of output and then "OK", or with
+    "KO: <reason>" on failure.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1", token: str | None = None, timeout: float = 120.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("r", encoding="utf-8", newline="\n")
+        banner = self._read()
+        if "Authentication required" in banner:
+            if token is None:
+                token = TOKEN_PATH.read_text().strip() if TOKEN_PATH.exists() else ""
+            self.command(f"auth {token}")
+
+    def _read(self) -> str:
+        lines = []
+        while True:
+            line = self.reader.readline()
+            if line == "":
+                raise ConsoleError("the emulator console closed the connection")
+            line = line.rstrip("\r\n")
+            if line == "OK":
+                return "\n".join(lines)
+            if line.startswith("KO"):
+                raise ConsoleError(line[3:].strip() or "command failed")
+            lines.append(line)
+
+    def command(self, command: str) -> str:
+        self.sock.sendall(f"{command}\n".encode())
+        return self._read()
+
+    def snapshots(self) -> List[str]:
+        # a table of "ID TAG VM SIZE DATE VM CLOCK" rows, the ID of emulator snapshots is "--"
+        rows = [row.split() for row in self.command("avd snapshot list").splitlines()]
+        return [row[1] for row in rows if len(row) > 1 and (row[0] == "--" or row[0].isdigit())]
+
+    def save(self, name: str) -> None:
+        self.command(f"avd snapshot save {name}")
+
+    def load(self, name: str) -> None:
+        self.command(f"avd snapshot load {name}")
+
+    def delete(self, name: str) -> None:
+        self.command(f"avd snapshot delete {name}")
+
+    def close(self) -> None:
+        try:
+            self.sock.sendall(b"quit\n")
+        except OSError:
+            pass
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class SnapshotReset:
+    """Resets an emulator to a golden snapshot with every app installed and logged in.
+
+    Loading a snapshot takes a few seconds whatever the apps are, where the
+    reinstall and scripted login of AndroidEnv.login take minutes per task.
+    """
+
+    def __init__(self, serial: str, name: str = GOLDEN, host: str = "127.0.0.1", token: str | None = None):
+        self.serial = serial
+        self.name = name
+        self.host = host
+        self.token = token
+        self.port = console_port(serial)
+
+    def console(self) -> EmulatorConsole:
+        return EmulatorConsole(self.port, self.host, self.token)
+
+    def exists(self) -> bool:
+        with self.console() as console:
+            return self.name in console.snapshots()
+
+    def save(self) -> None:
+        with self.console() as console:
+            console.save(self.name)
+
+    def restore(self, wait: bool = True) -> float:
+        """Load the golden snapshot, returns the seconds it took."""
+        start = time.perf_counter()
+        with self.console() as console:
+            console.load(self.name)
+        if wait:
+            subprocess.run(["adb", "-s", self.serial, "wait-for-device"], check=True, timeout=60)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    from .android_env import AndroidEnv
+    parser = argparse.ArgumentParser(description="Build the golden snapshot: install and log in to apps, then save")
+    parser.add_argument("apps", nargs="+", help="app names as in apk-info.csv")
+    parser.add_argument("--port", type=str, default="emulator-5554", help="emulator serial")
+    parser.add_argument("--name", type=str, default=GOLDEN, help="snapshot name")
+    args = parser.parse_args()
+    AndroidEnv(port=args.port, snapshot=args.name).build_snapshot(args.apps)
+    print(f"{args.port}: saved snapshot {args.name} with {len(args.apps)} apps")
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+from .util import parse_bound
+from .intern import pool
+from typing import Deque, Dict, List, Tuple, Union
+from collections import deque
+from pathlib import Path
+import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+import argparse
+import struct
+import mmap
+import numpy as np
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+FLAG_ATTRIBS = ["checkable", "checked", "clickable", "focusable", "focused", "enabled",
+                "scrollable", "long-clickable", "password", "selected", "visible-to-user"]
+FLAG_BITS = {name: 1 << i for i, name in enumerate(FLAG_ATTRIBS)}
+
+# derived string columns, in the same form as the Element fields
+COL_RESOURCE_ID = 0
+COL_CLASS = 1
+COL_PACKAGE = 2
+COL_CONTENT_DESC = 3
+COL_TEXT = 4
+
+# binary format: header, then the string tables and arrays, each 8-byte aligned.
+# With FORMAT_ZSTD set, everything after the header is one zstd frame.
+SUFFIX = ".uih"
+MAGIC = b"UIH1"
+FORMAT_ZSTD = 1
+# magic, format flags, nodes, keys, strings, child rows, roots, string bytes, key bytes
+HEADER = struct.Struct("<4sIIIIIIQQ")
+
+
+class NodeStore:
+    """Columnar storage for the nodes of one UI hierarchy.
+
+    Row i is the i-th node in the same BFS order as UIHierarchy._nodes. Strings
+    are kept once in a string table and referenced by id, raw attributes are an
+    [N, K] matrix of string ids (-1 when the attribute is missing).
+    """
+
+    strings: List[str]
+    keys: List[str]
+    attribs: np.ndarray        # int32[N, K]
+    text_columns: np.ndarray   # int32[N, 5], see COL_*
+    bounds: np.ndarray         # int32[N, 4]
+    flags: np.ndarray          # uint16[N], see FLAG_BITS
+    index: np.ndarray          # int32[N]
+    depth: np.ndarray          # int32[N]
+    parent: np.ndarray         # int32[N], -1 for top-level nodes
+    child_offsets: np.ndarray  # int32[N + 1]
+    child_rows: np.ndarray     # int32[M]
+    roots: np.ndarray          # int32[R]
+
+    def __init__(self):
+        self.strings = []
+        self._string_ids: Dict[str, int] = {}
+        self.keys = []
+        self._key_ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def intern(self, s: str) -> int:
+        sid = self._string_ids.get(s)
+        if sid is None:
+            sid = self._string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return sid
+
+    def key_id(self, key: str) -> int:
+        kid = self._key_ids.get(key)
+        if kid is None:
+            kid = self._key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return kid
+
+    def string(self, sid: int) -> str:
+        return self.strings[sid]
+
+    def text(self, row: int, col: int) -> str:
+        return self.strings[self.text_columns[row, col]]
+
+    def has_flag(self, row: int, name: str) -> bool:
+        return bool(self.flags[row] & FLAG_BITS[name])
+
+    def attrib(self, row: int) -> Dict[str, str]:
+        return {key: self.strings[sid] for key, sid in zip(self.keys, self.attribs[row].tolist()) if sid >= 0}
+
+    def children(self, row: int) -> np.ndarray:
+        return self.child_rows[self.child_offsets[row]:self.child_offsets[row + 1]]
+
+    def interactable_mask(self) -> np.ndarray:
+        # vectorized Element.is_interactable
+        flags = self.flags
+        edit = self.text_columns[:, COL_CLASS] == self._string_ids.get(
+            "android.widget.EditText", -1)
+        acting = flags & (FLAG_BITS["clickable"] | FLAG_BITS["checkable"] |
+                          FLAG_BITS["long-clickable"] | FLAG_BITS["scrollable"])
+        visible = (flags & FLAG_BITS["visible-to-user"]) != 0
+        return visible & (edit | (acting != 0))
+
+    def match_mask(self, match_rule: Dict[str, str], match_type: str = "equal") -> np.ndarray:
+        if match_type not in ["equal", "include"]:
+            raise ValueError("match_type should be 'equal' or 'include'")
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in match_rule.items():
+            kid = self._key_ids.get(key)
+            if kid is None:
+                return np.zeros(len(self), dtype=bool)
+            column = self.attribs[:, kid]
+            if match_type == "equal":
+                mask &= column == self._string_ids.get(value, -2)
+            else:
+                # substring search runs over the (small) string table only
+                sids = [sid for sid, s in enumerate(self.strings) if value in s]
+                mask &= np.isin(column, sids)
+        return mask
+
+    def point_mask(self, point: Tuple[int, int]) -> np.ndarray:
+        x, y = point
+        b = self.bounds
+        return (b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3])
+
+    def _arrays(self) -> List[Tuple[str, type]]:
+        return [("attribs", np.int32), ("text_columns", np.int32), ("bounds", np.int32),
+                ("flags", np.uint16), ("index", np.int32), ("depth", np.int32), ("parent", np.int32),
+                ("child_offsets", np.int32), ("child_rows", np.int32), ("roots", np.int32)]
+
+    def to_bytes(self, compress: bool = False) -> bytes:
+        strings = [s.encode("utf-8") for s in self.strings]
+        keys = [k.encode("utf-8") for k in self.keys]
+        string_blob, key_blob = b"".join(strings), b"".join(keys)
+        parts = [np.cumsum([0] + [len(s) for s in strings], dtype=np.int64).tobytes(), string_blob,
+                 np.cumsum([0] + [len(k) for k in keys], dtype=np.int64).tobytes(), key_blob]
+        parts += [np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes()
+                  for name, dtype in self._arrays()]
+        body = b"".join(part + b"\0" * (-len(part) % 8) for part in parts)
+        flags = 0
+        if compress:
+            if zstd is None:
+                raise ValueError("compress=True needs the zstandard package")
+            body, flags = zstd.ZstdCompressor().compress(body), FORMAT_ZSTD
+        header = HEADER.pack(MAGIC, flags, len(self), len(self.keys), len(self.strings),
+                             len(self.child_rows), len(self.roots), len(string_blob), len(key_blob))
+        return header + body
+
+    @classmethod
+    def from_buffer(cls, buffer: Union[bytes, mmap.mmap]) -> NodeStore:
+        """Load a store from to_bytes() output. Arrays are views into the buffer, not copies."""
+        magic, flags, n, k, s, m, r, string_bytes, key_bytes = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("not a binary UI hierarchy")
+        body: Union[bytes, mmap.mmap, memoryview] = memoryview(buffer)[HEADER.size:]
+        if flags & FORMAT_ZSTD:
+            if zstd is None:
+                raise ValueError("reading a compressed hierarchy needs the zstandard package")
+            body = zstd.ZstdDecompressor().decompress(body)
+        offset = 0
+
+        def take(dtype, count: int) -> np.ndarray:
+            nonlocal offset
+            array = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes + (-array.nbytes % 8)
+            return array
+
+        def take_strings(count: int, size: int) -> List[str]:
+            nonlocal offset
+            ends = take(np.int64, count + 1).tolist()
+            blob = bytes(body[offset:offset + size])
+            offset += size + (-size % 8)
+            return [blob[ends[i]:ends[i + 1]].decode("utf-8") for i in range(count)]
+
+        store = cls()
+        store.strings = take_strings(s, string_bytes)
+        store.keys = take_strings(k, key_bytes)
+        counts = {"attribs": n * k, "text_columns": n * 5, "bounds": n * 4, "child_offsets": n + 1,
+                  "child_rows": m, "roots": r}
+        for name, dtype in store._arrays():
+            setattr(store, name, take(dtype, counts.get(name, n)))
+        store.attribs = store.attribs.reshape(n, k)
+        store.text_columns = store.text_columns.reshape(n, 5)
+        store.bounds = store.bounds.reshape(n, 4)
+
+        # share the strings with other hierarchies, except free-form texts
+        texts = set(store.text_columns[:, [COL_CONTENT_DESC, COL_TEXT]].ravel().tolist())
+        store.strings = [string if sid in texts else pool(string) for sid, string in enumerate(store.strings)]
+        store.keys = [pool(key) for key in store.keys]
+        store._key_ids = {key: kid for kid, key in enumerate(store.keys)}
+        store._string_ids = {string: sid for sid, string in enumerate(store.strings)}
+        return store
+
+    def save(self, path: Union[str, Path], compress: bool = False) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes(compress))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> NodeStore:
+        """Load a saved store through mmap, without any XML parsing."""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.from_buffer(buffer)
+
+    @classmethod
+    def from_string(cls, data: Union[str, bytes]) -> NodeStore:
+        builder = _NodeStoreBuilder(cls())
+        parents: List[int] = []
+        skipped = 0
+
+        def start(tag: str, attrib: Dict[str, str]):
+            nonlocal skipped
+            if skipped > 0:
+                skipped += 1
+                return
+            depth = len(parents)
+            if depth == 0:
+                parents.append(-1)
+                return
+            if depth == 1 and attrib.get("package") == "com.android.systemui":
+                skipped = 1
+                return
+            parents.append(builder.add(attrib, parents[-1], depth))
+
+        def end(tag: str):
+            nonlocal skipped
+            if skipped > 0:
+                skipped -= 1
+                return
+            parents.pop()
+
+        parser = expat.ParserCreate(intern=pool.table)
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.Parse(data, True)
+        return builder.finish()
+
+    @classmethod
+    def from_element(cls, root: ET.Element) -> NodeStore:
+        builder = _NodeStoreBuilder(cls())
+
+        def add(elem: ET.Element, parent: int, depth: int):
+            row = builder.add(elem.attrib, parent, depth)
+            for ch in elem:
+                add(ch, row, depth + 1)
+        for ch in root:
+            if ch.attrib.get("package") != "com.android.systemui":
+                add(ch, -1, 1)
+        return builder.finish()
+
+
+class _NodeStoreBuilder:
+    # collects rows in document order, finish() reorders them into BFS order
+
+    def __init__(self, store: NodeStore):
+        self.store = store
+        self.parent: List[int] = []
+        self.depth: List[int] = []
+        self.index: List[int] = []
+        self.flags: List[int] = []
+        self.bounds: List[Tuple[int, int, int, int]] = []
+        self.text_columns: List[Tuple[int, int, int, int, int]] = []
+        self.attrib_rows: List[int] = []
+        self.attrib_keys: List[int] = []
+        self.attrib_values: List[int] = []
+
+    def add(self, attrib: Dict[str, str], parent: int, depth: int) -> int:
+        store = self.store
+        row = len(self.parent)
+        get = pool.attrib(attrib).get
+        self.parent.append(parent)
+        self.depth.append(depth)
+        self.index.append(int(get('index', '')))
+        flags = 0
+        for name, bit in FLAG_BITS.items():
+            if get(name, 'true' if name == 'visible-to-user' else '') == 'true':
+                flags |= bit
+        self.flags.append(flags)
+        self.bounds.append(parse_bound(get('bounds', '')))
+        self.text_columns.append((
+            store.intern(pool(get('resource-id', '').split('/')[-1].strip())),
+            store.intern(pool(get('class', '').strip())),
+            store.intern(pool(get('package', '').strip())),
+            store.intern(get('content-desc', '').strip()),
+            store.intern(get('text', '').strip())))
+        for key, value in attrib.items():
+            self.attrib_rows.append(row)
+            self.attrib_keys.append(store.key_id(key))
+            self.attrib_values.append(store.intern(value))
+        return row
+
+    def finish(self) -> NodeStore:
+        store = self.store
+        n = len(self.parent)
+        children: List[List[int]] = [[] for _ in range(n)]
+        roots = []
+        for row, parent in enumerate(self.parent):
+            if parent < 0:
+                roots.append(row)
+            else:
+                children[parent].append(row)
+
+        # same BFS order as UIHierarchy._build_from_element
+        order: List[int] = []
+        for root in roots:
+            q: Deque[int] = deque([root])
+            while len(q) > 0:
+                row = q.popleft()
+                order.append(row)
+                q.extend(children[row])
+        perm = np.array(order, dtype=np.int64)
+        inverse = np.empty(n, dtype=np.int32)
+        inverse[perm] = np.arange(n, dtype=np.int32)
+
+        parent = np.array(self.parent, dtype=np.int32)[perm]
+        store.parent = np.where(parent >= 0, inverse[parent], -1).astype(np.int32)
+        store.depth = np.array(self.depth, dtype=np.int32)[perm]
+        store.index = np.array(self.index, dtype=np.int32)[perm]
+        store.flags = np.array(self.flags, dtype=np.uint16)[perm]
+        store.bounds = np.array(self.bounds, dtype=np.int32).reshape(n, 4)[perm]
+        store.text_columns = np.array(
+            self.text_columns, dtype=np.int32).reshape(n, 5)[perm]
+        attribs = np.full((n, len(store.keys)), -1, dtype=np.int32)
+        attribs[inverse[self.attrib_rows], self.attrib_keys] = self.attrib_values
+        store.attribs = attribs
+
+        counts = np.array([len(children[row]) for row in order], dtype=np.int32)
+        store.child_offsets = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(counts, out=store.child_offsets[1:])
+        store.child_rows = inverse[[ch for row in order for ch in children[row]]] \
+            if n > 0 else np.zeros(0, dtype=np.int32)
+        store.roots = inverse[roots] if n > 0 else np.zeros(0, dtype=np.int32)
+        return store
+
+
+def convert(root: Union[str, Path], compress: bool = False, replace: bool = False) -> int:
+    """Write a binary copy next to every hierarchy XML under root. Returns the number written."""
+    count = 0
+    for xml_path in sorted(Path(root).rglob("*.xml")):
+        if not xml_path.stem.isdigit():
+            continue
+        bin_path = xml_path.with_suffix(SUFFIX)
+        if not bin_path.exists() or bin_path.stat().st_mtime < xml_path.stat().st_mtime:
+            NodeStore.from_string(xml_path.read_bytes()).save(bin_path, compress)
+            count += 1
+        if replace:
+            xml_path.unlink()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert hierarchy XMLs of traces to the binary format")
+    parser.add_argument("roots", nargs="+", help="trace directories, e.g. trace groundtruth")
+    parser.add_argument("--compress", action="store_true", help="zstd-compress the files")
+    parser.add_argument("--replace", action="store_true", help="delete the XMLs after converting")
+    args = parser.parse_args()
+    for root in args.roots:
+        print(f"{root}: {convert(root, args.compress, args.replace)} converted")
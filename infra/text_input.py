@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Deque, NamedTuple
+from collections import deque
+from adbutils import AdbError
+from uiautomator2.exceptions import DeviceError, RPCError
+import base64
+import time
+
+if TYPE_CHECKING:
+    from .controller import AndroidController
+
+
+KEYCODE_A = 29
+KEYCODE_DEL = 67
+KEYCODE_PASTE = 279
+META_CTRL_ON = 0x1000
+# broadcast result of the keyboard when it handled the text
+BROADCAST_OK = "result=-1"
+# what a failing shell or rpc call raises
+INPUT_ERRORS = (AdbError, DeviceError, RPCError)
+# secure setting whether input methods show their input view next to a hardware keyboard
+SHOW_WITH_HARD_KEYBOARD = "show_ime_with_hard_keyboard"
+
+
+class InputTiming(NamedTuple):
+    method: str  # broadcast, or clipboard when the keyboard did not answer
+    chars: int
+    ok: bool
+    seconds: float
+
+
+class TextInput:
+    """Types text through the uiautomator2 keyboard.
+
+    Typing is a broadcast of base64 text that the keyboard commits into the
+    focused field, which works for any Unicode string. If the keyboard does
+    not acknowledge it, the keyboard is selected again once, and then the
+    text is pasted through the clipboard.
+
+    The keyboard is selected once per task, by select() in AndroidEnv.reset,
+    and the null keyboard is given back by release() in AndroidEnv.close, so
+    inputs switch no input method. So that the selected keyboard draws no
+    input view over the app, which would show in screenshots and move widget
+    bounds, select() turns off show_ime_with_hard_keyboard: input methods
+    show no input view while the device has a hardware keyboard, as the
+    emulators do. release() puts the setting back.
+    """
+
+    def __init__(self, controller: AndroidController):
+        self.controller = controller
+        self.selected = False
+        # show_ime_with_hard_keyboard before select(), "null" when it was unset
+        self.show_with_hard_keyboard: str | None = None
+        self.timings: Deque[InputTiming] = deque(maxlen=1024)
+
+    def select(self) -> None:
+        ime = self.controller.adb_ime
+        responses = self.controller.batch("select_ime") \
+            .add(f"settings get secure {SHOW_WITH_HARD_KEYBOARD}") \
+            .add(f"settings put secure {SHOW_WITH_HARD_KEYBOARD} 0") \
+            .add(f"ime enable {ime}").add(f"ime set {ime}").run()
+        if self.show_with_hard_keyboard is None and len(responses) > 0:
+            # selected again after another input method took over, the setting is ours by now
+            self.show_with_hard_keyboard = responses[0].output.strip()
+        self.selected = True
+
+    def release(self) -> None:
+        """Give the device back to the null keyboard."""
+        ime = self.controller.null_ime
+        batch = self.controller.batch("release_ime").add(f"ime enable {ime}").add(f"ime set {ime}")
+        if self.show_with_hard_keyboard in [None, "", "null"]:
+            batch.add(f"settings delete secure {SHOW_WITH_HARD_KEYBOARD}")
+        else:
+            batch.add(f"settings put secure {SHOW_WITH_HARD_KEYBOARD} {self.show_with_hard_keyboard}")
+        batch.run()
+        self.selected = False
+        self.show_with_hard_keyboard = None
+
+    def _broadcast(self, action: str, text: str | None = None) -> bool:
+        if not self.selected:
+            self.select()
+        command = f"am broadcast -a {action}"
+        if text is not None:
+            command += f" --es text {base64.b64encode(text.encode('utf-8')).decode()}"
+        return BROADCAST_OK in self.controller.shell(command, label="text").output
+
+    def _paste(self, text: str) -> bool:
+        self.controller.rpc("setClipboard", None, text)
+        return bool(self.controller.rpc("pressKeyCode", KEYCODE_PASTE))
+
+    def clear(self) -> bool:
+        """Empty the focused field."""
+        if self._broadcast("ADB_KEYBOARD_CLEAR_TEXT"):
+            return True
+        # select all and delete, for fields the keyboard is not attached to
+        self.controller.rpc("pressKeyCode", KEYCODE_A, META_CTRL_ON)
+        return bool(self.controller.rpc("pressKeyCode", KEYCODE_DEL))
+
+    def type(self, text: str, clear: bool = True) -> bool:
+        """Type text into the focused field, replacing its content if clear.
+
+        Raises one of INPUT_ERRORS if the device fails, after recording the
+        attempt as a failed timing.
+        """
+        start = time.perf_counter()
+        action = "ADB_KEYBOARD_SET_TEXT" if clear else "ADB_KEYBOARD_INPUT_TEXT"
+        method = "broadcast"
+        try:
+            ok = self._broadcast(action, text)
+            if not ok:
+                # another input method took over, e.g. after the app restarted
+                self.selected = False
+                ok = self._broadcast(action, text)
+            if not ok:
+                method = "clipboard"
+                if clear:
+                    self.clear()
+                ok = self._paste(text)
+        except INPUT_ERRORS:
+            self.timings.append(InputTiming(method, len(text), False, time.perf_counter() - start))
+            raise
+        self.timings.append(InputTiming(method, len(text), ok, time.perf_counter() - start))
+        return ok
@@ -42,9 +42,12 @@ def cloneable(init):
         #        == clazz.__module__ + '.' + clazz.__name__:
         if issubclass(_from.__class__, clazz):
             #print("YAY")
-            for k,v in deepcopy(_from).__dict__.items():
+            # classes may provide a cheaper _clone_state() instead of a deepcopy
+            clone_state = getattr(_from, '_clone_state', None)
+            state = clone_state() if clone_state is not None else deepcopy(_from).__dict__
+            for k,v in state.items():
                 setattr(self, k, v)
-            return self
+            return None
         else:
             return init(self, _from, *args, **kwds)
     return wrapper
@@ -2,7 +2,7 @@ import json
 import time
 import random
 from pathlib import Path
-import subprocess
+import traceback
 import multiprocessing
 
 
@@ -37,39 +37,46 @@ def get_modality_and_action_mode(observation_mode):
     return modality, action_mode
 
 
-class Device:
+def run_worker(port: str, tasks: multiprocessing.Queue, total: int):
+    """Run benchmark tasks from a queue in this process until it yields None.
 
-    def __init__(self, port: str, task_list):
-        self.port = port
-        self.tasks = task_list
+    Unlike a `python run_benchmark.py` per task, the worker imports the agents and
+    LLM SDKs once, keeps the uiautomator2 connection of its emulator and reuses
+    LLM clients. Every task still gets its own AndroidEnv, agent, log and token
+    count, and an error in one task does not stop the next.
+    """
+    from run_benchmark import benchmark_run, skill_extract_from_gt
+    from infra import AndroidController
 
-    def run(self):
-        time_to_sleep = (int(self.port[9:]) - 5554) / 2
-        time.sleep(time_to_sleep)
-        random.shuffle(self.tasks)
-        for i, task in enumerate(self.tasks):
-            id = task["id"]
-            app = task["app"]
-            observation_mode = task["observation_mode"]
-            llm = task["llm"]
-            tell_skill = task["tell_skill"]
-            modality, action_mode = get_modality_and_action_mode(
-                observation_mode)
-            trace_dir = Path("./trace") / llm / \
-                (observation_mode+("_skill" if tell_skill else ""))
-            print("=" * 20, self.port, "running", str(i)+"-th", "of", len(self.tasks), "tasks", "=" * 20, "\n",
-                  "Running task", task["id"], "on app", task["app"], "with llm",
-                  task["llm"], "and observation mode", task["observation_mode"], "\n",
-                  "Save to dir:", trace_dir / str(task["id"]) / task["app"])
-            cmdline = ["python", "run_benchmark.py", "--id", str(id), "--app", app, "--modality", modality, "--llm", llm, "--port",
-                       self.port, "--observation_mode", observation_mode, "--action_mode", action_mode, "--trace_dir", trace_dir]
-            if tell_skill:
-                cmdline.append("--tell_skill")
-            subprocess.run(cmdline)
-
-
-def run_device(device: Device):
-    device.run()
+    time_to_sleep = (int(port[9:]) - 5554) / 2
+    time.sleep(time_to_sleep)
+    controller = None
+    i = 0
+    while (task := tasks.get()) is not None:
+        id = task["id"]
+        app = task["app"]
+        observation_mode = task["observation_mode"]
+        llm = task["llm"]
+        tell_skill = task["tell_skill"]
+        modality, action_mode = get_modality_and_action_mode(
+            observation_mode)
+        trace_dir = Path("./trace") / llm / \
+            (observation_mode+("_skill" if tell_skill else ""))
+        print("=" * 20, port, "running", str(i)+"-th", "of", total, "tasks", "=" * 20, "\n",
+              "Running task", task["id"], "on app", task["app"], "with llm",
+              task["llm"], "and observation mode", task["observation_mode"], "\n",
+              "Save to dir:", trace_dir / str(task["id"]) / task["app"])
+        i += 1
+        try:
+            if controller is None:
+                controller = AndroidController(port, None)
+            benchmark_run(id, app, "ReAct", modality, llm, port, observation_mode, action_mode, to_print=False,
+                          trace_dir=trace_dir, use_skill=skill_extract_from_gt(id, app) if tell_skill else "",
+                          controller=controller)
+        except Exception:
+            traceback.print_exc()
+            # reconnect for the next task, the device may be what failed
+            controller = None
 
 
 if __name__ == "__main__":
@@ -227,7 +234,16 @@ if __name__ == "__main__":
     split_tasks = split_tasks(tasks, len(devices))
     print(split_tasks)
     print([len(x) for x in split_tasks])
-    devices = [Device(x, y) for x, y in zip(devices, split_tasks)]
-
-    with multiprocessing.Pool(processes=len(devices)) as pool:
-        pool.map(run_device, devices)
+    # one long-lived worker process per emulator, fed through its own queue
+    workers = []
+    for port, device_tasks in zip(devices, split_tasks):
+        queue = multiprocessing.Queue()
+        random.shuffle(device_tasks)
+        for task in device_tasks:
+            queue.put(task)
+        queue.put(None)
+        worker = multiprocessing.Process(target=run_worker, args=(port, queue, len(device_tasks)))
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
@@ -5,6 +5,7 @@ import re
 import argparse
 import json
 import traceback
+import contextlib
 from pathlib import Path
 
 from Agents.GetAgent import get_agent
@@ -18,42 +19,30 @@ useless_observations = ['OK.', 'You have clicked']
 total_token_usage = {'input': 0, 'output': 0, 'total': 0}
 
 
-def benchmark_run(idx, app, agent_name, modality, llm_name, port, observation_mode, action_mode, to_print=True, trace_dir=Path("./trace"), output_to_log=True, catch=True, reinstall=True, use_skill=""):
+def benchmark_run(idx, app, agent_name, modality, llm_name, port, observation_mode, action_mode, to_print=True, trace_dir=Path("./trace"), output_to_log=True, catch=True, reinstall=True, use_skill="", token_budget=None, list_keep=None, capture_profile="mode-only", screenshot_encoding="png", annotated_encoding="png", snapshot=None, login_cache=True, controller=None, input_backend="rpc"):
+    # controller: a connected AndroidController of the port to reuse, see run_all.run_worker
     global total_token_usage
+    # the usage of this task only, also when a worker runs many tasks in one process
+    total_token_usage = {'input': 0, 'output': 0, 'total': 0}
     # env init
     env = AndroidEnv(port=port, observation_mode=observation_mode,
-                     action_mode=action_mode, trace_dir=trace_dir, reinstall=reinstall)
-    observation = env.reset(idx, app)
-    instruction = env.get_instruction()
-    log_path = env.trace_path / "log.txt"
-    # print(output_to_log)
-    with open(log_path, 'w', encoding="utf-8") as f:
-        stdout = sys.stdout
-        if output_to_log:
-            sys.stdout = f
-        print(f"Observation: {observation}\n")
-
-        agent = get_agent(agent_name, modality, llm_name,
-                          instruction=instruction, use_skill=use_skill)
-        if not catch:
-            print("do not catch exception")
-            for _ in range(env.max_steps):
-                action = agent.act(observation)
-                res = env.step(action)
-                last_action_desc = get_description(
-                    env.actions[-1]) if action_mode == "id" else action
-                agent.update_history(last_action_desc)
-                observation = res[0]
-
-                if to_print:
-                    print(f'Observation: {observation}')
-                    sys.stdout.flush()
-
-                if res[2]:
-                    break
-        else:
-            print("catch exception")
-            try:
+                     action_mode=action_mode, trace_dir=trace_dir, reinstall=reinstall, token_budget=token_budget, list_keep=list_keep, capture_profile=capture_profile,
+                     screenshot_encoding=screenshot_encoding, annotated_encoding=annotated_encoding, snapshot=snapshot, login_cache=login_cache,
+                     controller=controller, input_backend=input_backend)
+    # the env is closed however the task ends, a worker runs the next task on the same device
+    try:
+        observation = env.reset(idx, app)
+        instruction = env.get_instruction()
+        log_path = env.trace_path / "log.txt"
+        # print(output_to_log)
+        # stdout goes back to the console even if the task raises
+        with open(log_path, 'w', encoding="utf-8") as f, contextlib.redirect_stdout(f if output_to_log else sys.stdout):
+            print(f"Observation: {observation}\n")
+
+            agent = get_agent(agent_name, modality, llm_name,
+                              instruction=instruction, use_skill=use_skill)
+            if not catch:
+                print("do not catch exception")
                 for _ in range(env.max_steps):
                     action = agent.act(observation)
                     res = env.step(action)
@@ -68,28 +57,45 @@ def benchmark_run(idx, app, agent_name, modality, llm_name, port, observation_mo
 
                     if res[2]:
                         break
-            except Exception as e:
-                tb_str = traceback.format_exc()
-                env.dump_meta(0, type(e).__name__ + ": " +
-                              str(e) + "\n\n" + tb_str)
-
-        total_token_usage['input'] += agent.token_usage['input']
-        total_token_usage['output'] += agent.token_usage['output']
-        total_token_usage['total'] += agent.token_usage['total']
-        print("Total Token Usage: ")
-        print(
-            f"input: {total_token_usage['input']}, output: {total_token_usage['output']}, total: {total_token_usage['total']}")
-
-        token_path = env.trace_path / "token_usage.json"
-        env.controller.device.app_stop_all()
-        if reinstall:
-            env.controller.device.app_uninstall_all(
-                excludes=["com.wparam.nullkeyboard"])
+            else:
+                print("catch exception")
+                try:
+                    for _ in range(env.max_steps):
+                        action = agent.act(observation)
+                        res = env.step(action)
+                        last_action_desc = get_description(
+                            env.actions[-1]) if action_mode == "id" else action
+                        agent.update_history(last_action_desc)
+                        observation = res[0]
+
+                        if to_print:
+                            print(f'Observation: {observation}')
+                            sys.stdout.flush()
+
+                        if res[2]:
+                            break
+                except Exception as e:
+                    tb_str = traceback.format_exc()
+                    env.dump_meta(0, type(e).__name__ + ": " +
+                                  str(e) + "\n\n" + tb_str)
+
+            total_token_usage['input'] += agent.token_usage['input']
+            total_token_usage['output'] += agent.token_usage['output']
+            total_token_usage['total'] += agent.token_usage['total']
+            print("Total Token Usage: ")
+            print(
+                f"input: {total_token_usage['input']}, output: {total_token_usage['output']}, total: {total_token_usage['total']}")
+
+            token_path = env.trace_path / "token_usage.json"
+            with open(token_path, 'w') as f:
+                json.dump(agent.token_usage, f)
+            env.controller.device.app_stop_all()
+            # the next task restores the snapshot, which drops whatever this one installed
+            if reinstall and snapshot is None:
+                env.controller.device.app_uninstall_all(
+                    excludes=["com.wparam.nullkeyboard"])
+    finally:
         env.close()
-        with open(token_path, 'w') as f:
-            json.dump(agent.token_usage, f)
-        sys.stdout = stdout
-
     return 0
 
 
@@ -129,9 +135,27 @@ if __name__ == "__main__":
                         action="store_false", help='not catch exception')
     parser.add_argument('--notreinstall', dest="reinstall",
                         action="store_false", help="not reinstall but stop and start directly")
+    parser.add_argument('--token_budget', type=int,
+                        default=None, help='approximate token limit of text and tree observations')
+    parser.add_argument('--list_keep', type=int,
+                        default=None, help='rows kept at each end of long lists of similar rows in tree observations')
+    parser.add_argument('--capture_profile', type=str, default="mode-only",
+                        choices=["minimal", "mode-only", "full-archive"], help='trace artifacts kept per step')
+    parser.add_argument('--screenshot_encoding', type=str, default="png",
+                        help='format[:quality][@scale] of the raw screenshots, e.g. png, png:6, webp:80, jpeg:90@0.5; '
+                        'the screenshots the observation mode reads cannot be scaled')
+    parser.add_argument('--annotated_encoding', type=str, default="png",
+                        help='format[:quality][@scale] of the annotated screenshots')
+    parser.add_argument('--snapshot', type=str, default=None,
+                        help='golden emulator snapshot restored before the task instead of reinstalling the app')
+    parser.add_argument('--no_login_cache', dest="login_cache", action="store_false",
+                        help='always replay the login script instead of restoring the cached logged-in app data')
+    parser.add_argument('--input_backend', type=str, default="rpc", choices=["rpc", "shell"],
+                        help='inject gestures through the uiautomator2 server or with `adb shell input`')
 
     args = parser.parse_args()
     benchmark_run(args.id, args.app, args.agent, args.modality, args.llm, args.port, args.observation_mode,
                   args.action_mode, args.to_print, Path(
                       args.trace_dir), args.log, args.catch, args.reinstall,
-                  skill_extract_from_gt(args.id, args.app) if args.tell_skill else "")
+                  skill_extract_from_gt(args.id, args.app) if args.tell_skill else "", args.token_budget, args.list_keep, args.capture_profile,
+                  args.screenshot_encoding, args.annotated_encoding, args.snapshot, args.login_cache, None, args.input_backend)
@@ -1,7 +1,8 @@
 import json
 from Agents.utils import get_llm
 from pathlib import Path
-from infra import UIHierarchy, Element
+from infra import UIHierarchy, Element, load_hierarchy
+from infra.capture import screenshot_path
 import xml.etree.ElementTree as ET
 import cv2
 from LLMs import vlm_base, qwen_vl_max, qwen_vl_max_latest
@@ -141,9 +142,8 @@ def test_complete_testcase(id, app, llm, instruction, trace_dir, mode, observati
         hierarchies = []
         image_paths = []
         for i in range(len(actions)):
-            with open(gt_path / f"{i}.xml", encoding="utf-8") as f:
-                hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
-            image_paths.append(gt_path / f"{i}.png")
+            hierarchies.append(load_hierarchy(gt_path / f"{i}.xml"))
+            image_paths.append(screenshot_path(gt_path, i))
         result = []
         for i in range(len(actions)):
             gt = (i == len(actions) - 1)
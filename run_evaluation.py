@@ -1,4 +1,4 @@
-from infra import AndroidController, UIHierarchy, Element, center, parse_bound, MainEvaluator
+from infra import AndroidController, UIHierarchy, load_hierarchy, Element, center, parse_bound, MainEvaluator
 from infra import ActionType, Action, click_action, longclick_action, text_action, swipe_action, enter_action, back_action, stop_action, none_action, restart_action
 from config import apk_info
 from pathlib import Path
@@ -46,13 +46,11 @@ def evaluate(trace_dir: Path, evaluator_path: Path):
     activities = list(map(tuple, activities))
     hierarchies = []
     for i in range(len(actions)):
-        with open(trace_dir / f"{i}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{i}.xml"))
     actions = list(map(TranslateToAction, actions))
     if len(actions) == len(activities) - 1:
         actions.append(stop_action())
-        with open(trace_dir / f"{len(actions) - 1}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{len(actions) - 1}.xml"))
     if len(actions) != len(activities) or len(actions) != len(hierarchies):
         raise ValueError("Invalid trace.")
     result = evaluator.evaluate(hierarchies, actions, activities)
@@ -67,13 +65,11 @@ def evaluate_acp(trace_dir: Path, evaluator_path: Path):
     activities = list(map(tuple, activities))
     hierarchies = []
     for i in range(len(actions)):
-        with open(trace_dir / f"{i}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{i}.xml"))
     actions = list(map(TranslateToAction, actions))
     if len(actions) == len(activities) - 1:
         actions.append(stop_action())
-        with open(trace_dir / f"{len(actions) - 1}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{len(actions) - 1}.xml"))
     if len(actions) != len(activities) or len(actions) != len(hierarchies):
         raise ValueError("Invalid trace.")
     with open(evaluator_path, "r", encoding="utf-8") as f:
@@ -1,4 +1,4 @@
-from infra import AndroidController, UIHierarchy, Element, center, parse_bound, MainEvaluator
+from infra import AndroidController, UIHierarchy, load_hierarchy, Element, center, parse_bound, MainEvaluator
 from infra import ActionType, Action, click_action, longclick_action, text_action, swipe_action, enter_action, back_action, stop_action, none_action, restart_action
 from config import apk_info
 from pathlib import Path
@@ -45,14 +45,12 @@ def evaluate(trace_dir: Path, evaluator_path: Path):
         activities = json.load(f)
     hierarchies = []
     for i in range(len(actions)):
-        with open(trace_dir / f"{i+1}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{i+1}.xml"))
     actions = list(map(TranslateToAction, actions))
     if len(actions) == 0 or actions[-1] != stop_action():
         actions.append(stop_action())
     if len(hierarchies) == len(actions) - 1:
-        with open(trace_dir / f"{len(actions)}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{len(actions)}.xml"))
     activities = activities[0: len(actions)]
     activities = list(map(tuple, activities))
     if len(activities) == len(actions) - 1:
@@ -75,14 +73,12 @@ def evaluate_acp(trace_dir: Path, evaluator_path: Path):
         activities = json.load(f)
     hierarchies = []
     for i in range(len(actions)):
-        with open(trace_dir / f"{i+1}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{i+1}.xml"))
     actions = list(map(TranslateToAction, actions))
     if len(actions) == 0 or actions[-1] != stop_action():
         actions.append(stop_action())
     if len(hierarchies) == len(actions) - 1:
-        with open(trace_dir / f"{len(actions)}.xml", "r", encoding="utf-8") as f:
-            hierarchies.append(UIHierarchy(ET.fromstring(f.read())))
+        hierarchies.append(load_hierarchy(trace_dir / f"{len(actions)}.xml"))
     activities = activities[0: len(actions)]
     activities = list(map(tuple, activities))
     if len(activities) == len(actions) - 1:
@@ -1,7 +1,7 @@
 import json
 from Agents.utils import get_llm
 from pathlib import Path
-from infra import UIHierarchy, Element
+from infra import UIHierarchy, Element, load_hierarchy
 import xml.etree.ElementTree as ET
 import cv2
 from LLMs import vlm_base, qwen_vl_max, qwen_vl_max_latest
@@ -175,8 +175,7 @@ To be successful, it is very important to follow the following rules:
 
 '''
     hierarchy_path = Path("lowlevel_tasks") / f"{id}.xml"
-    with open(hierarchy_path, "r", encoding="utf-8") as f:
-        hierarchy = UIHierarchy(ET.fromstring(f.read()))
+    hierarchy = load_hierarchy(hierarchy_path)
     if observation_mode == "tree":
         user_prompt += f"Observation: {hierarchy.dump_widget_tree()}\n"
         user_prompt += f"Task: {instruction}\n"
@@ -0,0 +1,29 @@
+"""Outputs of the baseline UIHierarchy on the groundtruth dumps.
+
+data/hierarchy_baseline.json.gz maps every groundtruth XML to what the
+UIHierarchy of the first commit produced for it, built from an ElementTree:
+str(), dump_widget_tree(), the numbered widget list of the text observation,
+the events, and find_element results for rules drawn from the dump itself.
+The optimized builders, stores and indexes must reproduce all of it.
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+import gzip
+import json
+
+DATA = Path(__file__).resolve().parent / "data" / "hierarchy_baseline.json.gz"
+
+
+@lru_cache(maxsize=1)
+def baseline() -> Dict[str, Dict[str, Any]]:
+    with gzip.open(DATA, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+XML_FILES = sorted(baseline())
+
+
+def read_xml(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
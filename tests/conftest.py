@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# infra reads apk-info.csv and task_info.json relative to the repository root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
@@ -0,0 +1,96 @@
+"""A stand-in for the uiautomator2 device of an AndroidController."""
+import base64
+import io
+import subprocess
+from typing import Callable, List, Tuple
+
+import numpy as np
+from PIL import Image
+from uiautomator2.abstract import ShellResponse
+
+import infra.controller
+
+
+# runs `su 0 sh -c '...'` of a root_shell as the script itself
+SU = 'su() { shift; "$@"; }; '
+
+
+class FakeRPC:
+    def __init__(self, device: "FakeDevice"):
+        self.device = device
+
+    def __getattr__(self, method: str) -> Callable:
+        def call(*args):
+            self.device.calls.append((f"rpc.{method}", args))
+            result = self.device.rpc_results.get(method, True)
+            if isinstance(result, Exception):
+                raise result
+            return result(*args) if callable(result) else result
+        return call
+
+
+class FakeDevice:
+    """Records the shell commands and rpc calls it gets.
+
+    The screen shows the hierarchy dump `hierarchy`, the image `frame` and
+    the focused window `focus`, a "package/activity" that `dumpsys window`
+    reports.
+
+    Shell commands run in the local sh when local_shell, after prelude, which
+    can define functions standing in for device commands; otherwise respond()
+    answers them. rpc_results maps a method to its result, a function of the
+    arguments, or an exception to raise.
+    """
+
+    def __init__(self, local_shell: bool = False, respond: Callable[[str], ShellResponse] | None = None,
+                 prelude: str = ""):
+        self.device_info = {}
+        self.local_shell = local_shell
+        self.prelude = prelude
+        self.respond = respond or self._respond
+        self.rpc_results = {"takeScreenshot": self._thumbnail}
+        self.calls: List[Tuple[str, tuple]] = []
+        self.jsonrpc = FakeRPC(self)
+        self.hierarchy = '<hierarchy rotation="0" />'
+        self.frame = Image.new("RGB", (144, 320))
+        self.focus = "com.tencent.mm/com.tencent.mm.ui.LauncherUI"
+
+    def _respond(self, command: str) -> ShellResponse:
+        if "mCurrentFocus" in command:
+            return ShellResponse(f"  mCurrentFocus=Window{{1c2d u0 {self.focus}}}\n", 0)
+        return ShellResponse("", 0)
+
+    def _thumbnail(self, scale: float, quality: int) -> str:
+        frame = self.frame.resize((round(self.frame.width * scale), round(self.frame.height * scale)))
+        data = io.BytesIO()
+        frame.save(data, format="JPEG", quality=quality)
+        return base64.b64encode(data.getvalue()).decode()
+
+    def dump_hierarchy(self) -> str:
+        self.calls.append(("dump_hierarchy", ()))
+        return self.hierarchy
+
+    def screenshot(self, format: str = "pillow"):
+        self.calls.append(("screenshot", ()))
+        if format == "opencv":
+            return np.asarray(self.frame)[:, :, ::-1].copy()
+        return self.frame.copy()
+
+    def app_stop(self, package: str) -> None:
+        self.calls.append(("app_stop", (package,)))
+
+    def shell(self, command: str, timeout: float = 60) -> ShellResponse:
+        self.calls.append(("shell", (command,)))
+        if self.local_shell:
+            done = subprocess.run(["sh", "-c", SU + self.prelude + command], capture_output=True, text=True, timeout=timeout)
+            return ShellResponse(done.stdout, done.returncode)
+        return self.respond(command)
+
+    def shell_commands(self) -> List[str]:
+        return [args[0] for name, args in self.calls if name == "shell"]
+
+
+def connect(monkeypatch, device: FakeDevice, input_backend: str = "rpc") -> infra.controller.AndroidController:
+    monkeypatch.setattr(infra.controller.u2, "connect_usb", lambda port: device)
+    monkeypatch.setattr(infra.controller.time, "sleep", lambda seconds: None)
+    return infra.controller.AndroidController("emulator-5554", "com.tencent.mm", input_backend)
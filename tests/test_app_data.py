@@ -0,0 +1,44 @@
+from uiautomator2.abstract import ShellResponse
+
+from device import FakeDevice, connect
+
+
+def test_root_is_checked_once(monkeypatch):
+    device = FakeDevice(respond=lambda command: ShellResponse("0\n" if command == "id -u" else "", 0))
+    controller = connect(monkeypatch, device)
+    controller.save_app_data("com.tencent.mm", "/data/local/tmp/sphinx_login/com.tencent.mm.tgz")
+    controller.restore_app_data("com.tencent.mm", "/data/local/tmp/sphinx_login/com.tencent.mm.tgz")
+    controller.drop_app_data("/data/local/tmp/sphinx_login/com.tencent.mm.tgz")
+    commands = device.shell_commands()
+    assert commands.count("id -u") == 1 and len(commands) == 4
+    # adbd runs as root, no su
+    assert not any(command.startswith("su ") for command in commands)
+
+
+def test_scripts_run_through_su(monkeypatch):
+    device = FakeDevice(local_shell=True)
+    controller = connect(monkeypatch, device)
+    controller.adbd_root = False
+    response = controller.root_shell("echo 'it'\"'\"'s quoted' && exit 3")
+    assert device.shell_commands()[-1].startswith("su 0 sh -c '")
+    assert response == ShellResponse("it's quoted\n", 3)
+
+
+def test_save_and_restore_stop_the_app_in_the_same_round_trip(monkeypatch):
+    archive = "/data/local/tmp/sphinx_login/com.tencent.mm.tgz"
+    exit_code = 0
+    device = FakeDevice(respond=lambda command: ShellResponse("", exit_code))
+    controller = connect(monkeypatch, device)
+    controller.adbd_root = True
+    assert controller.save_app_data("com.tencent.mm", archive)
+    assert controller.restore_app_data("com.tencent.mm", archive)
+    save, restore = device.shell_commands()
+    assert save.startswith("am force-stop com.tencent.mm && ")
+    assert f"tar -czf {archive} -C /data/data/com.tencent.mm" in save
+    assert "--exclude=./cache" in save and "--exclude=./lib" in save
+    assert restore.startswith("am force-stop com.tencent.mm; test -f ")
+    assert f"tar -xzf {archive} -C /data/data/com.tencent.mm" in restore
+    assert "restorecon -R /data/data/com.tencent.mm" in restore
+    exit_code = 1
+    assert not controller.save_app_data("com.tencent.mm", archive)
+    assert not controller.restore_app_data("com.tencent.mm", archive)
@@ -0,0 +1,74 @@
+import re
+
+import pytest
+
+from infra.hierarchy import CompactUIHierarchy, UIHierarchy, estimate_tokens
+from baseline import XML_FILES, baseline, read_xml
+
+
+BUDGETS = [20, 100, 400, 1500]
+WIDGET = re.compile(r"^\t*\[(\d+)\] ", re.M)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("微信") == 2
+    assert estimate_tokens("ab微信") == 3
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_budgeted_dumps_fit(path):
+    hierarchy = UIHierarchy(read_xml(path))
+    for budget in BUDGETS:
+        assert estimate_tokens(hierarchy.dump_widget_tree(budget)) <= budget
+        assert estimate_tokens(hierarchy.dump_widget_list(budget)) <= budget
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_interactable_widgets_are_kept_first(path):
+    hierarchy = UIHierarchy(read_xml(path))
+    widgets = set(range(len(hierarchy.widgets())))
+    lines = baseline()[path]["widget_tree"].splitlines(keepends=True)
+    # enough for the widget lines at their unbudgeted indent, which is never smaller
+    budget = sum(estimate_tokens(line) for line in lines if WIDGET.match(line))
+    budget += estimate_tokens(f"... {len(lines)} more elements not shown\n")
+    for extra in [0, 50, 200]:
+        tree = hierarchy.dump_widget_tree(budget + extra)
+        assert {int(index) for index in WIDGET.findall(tree)} == widgets
+    for small in BUDGETS[:2]:
+        shown = [int(index) for index in WIDGET.findall(hierarchy.dump_widget_tree(small))]
+        assert len(shown) == len(set(shown)) and set(shown) <= widgets
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_budgeted_list_is_a_prefix(path):
+    hierarchy = UIHierarchy(read_xml(path))
+    full = baseline()[path]["widget_list"].split("\n")
+    for budget in BUDGETS:
+        lines = hierarchy.dump_widget_list(budget).split("\n")
+        if lines[-1].endswith("more widgets not shown"):
+            assert lines[-1] == f"... {len(full) - len(lines) + 1} more widgets not shown"
+            lines = lines[:-1]
+        assert lines == full[:len(lines)]
+    assert hierarchy.dump_widget_list(10 ** 6) == baseline()[path]["widget_list"]
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_large_budget_keeps_everything(path):
+    hierarchy = UIHierarchy(read_xml(path))
+    tree = hierarchy.dump_widget_tree(10 ** 6)
+    assert "not shown" not in tree
+    assert sorted(int(index) for index in WIDGET.findall(tree)) == list(range(len(hierarchy.widgets())))
+    # the unbudgeted dump is untouched
+    assert hierarchy.dump_widget_tree() == baseline()[path]["widget_tree"]
+
+
+@pytest.mark.parametrize("path", XML_FILES[:3])
+def test_compact_budgeted_dumps_match(path):
+    xml = read_xml(path)
+    full, compact = UIHierarchy(xml), CompactUIHierarchy(xml)
+    for budget in BUDGETS:
+        assert compact.dump_widget_tree(budget) == full.dump_widget_tree(budget)
+        assert compact.dump_widget_list(budget) == full.dump_widget_list(budget)
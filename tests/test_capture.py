@@ -0,0 +1,104 @@
+from pathlib import Path
+import shutil
+import numpy as np
+import cv2
+import pytest
+from PIL import Image
+
+from infra.capture import (DEFERRED, SKIP, SYNC, DEFAULT_ENCODING, Encoding, artifact_path, capture_plan, check_encodings,
+                           load_encodings, parse_encoding, read_screenshot, regenerate, screenshot_path,
+                           write_image, write_manifest)
+from infra.hierarchy import UIHierarchy
+from baseline import XML_FILES, read_xml
+
+
+@pytest.mark.parametrize("mode", ["text", "tree", "image", "annotated_image"])
+def test_capture_plan(mode):
+    minimal, mode_only, full = (capture_plan(profile, mode) for profile in ["minimal", "mode-only", "full-archive"])
+    # the hierarchy is always kept for evaluation, and never on the critical path
+    assert minimal["xml"] == mode_only["xml"] == full["xml"] == DEFERRED
+    assert mode_only["screenshot"] != SKIP and full["annotated"] != SKIP
+    if mode == "image":
+        assert all(plan["screenshot"] == SYNC for plan in [minimal, mode_only, full])
+        assert minimal["annotated"] == mode_only["annotated"] == SKIP
+    elif mode == "annotated_image":
+        assert all(plan["annotated"] == SYNC for plan in [minimal, mode_only, full])
+        assert minimal["screenshot"] == SKIP
+    else:
+        assert minimal == {"xml": DEFERRED, "screenshot": SKIP, "annotated": SKIP}
+        assert full == {"xml": DEFERRED, "screenshot": DEFERRED, "annotated": DEFERRED}
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        capture_plan("everything", "tree")
+
+
+def test_regenerate_renders_missing_annotated_screenshots(tmp_path):
+    trace = tmp_path / "1" / "wechat"
+    trace.mkdir(parents=True)
+    for step, path in enumerate(XML_FILES[:2]):
+        shutil.copy(path, trace / f"{step}.xml")
+        shutil.copy(Path(path).with_suffix(".png"), trace / f"{step}.png")
+    write_manifest(trace, "mode-only", capture_plan("mode-only", "tree"),
+                   {"screenshot": DEFAULT_ENCODING, "annotated": DEFAULT_ENCODING})
+    assert regenerate(tmp_path) == [trace]
+    for step, path in enumerate(XML_FILES[:2]):
+        screen = cv2.imread(str(Path(path).with_suffix(".png")))
+        expected = UIHierarchy(read_xml(path)).dump_annotated_image(screen)
+        assert np.array_equal(read_screenshot(trace, step, "annotated"), expected)
+    # done once
+    assert screenshot_path(trace, 0, "annotated").exists()
+    assert regenerate(tmp_path) == []
+
+
+def test_parse_encoding():
+    assert parse_encoding("png") == DEFAULT_ENCODING == Encoding("png", None, 1.0)
+    assert parse_encoding("png:6") == Encoding("png", 6, 1.0)
+    assert parse_encoding("webp:101") == Encoding("webp", 101, 1.0)
+    assert parse_encoding("jpeg:90@0.5") == Encoding("jpeg", 90, 0.5)
+    assert parse_encoding("webp@0.25") == Encoding("webp", None, 0.25)
+    for spec in ["gif", "png:10", "jpeg:101", "webp:0", "png@0", "png@1.5", "png:high"]:
+        with pytest.raises(ValueError):
+            parse_encoding(spec)
+
+
+SCREEN = cv2.resize(np.random.default_rng(0).integers(0, 256, (80, 36, 3), dtype=np.uint8), (360, 800),
+                    interpolation=cv2.INTER_NEAREST)
+
+
+@pytest.mark.parametrize("spec, max_error", [("png", 0), ("png:9", 0), ("webp:101", 0), ("jpeg:95", 12),
+                                             ("webp:80", 20), ("png@0.5", 12)])
+def test_screenshot_round_trip(tmp_path, spec, max_error):
+    encoding = parse_encoding(spec)
+    write_manifest(tmp_path, "mode-only", capture_plan("mode-only", "image"),
+                   {"screenshot": encoding, "annotated": DEFAULT_ENCODING})
+    assert load_encodings(tmp_path)["screenshot"] == encoding
+    write_image(artifact_path(tmp_path, "screenshot", 3, encoding), SCREEN, encoding)
+    assert screenshot_path(tmp_path, 3) == tmp_path / f"3{encoding.suffix}"
+    image = read_screenshot(tmp_path, 3)
+    # read back at the device resolution
+    assert image.shape == SCREEN.shape
+    error = np.abs(image.astype(np.int16) - SCREEN.astype(np.int16)).mean()
+    assert error <= max_error
+
+
+def test_pil_images_and_old_traces(tmp_path):
+    # traces written before the manifest hold PNGs
+    assert load_encodings(tmp_path) == {"screenshot": DEFAULT_ENCODING, "annotated": DEFAULT_ENCODING}
+    pil = Image.fromarray(cv2.cvtColor(SCREEN, cv2.COLOR_BGR2RGB))
+    write_image(tmp_path / "0.png", pil, DEFAULT_ENCODING)
+    assert np.array_equal(read_screenshot(tmp_path, 0), SCREEN)
+    with pytest.raises(FileNotFoundError):
+        read_screenshot(tmp_path, 1)
+
+
+def test_observation_artifacts_keep_the_device_resolution():
+    archive = {"screenshot": parse_encoding("jpeg:90@0.5"), "annotated": parse_encoding("webp:80@0.5")}
+    check_encodings(capture_plan("full-archive", "tree"), archive)
+    for mode in ["image", "annotated_image"]:
+        with pytest.raises(ValueError):
+            check_encodings(capture_plan("minimal", mode), archive)
+    # a lossy format keeps the device resolution
+    check_encodings(capture_plan("full-archive", "image"), {"screenshot": parse_encoding("jpeg:90"),
+                                                            "annotated": parse_encoding("png@0.5")})
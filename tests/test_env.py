@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from uiautomator2.abstract import ShellResponse
+
+from infra.android_env import AndroidEnv, EnvRuntimeError
+from infra.hierarchy import UIHierarchy, back_action
+from device import FakeDevice, connect
+from baseline import XML_FILES, read_xml
+
+
+@pytest.fixture
+def device():
+    device = FakeDevice()
+    device.hierarchy = read_xml(XML_FILES[0])
+    return device
+
+
+@pytest.fixture
+def make_env(monkeypatch, tmp_path, device):
+    envs = []
+
+    def make(**kwargs):
+        kwargs = {"observation_mode": "tree", "reinstall": False, "settle_quiet": None, "wait_time": 0,
+                  "trace_dir": tmp_path, **kwargs}
+        env = AndroidEnv(controller=connect(monkeypatch, device), **kwargs)
+        envs.append(env)
+        return env
+    yield make
+    for env in envs:
+        env.close()
+
+
+def test_settle_times_line_up_with_steps(make_env, tmp_path):
+    env = make_env()
+    env.reset(1, "wechat")
+    # actions outside of steps, as a login script replays them
+    env.act(back_action())
+    env.act(back_action())
+    assert env.settle_times == []
+    env.step("press [back]")
+    env.step("press [back]")
+    env.step("press [stop]")
+    with open(tmp_path / "1" / "wechat" / "settle_times.json") as f:
+        settle_times = json.load(f)
+    assert settle_times == [{"seconds": 0, "polls": 0, "timed_out": False}] * 3
+    with open(tmp_path / "1" / "wechat" / "actions.json") as f:
+        assert len(json.load(f)) == len(settle_times)
+
+
+def test_full_archive_renders_annotated_screenshots_from_memory(make_env, device, tmp_path):
+    device.frame = Image.open(Path(XML_FILES[0]).with_suffix(".png")).convert("RGB")
+    env = make_env(capture_profile="full-archive", screenshot_encoding="jpeg:50@0.5")
+    env.reset(1, "wechat")
+    env.step("press [back]")
+    env.recorder.flush()
+    trace = tmp_path / "1" / "wechat"
+    expected = UIHierarchy(read_xml(XML_FILES[0])).dump_annotated_image(
+        cv2.cvtColor(np.asarray(device.frame), cv2.COLOR_RGB2BGR))
+    for step in range(2):
+        # not from the lossy, downscaled screenshot that is stored
+        assert np.array_equal(cv2.imread(str(trace / f"annotated_{step}.png")), expected)
+        assert cv2.imread(str(trace / f"{step}.jpg")).shape[:2] == (1600, 720)
+
+
+def test_observation_screenshots_are_not_downscaled(make_env):
+    with pytest.raises(EnvRuntimeError):
+        make_env(observation_mode="image", action_mode="coordination", screenshot_encoding="png@0.5")
+    make_env(observation_mode="annotated_image", screenshot_encoding="png@0.5")
+
+
+def test_close_releases_everything_before_raising(make_env, device):
+    env = make_env()
+    env.reset(1, "wechat")
+    assert env.observation_handler.executor is not None
+
+    def fail():
+        raise OSError("disk full")
+    env.recorder.submit(fail)
+    device.calls.clear()
+    with pytest.raises(OSError):
+        env.close()
+    assert env.recorder.closed and env.observation_handler.executor is None
+    assert ("app_stop", ("com.tencent.mm",)) in device.calls
+    assert any("ime set com.wparam.nullkeyboard/.NullKeyboard" in command for command in device.shell_commands())
+    assert env.controller is None and not env.reset_finished
+
+
+def test_keyboard_is_selected_for_the_whole_task(make_env, device):
+    default = device.respond
+    device.respond = lambda command: (ShellResponse("Broadcast completed: result=-1\n", 0)
+                                      if command.startswith("am broadcast") else default(command))
+    env = make_env()
+    env.reset(1, "wechat")
+    env.step("text [0] [hello]")
+    env.step("text [1] [world]")
+    commands = device.shell_commands()
+    assert sum("ime set com.github.uiautomator/.AdbKeyboard" in command for command in commands) == 1
+    assert not any("NullKeyboard" in command for command in commands)
+    assert [timing.ok for timing in env.controller.text_input.timings] == [True, True]
+    env.close()
+    assert "ime set com.wparam.nullkeyboard/.NullKeyboard" in device.shell_commands()[-1]
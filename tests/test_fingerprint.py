@@ -0,0 +1,65 @@
+import re
+
+import pytest
+
+from infra.fingerprint import stable_key
+from infra.hierarchy import CompactUIHierarchy, UIHierarchy
+from baseline import XML_FILES, read_xml
+
+
+HIERARCHIES = {"full": UIHierarchy, "compact": CompactUIHierarchy}
+
+
+def first_text(xml):
+    return re.search(r' text="([^"]+)"', xml).group(1)
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+def test_same_dump_same_fingerprint(kind):
+    fingerprints = [HIERARCHIES[kind](read_xml(path)).fingerprint() for path in XML_FILES]
+    assert fingerprints == [UIHierarchy(read_xml(path)).fingerprint() for path in XML_FILES]
+    # the groundtruth screens are all different
+    assert len(set(fingerprints)) == len(XML_FILES)
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+def test_volatile_attributes_are_ignored(kind):
+    xml = read_xml(XML_FILES[0])
+    fingerprint = HIERARCHIES[kind](xml).fingerprint()
+    focused = xml.replace('focused="false"', 'focused="true"', 1)
+    assert HIERARCHIES[kind](focused).fingerprint() == fingerprint
+    # numbers in texts are masked, e.g. a clock
+    clock = xml.replace('text=""', 'text="12:30"', 1)
+    assert HIERARCHIES[kind](clock.replace("12:30", "12:31")).fingerprint() == HIERARCHIES[kind](clock).fingerprint()
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+def test_content_changes_are_seen(kind):
+    xml = read_xml(XML_FILES[0])
+    fingerprint = HIERARCHIES[kind](xml).fingerprint()
+    text = first_text(xml)
+    assert HIERARCHIES[kind](xml.replace(f'text="{text}"', 'text="changed"', 1)).fingerprint() != fingerprint
+    assert HIERARCHIES[kind](xml.replace('clickable="false"', 'clickable="true"', 1)).fingerprint() != fingerprint
+    assert HIERARCHIES[kind](xml.replace('bounds="[0,0]', 'bounds="[0,1]', 1)).fingerprint() != fingerprint
+
+
+def test_equal_subtrees_hash_equal():
+    hierarchies = [UIHierarchy(read_xml(path)) for path in XML_FILES[:2]]
+    hashes = [{node.subtree_hash() for node in hierarchy} for hierarchy in hierarchies]
+    # the leaves of two screens of one app repeat
+    assert len(hashes[0] & hashes[1]) > 0
+    compact = CompactUIHierarchy(read_xml(XML_FILES[0]))
+    assert [node.subtree_hash() for node in compact] == [node.subtree_hash() for node in hierarchies[0]]
+
+
+def test_only_volatile_numbers_are_masked():
+    def key(text, cls="android.widget.TextView"):
+        return stable_key({"class": cls, "text": text})
+    assert key("12:30") == key("9:05") and key("Sent at 9:41 PM") == key("Sent at 10:02 AM")
+    assert key("3") == key("99+")
+    assert key("Step 1 of 3") != key("Step 2 of 3")
+    assert key("¥12.50") != key("¥13.50")
+    assert key("13800138000") != key("13900139000")
+    # typed text is never masked
+    assert key("12:30", "android.widget.EditText") != key("12:31", "android.widget.EditText")
+    assert key("3", "android.widget.EditText") != key("5", "android.widget.EditText")
@@ -0,0 +1,131 @@
+from copy import deepcopy
+import xml.etree.ElementTree as ET
+import pytest
+
+from infra.hierarchy import ActionType, UIHierarchy, Widget
+from baseline import XML_FILES, baseline, read_xml
+
+
+def widget_list(hierarchy: UIHierarchy) -> str:
+    # the text observation of the baseline AndroidEnv
+    return "\n".join(f"[{i}] {widget}" for i, widget in enumerate(hierarchy.widgets()))
+
+
+BUILDERS = {
+    "element": lambda s: UIHierarchy(ET.fromstring(s)),
+    "string": lambda s: UIHierarchy(s),
+    "bytes": lambda s: UIHierarchy(s.encode("utf-8")),
+}
+
+
+@pytest.mark.parametrize("builder", list(BUILDERS))
+@pytest.mark.parametrize("path", XML_FILES)
+def test_serializers_match_baseline(path, builder):
+    expected = baseline()[path]
+    hierarchy = BUILDERS[builder](read_xml(path))
+    assert str(hierarchy) == expected["str"]
+    assert hierarchy.dump_widget_tree() == expected["widget_tree"]
+    assert widget_list(hierarchy) == expected["widget_list"]
+    assert hierarchy.dump_widget_list() == expected["widget_list"]
+    assert [str(event) for event in hierarchy.events()] == expected["events"]
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_expat_builder_matches_element_builder(path):
+    xml = read_xml(path)
+    from_element, from_string = UIHierarchy(ET.fromstring(xml)), UIHierarchy(xml)
+    assert [node._attrib for node in from_element] == [node._attrib for node in from_string]
+    assert [node._depth for node in from_element] == [node._depth for node in from_string]
+
+
+def test_systemui_windows_are_skipped():
+    xml = ('<hierarchy rotation="0">'
+           '<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="com.android.systemui" '
+           'content-desc="" clickable="true" bounds="[0,0][1080,80]" />'
+           '<node index="1" text="ok" resource-id="app:id/ok" class="android.widget.Button" package="app" '
+           'content-desc="" clickable="true" bounds="[0,100][200,200]" />'
+           '</hierarchy>')
+    for hierarchy in [UIHierarchy(xml), UIHierarchy(ET.fromstring(xml))]:
+        assert [node._package for node in hierarchy] == ["app"]
+
+
+def test_clones_are_independent():
+    hierarchy = UIHierarchy(read_xml(XML_FILES[0]))
+    node = hierarchy.widgets()[0]
+    widget = Widget(node)
+    assert str(widget) == str(node)
+    widget.set_attrib("text", "changed")
+    assert widget._attrib["text"] == "changed"
+    assert node._attrib.get("text") != "changed"
+    widget._action_types.append(ActionType.BACK)
+    assert ActionType.BACK not in node._action_types
+    copied = deepcopy(hierarchy._children[0])
+    copied.add_child(copied)
+    assert len(copied._children) == len(hierarchy._children[0]._children) + 1
+
+
+def test_widgets_are_built_once_per_node():
+    hierarchy = UIHierarchy(read_xml(XML_FILES[0]))
+    hierarchy.dump_widget_tree()
+    nodes = hierarchy._numbered_nodes()
+    assert all(node.to_widget() is node.to_widget() for node in nodes)
+    assert [str(widget) for widget in hierarchy.widgets()] == [str(node.to_widget()) for node in nodes]
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_reusing_nodes_matches_baseline(path):
+    # every other dump as the previous step, including the same dump
+    expected = baseline()[path]
+    for previous_path in XML_FILES:
+        previous = UIHierarchy(read_xml(previous_path))
+        previous.dump_widget_tree()  # the reused nodes carry cached widgets and numbers
+        hierarchy = UIHierarchy(read_xml(path), previous)
+        assert hierarchy.dump_widget_tree() == expected["widget_tree"]
+        assert hierarchy.dump_widget_list() == expected["widget_list"]
+        assert [str(event) for event in hierarchy.events()] == expected["events"]
+        assert hierarchy.fingerprint() == UIHierarchy(read_xml(path)).fingerprint()
+
+
+def test_reused_widgets_keep_no_position():
+    xml = read_xml(XML_FILES[0])
+    previous = UIHierarchy(xml)
+    widgets = [node.to_widget() for node in previous._numbered_nodes()]
+    hierarchy = UIHierarchy(xml, previous)
+    for node, widget in zip(hierarchy._numbered_nodes(), widgets):
+        assert node.to_widget() is widget
+        assert not hasattr(widget, "_depth") and not hasattr(widget, "_children")
+
+
+NODE = ('<node index="{index}" text="{text}" resource-id="app:id/{id}" class="android.widget.TextView" '
+        'package="app" content-desc="" clickable="true" bounds="[0,{top}][100,{bottom}]">{children}</node>')
+
+
+def screen(rows):
+    children = "".join(NODE.format(index=i, text=text, id=f"row{i}", top=i * 100, bottom=i * 100 + 90, children="")
+                       for i, text in enumerate(rows))
+    return f'<hierarchy rotation="0">{NODE.format(index=0, text="", id="list", top=0, bottom=1000, children=children)}</hierarchy>'
+
+
+def test_diff():
+    previous = UIHierarchy(screen(["a", "b", "c"]))
+    assert UIHierarchy(screen(["a", "b", "c"])).diff(previous).is_empty()
+    diff = UIHierarchy(screen(["a", "x", "c"])).diff(previous)
+    assert [(old._text, new._text) for old, new in diff.changed] == [("b", "x")]
+    assert diff.unchanged == 3
+    diff = UIHierarchy(screen(["a", "b", "c", "d"])).diff(previous)
+    assert [node._text for node in diff.inserted] == ["d"] and diff.removed == []
+    diff = UIHierarchy(screen(["a"])).diff(previous)
+    assert sorted(node._text for node in diff.removed) == ["b", "c"] and diff.inserted == []
+
+
+@pytest.mark.parametrize("path", XML_FILES[:4])
+def test_serializers_are_independent_of_call_order(path):
+    expected = baseline()[path]
+    first = UIHierarchy(read_xml(path))
+    tree, widgets = first.dump_widget_tree(), widget_list(first)
+    second = UIHierarchy(read_xml(path))
+    widgets_first = widget_list(second)
+    assert (second.dump_widget_tree(), widgets_first) == (tree, widgets) == (expected["widget_tree"], expected["widget_list"])
+    # memoized, and numbered once
+    assert second.dump_widget_tree() is second.dump_widget_tree()
+    assert [node._output_index for node in second._numbered_nodes()] == list(range(len(second.widgets())))
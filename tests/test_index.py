@@ -0,0 +1,94 @@
+import pytest
+
+from infra.hierarchy import CompactUIHierarchy, UIHierarchy
+from infra.index import AttributeIndex, contains, matches
+from baseline import XML_FILES, baseline, read_xml
+
+
+HIERARCHIES = {"full": UIHierarchy, "compact": CompactUIHierarchy}
+
+
+def found(node):
+    return dict(node._attrib) if node is not None else None
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+@pytest.mark.parametrize("path", XML_FILES)
+def test_find_element_matches_baseline(path, kind):
+    hierarchy = HIERARCHIES[kind](read_xml(path))
+    for case in baseline()[path]["find_element"]:
+        if case["point"] is not None:
+            continue
+        assert found(hierarchy.find_element(case["rule"], case["match_type"])) == case["found"], case
+
+
+@pytest.mark.parametrize("path", XML_FILES[:4])
+def test_attribute_index_matches_scan(path):
+    nodes = list(UIHierarchy(read_xml(path)))
+    index = AttributeIndex(nodes)
+    rules = [({"class": "android.widget.TextView"}, "equal"), ({"text": "a"}, "include"),
+             ({"text": "微信"}, "include"), ({"resource-id": "com.tencent.mm:id/"}, "include"),
+             ({"class": "Layout", "clickable": "true"}, "include"), ({"text": ""}, "equal"), ({}, "equal")]
+    for node in nodes[::5]:
+        if len(node._attrib.get("text", "")) > 3:
+            rules.append(({"text": node._attrib["text"][1:-1]}, "include"))
+    for rule, match_type in rules:
+        expected = [pos for pos, node in enumerate(nodes) if matches(node._attrib, rule, match_type)]
+        assert list(index.match(rule, match_type)) == expected, rule
+        # memoized positions give the same answer
+        assert list(index.match(rule, match_type)) == expected, rule
+
+
+def test_invalid_match_type():
+    hierarchy = UIHierarchy(read_xml(XML_FILES[0]))
+    with pytest.raises(ValueError):
+        hierarchy.find_element({"text": "x"}, "regex")
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+@pytest.mark.parametrize("path", XML_FILES)
+def test_find_element_with_point_matches_baseline(path, kind):
+    hierarchy = HIERARCHIES[kind](read_xml(path))
+    for case in baseline()[path]["find_element"]:
+        if case["point"] is None:
+            continue
+        point = tuple(case["point"])
+        assert found(hierarchy.find_element(case["rule"], case["match_type"], point)) == case["found"], case
+
+
+@pytest.mark.parametrize("path", XML_FILES[:4])
+def test_elements_at_matches_scan(path):
+    hierarchy = UIHierarchy(read_xml(path))
+    nodes = list(hierarchy)
+    for x in range(0, 1440, 97):
+        for y in range(0, 3200, 131):
+            expected = [node for node in nodes if contains(node._bounds, x, y)]
+            assert hierarchy.elements_at(x, y) == expected, (x, y)
+
+
+def test_topmost_interactable_prefers_deepest_then_later():
+    xml = ('<hierarchy rotation="0">'
+           '<node index="0" class="android.widget.FrameLayout" package="app" clickable="true" bounds="[0,0][1000,1000]">'
+           '<node index="0" class="android.widget.Button" package="app" clickable="true" bounds="[0,0][500,500]" />'
+           '<node index="1" class="android.widget.Button" package="app" clickable="true" bounds="[250,250][750,750]" />'
+           '</node></hierarchy>')
+    for hierarchy in [UIHierarchy(xml), CompactUIHierarchy(xml)]:
+        assert hierarchy.topmost_interactable_at(100, 100)._bounds == (0, 0, 500, 500)
+        assert hierarchy.topmost_interactable_at(300, 300)._bounds == (250, 250, 750, 750)
+        assert hierarchy.topmost_interactable_at(900, 900)._bounds == (0, 0, 1000, 1000)
+        assert hierarchy.topmost_interactable_at(2000, 2000) is None
+
+
+def test_topmost_interactable_is_not_a_covered_deeper_node():
+    xml = ('<hierarchy rotation="0">'
+           '<node index="0" class="android.widget.FrameLayout" package="app" resource-id="android:id/content" bounds="[0,0][1000,1000]">'
+           '<node index="0" class="android.widget.LinearLayout" package="app" bounds="[0,0][1000,1000]">'
+           '<node index="0" class="android.widget.Button" package="app" clickable="true" bounds="[100,100][400,400]" />'
+           '</node>'
+           '<node index="1" class="android.widget.Button" package="app" clickable="true" bounds="[0,0][1000,500]" />'
+           '</node></hierarchy>')
+    for hierarchy in [UIHierarchy(xml), CompactUIHierarchy(xml)]:
+        # the dialog button is drawn over the deeper one
+        assert hierarchy.topmost_interactable_at(200, 200)._bounds == (0, 0, 1000, 500)
+        # nothing interactable under the point on the top path
+        assert hierarchy.topmost_interactable_at(200, 700) is None
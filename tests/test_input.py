@@ -0,0 +1,28 @@
+import pytest
+
+from infra.controller import KEYCODE_BACK, SWIPE_STEPS
+from device import FakeDevice, connect
+
+
+GESTURES = {
+    "tap": (lambda c: c.click(10, 20), ("rpc.click", (10, 20)), "input tap 10 20"),
+    "hold": (lambda c: c.tap_hold(10, 20, 1.5), ("rpc.click", (10, 20, 1500)), "input swipe 10 20 10 20 1500"),
+    "swipe": (lambda c: c.swipe(1, 2, 3.7, 4), ("rpc.swipe", (1, 2, 3, 4, SWIPE_STEPS)), "input swipe 1 2 3 4 100"),
+    "back": (lambda c: c.back(), ("rpc.pressKeyCode", (KEYCODE_BACK,)), f"input keyevent {KEYCODE_BACK}"),
+}
+
+
+@pytest.mark.parametrize("gesture", list(GESTURES))
+def test_backends(monkeypatch, gesture):
+    do, rpc, shell = GESTURES[gesture]
+    device = FakeDevice()
+    do(connect(monkeypatch, device, "rpc"))
+    assert device.calls == [rpc]
+    device = FakeDevice()
+    do(connect(monkeypatch, device, "shell"))
+    assert device.calls == [("shell", (shell,))]
+
+
+def test_unknown_backend(monkeypatch):
+    with pytest.raises(ValueError):
+        connect(monkeypatch, FakeDevice(), "adb")
@@ -0,0 +1,38 @@
+from infra.hierarchy import UIHierarchy
+from infra.intern import StringPool, UNPOOLED_ATTRIBS, pool
+from baseline import XML_FILES, read_xml
+
+
+def test_equal_values_share_one_string():
+    strings = StringPool()
+    a, b = "".join(["android.widget.", "TextView"]), "".join(["android.widget.", "Text", "View"])
+    assert a is not b
+    assert strings(a) is strings(b)
+    assert strings.stats()["hits"] == 1
+
+
+def test_unpooled_attribs_are_left_alone():
+    strings = StringPool()
+    attrib = {"class": "android.widget.TextView", "text": "hello", "content-desc": "x", "bounds": "[0,0][1,1]"}
+    strings.attrib(attrib)
+    assert len(strings) == 1
+    assert UNPOOLED_ATTRIBS == {"text", "content-desc", "bounds"}
+
+
+def test_pool_is_bounded():
+    strings = StringPool(max_strings=10)
+    for i in range(100):
+        strings(f"value{i}")
+        strings.attrib({"resource-id": f"id{i}"})
+        assert len(strings) <= 10
+
+
+def test_hierarchies_share_pooled_strings():
+    pool.clear()
+    xml = read_xml(XML_FILES[0])
+    first, second = list(UIHierarchy(xml)), list(UIHierarchy(xml))
+    assert all(a._class is b._class for a, b in zip(first, second))
+    assert all(a._attrib["resource-id"] is b._attrib["resource-id"] for a, b in zip(first, second))
+    assert not any(a._attrib["bounds"] in pool.table for a in first)
+    pool.clear()
+    assert len(pool) == 0
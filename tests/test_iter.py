@@ -0,0 +1,47 @@
+import pytest
+
+from infra.hierarchy import ActionType, CompactUIHierarchy, UIHierarchy
+from baseline import XML_FILES, baseline, read_xml
+
+
+HIERARCHIES = {"full": UIHierarchy, "compact": CompactUIHierarchy}
+REGIONS = [None, (0, 0, 1440, 1600), (0, 1600, 1440, 3200), (100, 100, 101, 101)]
+
+
+def overlaps(bounds, region):
+    x1, y1, x2, y2 = bounds
+    return x1 < region[2] and region[0] < x2 and y1 < region[3] and region[1] < y2
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+@pytest.mark.parametrize("path", XML_FILES)
+def test_lists_match_baseline(path, kind):
+    hierarchy = HIERARCHIES[kind](read_xml(path))
+    assert [str(event) for event in hierarchy.events()] == baseline()[path]["events"]
+    assert [str(widget) for widget in hierarchy.iter_widgets()] == [str(widget) for widget in hierarchy.widgets()]
+
+
+@pytest.mark.parametrize("kind", list(HIERARCHIES))
+@pytest.mark.parametrize("path", XML_FILES[:4])
+def test_filters_match_list_filters(path, kind):
+    hierarchy = HIERARCHIES[kind](read_xml(path))
+    widgets, events = hierarchy.widgets(), hierarchy.events()
+    for action_type in [None, ActionType.CLICK, ActionType.SWIPE, ActionType.TEXT, ActionType.LONGCLICK]:
+        for region in REGIONS:
+            for visible_only in [False, True]:
+                def keep(widget):
+                    x1, y1, x2, y2 = widget._bounds
+                    return ((not visible_only or (x1 < x2 and y1 < y2))
+                            and (region is None or overlaps(widget._bounds, region)))
+                expected = [w for w in widgets if keep(w) and (action_type is None or action_type in w._action_types)]
+                assert list(hierarchy.iter_widgets(action_type, visible_only, region)) == expected
+                expected_events = [str(e) for e in events if keep(e) and (action_type is None or e._action == action_type)]
+                assert [str(e) for e in hierarchy.iter_events(action_type, visible_only, region)] == expected_events
+
+
+def test_widgets_are_built_when_consumed():
+    hierarchy = UIHierarchy(read_xml(XML_FILES[0]))
+    widgets = hierarchy.iter_widgets()
+    first = next(widgets)
+    built = [node for node in hierarchy._numbered_nodes() if node._widget is not None]
+    assert len(built) == 1 and built[0]._widget is first
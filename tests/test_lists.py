@@ -0,0 +1,68 @@
+import re
+
+import pytest
+
+from infra.hierarchy import UIHierarchy, format_ranges
+from baseline import XML_FILES, baseline, read_xml
+
+
+ROW = ('<node index="{index}" text="{text}" resource-id="app:id/{id}" class="{cls}" package="app" content-desc="" '
+       'clickable="true" bounds="[0,{top}][100,{bottom}]" />')
+LIST = ('<hierarchy rotation="0"><node index="0" text="" resource-id="app:id/list" '
+        'class="androidx.recyclerview.widget.RecyclerView" package="app" content-desc="" clickable="false" '
+        'scrollable="{scrollable}" bounds="[0,0][100,3000]">{rows}</node></hierarchy>')
+
+
+def screen(rows, scrollable=True):
+    return LIST.format(scrollable=str(scrollable).lower(), rows="".join(
+        ROW.format(index=i, text=text, id="row", cls=cls, top=i * 10, bottom=i * 10 + 9)
+        for i, (text, cls) in enumerate(rows)))
+
+
+def rows(count, cls="android.widget.TextView"):
+    return [(f"Item {i}", cls) for i in range(count)]
+
+
+def test_format_ranges():
+    assert format_ranges([]) == ""
+    assert format_ranges([3]) == "3"
+    assert format_ranges([3, 4, 5, 9]) == "3-5, 9"
+    assert format_ranges([1, 3, 4]) == "1, 3-4"
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_without_long_lists_nothing_changes(path):
+    hierarchy = UIHierarchy(read_xml(path))
+    assert hierarchy.dump_widget_tree(list_keep=None) == baseline()[path]["widget_tree"]
+    assert hierarchy.dump_widget_tree(list_keep=1000) == baseline()[path]["widget_tree"]
+
+
+def test_long_list_is_summarised():
+    hierarchy = UIHierarchy(screen(rows(20)))
+    tree = hierarchy.dump_widget_tree(list_keep=2)
+    texts = re.findall(r"Item \d+", tree)
+    assert texts == ["Item 0", "Item 1", "Item 18", "Item 19"]
+    hidden = sorted(node._output_index for node in list(hierarchy)[3:19])
+    assert f"... 16 more similar items (widgets {format_ranges(hidden)})" in tree
+    # the hidden rows can still be addressed
+    assert len(hierarchy.widgets()) == 21
+
+
+def test_short_and_mixed_lists_are_kept():
+    assert "more similar items" not in UIHierarchy(screen(rows(5))).dump_widget_tree(list_keep=2)
+    # only runs of rows with the same structure are summarised
+    mixed = rows(3) + rows(4, "android.widget.Button") + rows(8)
+    tree = UIHierarchy(screen(mixed)).dump_widget_tree(list_keep=1)
+    assert tree.count("more similar items") == 2
+    assert "... 2 more similar items" in tree and "... 6 more similar items" in tree
+
+
+def test_only_scrollable_lists_are_summarised():
+    hierarchy = UIHierarchy(screen(rows(20), scrollable=False))
+    assert hierarchy.dump_widget_tree(list_keep=2) == hierarchy.dump_widget_tree()
+
+
+def test_summarised_list_fits_a_budget():
+    hierarchy = UIHierarchy(screen(rows(200)))
+    assert len(hierarchy.dump_widget_tree(400, list_keep=3)) < len(hierarchy.dump_widget_tree(400))
+    assert "more elements not shown" not in hierarchy.dump_widget_tree(400, list_keep=3)
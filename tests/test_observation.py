@@ -0,0 +1,112 @@
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from infra.context import Activity
+from infra.observation import ObservationHandler
+from infra.hierarchy import CompactUIHierarchy, UIHierarchy
+from baseline import XML_FILES, baseline, read_xml
+
+
+class FakeController:
+    """A screen that shows gray level `levels[i]` at the i-th thumbnail, the last one repeats."""
+
+    def __init__(self, xml, levels=(0,)):
+        self.xml = xml
+        self.levels = list(levels)
+        self.thumbnails = 0
+        self.calls = []
+        self.threads = set()
+
+    def _call(self, name):
+        self.calls.append(name)
+        self.threads.add(threading.current_thread().name)
+
+    def capture_screen(self, format="pillow"):
+        self._call("screen")
+        return Image.new("RGB", (144, 320))
+
+    def capture_thumbnail(self, scale=0.1):
+        self._call("thumbnail")
+        level = self.levels[min(self.thumbnails, len(self.levels) - 1)]
+        self.thumbnails += 1
+        return np.full((320, 144), level, dtype=np.uint8)
+
+    def dumpstr(self):
+        self._call("dump")
+        return self.xml
+
+    def activity(self):
+        self._call("activity")
+        return Activity("com.tencent.mm", ".ui.LauncherUI")
+
+
+@pytest.fixture
+def handler(request):
+    handler = ObservationHandler(**request.param)
+    yield handler
+    handler.close()
+
+
+@pytest.mark.parametrize("handler", [{"concurrent": True}, {"concurrent": False}, {"compact": True}], indirect=True)
+def test_observation(handler):
+    path = XML_FILES[0]
+    controller = FakeController(read_xml(path))
+    obs, _ = handler.get_observation(controller)
+    # the check samples before and after the capture
+    assert controller.calls[:2] == ["activity", "thumbnail"] and controller.calls[-2:] == ["activity", "thumbnail"]
+    assert sorted(controller.calls[2:-2]) == ["dump", "screen"]
+    assert obs["consistent"]
+    assert obs["activity"] == ("com.tencent.mm", ".ui.LauncherUI")
+    assert obs["hierarchy"].dump_widget_tree() == baseline()[path]["widget_tree"]
+    assert obs["fingerprint"] == UIHierarchy(read_xml(path)).fingerprint()
+    assert [str(w) for w in obs["numbered_widgets"].values()] == [str(w) for w in obs["widgets"]]
+    assert obs["screen"].size == (144, 320)
+    assert "diff" not in obs
+    assert isinstance(obs["hierarchy"], CompactUIHierarchy if handler.hierarchy_class is CompactUIHierarchy else UIHierarchy)
+    capture_threads = {name for name in controller.threads if name != threading.current_thread().name}
+    if handler.concurrent:
+        assert len(capture_threads) > 0 and all(name.startswith("observation") for name in capture_threads)
+    else:
+        assert capture_threads == set()
+
+
+@pytest.mark.parametrize("handler", [{"concurrent": True}, {"concurrent": False}], indirect=True)
+def test_settled_sample_is_reused(handler):
+    controller = FakeController(read_xml(XML_FILES[0]))
+    state, captured = handler.checker.sample(FakeController(""))
+    settled = {"activity": captured["activity"], "state": state, "hierarchy_str": read_xml(XML_FILES[1])}
+    obs, _ = handler.get_observation(controller, settled=settled)
+    # the wait's last sample is the one before the capture
+    assert controller.calls == ["screen", "activity", "thumbnail"]
+    assert obs["consistent"]
+    assert obs["hierarchy_str"] is settled["hierarchy_str"]
+
+
+@pytest.mark.parametrize("handler", [{"concurrent": True}, {"concurrent": False}], indirect=True)
+def test_changes_during_the_capture_are_captured_again(handler):
+    # the screen changes once, between the first sample and the one after the capture
+    controller = FakeController(read_xml(XML_FILES[0]), [0, 100])
+    obs, _ = handler.get_observation(controller)
+    assert obs["consistent"]
+    assert controller.calls.count("dump") == 2 and controller.thumbnails == 4
+    # a screen that keeps changing is captured twice, then handed out as it is
+    controller = FakeController(read_xml(XML_FILES[0]), [0, 100, 200, 50])
+    obs, _ = handler.get_observation(controller)
+    assert not obs["consistent"] and controller.calls.count("dump") == 2
+    # a stale settled sample is dropped for the second capture
+    controller = FakeController(read_xml(XML_FILES[0]), [100])
+    state, captured = handler.checker.sample(FakeController(""))
+    obs, _ = handler.get_observation(controller, settled={**captured, "state": state, "hierarchy_str": ""})
+    assert obs["consistent"] and controller.calls.count("dump") == 1
+    assert len(obs["hierarchy_str"]) > 0
+
+
+@pytest.mark.parametrize("handler", [{"screen": False, "widgets": False, "check": False}], indirect=True)
+def test_optional_captures(handler):
+    controller = FakeController(read_xml(XML_FILES[0]))
+    obs, _ = handler.get_observation(controller)
+    assert sorted(controller.calls) == ["activity", "dump"]
+    assert obs["screen"] is None and "widgets" not in obs
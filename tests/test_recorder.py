@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from infra.recorder import TraceRecorder, write_text
+
+
+def test_writes_run_in_order_off_the_caller():
+    recorder = TraceRecorder(max_pending=2)
+    done, threads = [], set()
+
+    def write(i):
+        threads.add(threading.current_thread().name)
+        done.append(i)
+    for i in range(50):
+        recorder.submit(write, i)
+    recorder.flush()
+    assert done == list(range(50))
+    assert threads == {"trace-recorder"}
+    recorder.close()
+
+
+def test_flush_reraises_the_first_error(tmp_path):
+    recorder = TraceRecorder()
+
+    def fail(message):
+        raise OSError(message)
+    recorder.submit(fail, "first")
+    recorder.submit(fail, "second")
+    recorder.submit(write_text, tmp_path / "after.txt", "written")
+    with pytest.raises(OSError, match="first"):
+        recorder.flush()
+    # later writes still ran, and the errors were reported once
+    assert (tmp_path / "after.txt").read_text(encoding="utf-8") == "written"
+    recorder.flush()
+    recorder.close()
+
+
+def test_close_waits_and_rejects_new_writes(tmp_path):
+    recorder = TraceRecorder()
+    for i in range(5):
+        recorder.submit(write_text, tmp_path / f"{i}.txt", "微信")
+    recorder.close()
+    assert recorder.closed
+    assert sorted(path.name for path in tmp_path.iterdir()) == [f"{i}.txt" for i in range(5)]
+    with pytest.raises(RuntimeError):
+        recorder.submit(write_text, tmp_path / "late.txt", "")
+    recorder.close()
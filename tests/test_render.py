@@ -0,0 +1,28 @@
+from pathlib import Path
+import numpy as np
+import cv2
+import pytest
+
+from infra.bench import reference_annotated_image
+from infra.hierarchy import CompactUIHierarchy, UIHierarchy
+from baseline import XML_FILES, read_xml
+
+# share of pixels that may differ by more than 8 levels from the pyshine renderer,
+# anti-aliased text edges round differently
+DIFF_RATIO = 0.001
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_annotated_image_matches_reference(path):
+    screen = cv2.imread(str(Path(path).with_suffix(".png")))
+    reference = reference_annotated_image(UIHierarchy(read_xml(path)), screen.copy())
+    for hierarchy in [UIHierarchy(read_xml(path)), CompactUIHierarchy(read_xml(path))]:
+        rendered = hierarchy.dump_annotated_image(screen.copy())
+        diff = np.abs(reference.astype(np.int16) - rendered.astype(np.int16)).max(axis=2)
+        assert (diff > 8).mean() < DIFF_RATIO
+
+
+def test_cached_layers_render_the_same():
+    hierarchy = UIHierarchy(read_xml(XML_FILES[0]))
+    screen = np.full((3200, 1440, 3), 128, np.uint8)
+    assert np.array_equal(hierarchy.dump_annotated_image(screen.copy()), hierarchy.dump_annotated_image(screen.copy()))
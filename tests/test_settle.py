@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from infra.context import Activity
+from infra.settle import SettleDetector
+from baseline import XML_FILES, read_xml
+
+
+class FakeController:
+    """Plays a screen per poll: (activity name, gray level, hierarchy), the last one repeats.
+
+    A poll ends with the call of the last signal sampled, last_signal.
+    """
+
+    def __init__(self, screens, last_signal="frame"):
+        self.screens = screens
+        self.last_signal = last_signal
+        self.polls = 0
+        self.dumps = 0
+
+    def _sampled(self, signal):
+        if signal == self.last_signal:
+            self.polls += 1
+
+    def _screen(self):
+        return self.screens[min(self.polls, len(self.screens) - 1)]
+
+    def activity(self):
+        return Activity("app", self._screen()[0])
+
+    def capture_thumbnail(self, scale=0.1):
+        screen = self._screen()
+        self._sampled("frame")
+        return np.full((320, 144), screen[1], dtype=np.uint8)
+
+    def dumpstr(self):
+        self.dumps += 1
+        screen = self._screen()
+        self._sampled("hierarchy")
+        return screen[2]
+
+
+XML = [read_xml(path) for path in XML_FILES[:2]]
+
+
+def detector(**kwargs):
+    return SettleDetector(quiet=0.02, timeout=0.5, interval=0.005, **kwargs)
+
+
+def test_settles_after_changes_stop():
+    controller = FakeController([("a", 0, XML[0]), ("b", 0, XML[0]), ("b", 100, XML[0]), ("b", 100, XML[0])])
+    settled = detector().wait(controller)
+    assert not settled.timed_out
+    assert settled.polls >= 4 and settled.polls == controller.polls
+    assert settled.captured["activity"] == Activity("app", "b")
+    # the hierarchy is only dumped when asked for
+    assert controller.dumps == 0 and "hierarchy_str" not in settled.captured
+
+
+def test_small_frame_changes_are_noise():
+    controller = FakeController([("a", 100, XML[0]), ("a", 101, XML[0])])
+    assert not detector().wait(controller).timed_out
+
+
+def test_times_out_on_a_changing_screen():
+    class Animated(FakeController):
+        def _screen(self):
+            return ("a", (self.polls * 50) % 250, XML[0])
+    settled = detector().wait(Animated([]))
+    assert settled.timed_out and settled.seconds >= 0.5
+    assert "activity" in settled.captured
+
+
+def test_hierarchy_signal():
+    controller = FakeController([("a", 0, XML[0]), ("a", 0, XML[1]), ("a", 0, XML[1])], "hierarchy")
+    settled = detector(signals=["hierarchy"]).wait(controller)
+    assert not settled.timed_out
+    assert settled.captured["hierarchy_str"] == XML[1] and "activity" not in settled.captured
+    assert controller.dumps == settled.polls
+
+
+def test_unknown_signal():
+    with pytest.raises(ValueError):
+        SettleDetector(signals=["focus", "sound"])
@@ -0,0 +1,41 @@
+from uiautomator2.abstract import ShellResponse
+
+from device import FakeDevice, connect
+
+
+def test_batch_returns_a_response_per_command(monkeypatch):
+    device = FakeDevice(local_shell=True)
+    controller = connect(monkeypatch, device)
+    responses = controller.batch("test") \
+        .add("echo one") \
+        .add("printf 'two\\nlines\\n'") \
+        .add("printf 'no newline'") \
+        .add("false") \
+        .add("echo after").run()
+    assert responses == [ShellResponse("one\n", 0), ShellResponse("two\nlines\n", 0), ShellResponse("no newline", 0),
+                         ShellResponse("", 1), ShellResponse("after\n", 0)]
+    assert len(device.shell_commands()) == 1
+    assert controller.round_trip_stats()["test"] == {"calls": 1, "commands": 5, "seconds": controller.round_trips[0].seconds}
+
+
+def test_stop_on_error_ends_the_chain(monkeypatch):
+    device = FakeDevice(local_shell=True)
+    controller = connect(monkeypatch, device)
+    batch = controller.batch().add("echo one").add("(exit 3)").add("echo never")
+    assert batch.run(stop_on_error=True) == [ShellResponse("one\n", 0), ShellResponse("", 3)]
+    assert controller.batch().run() == [] and len(device.shell_commands()) == 1
+
+
+def test_multi_command_paths_take_one_round_trip(monkeypatch):
+    device = FakeDevice()
+    controller = connect(monkeypatch, device)
+    controller.restart_app("com.tencent.mm")
+    controller.grant_permission(["android.permission.CAMERA", "android.permission.RECORD_AUDIO"])
+    controller.air_mode_switch(True)
+    restart, grant, air_mode = device.shell_commands()
+    assert restart.startswith("am force-stop com.tencent.mm; ")
+    assert "monkey -p com.tencent.mm -c android.intent.category.LAUNCHER 1" in restart
+    assert grant.count("pm grant com.tencent.mm") == 2
+    assert "settings put global airplane_mode_on 1" in air_mode
+    stats = controller.round_trip_stats()
+    assert {label: entry["calls"] for label, entry in stats.items()} == {"restart_app": 1, "pm": 1, "air_mode": 1}
@@ -0,0 +1,127 @@
+from typing import List, Set
+import socketserver
+import threading
+import pytest
+
+from infra.snapshot import ConsoleError, EmulatorConsole, SnapshotReset, console_port
+
+
+class FakeConsole(socketserver.ThreadingTCPServer):
+    """A local stand-in for the emulator console that keeps snapshots by name.
+
+    Serves the auth and avd snapshot commands on 127.0.0.1; `commands` records what was sent.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, token: str = "token", snapshots: Set[str] | None = None):
+        super().__init__(("127.0.0.1", 0), FakeConsoleHandler)
+        self.token = token
+        self.snapshots = set() if snapshots is None else snapshots
+        self.commands: List[str] = []
+        self.loaded: str | None = None
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+class FakeConsoleHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, text: str) -> None:
+        self.wfile.write(text.replace("\n", "\r\n").encode())
+
+    def handle(self) -> None:
+        server: FakeConsole = self.server  # type: ignore
+        self.reply("Android Console: Authentication required\n"
+                   "Android Console: type 'auth <auth_token>' to authenticate\nOK\n")
+        authenticated = False
+        for raw in self.rfile:
+            line = raw.decode().strip()
+            server.commands.append(line)
+            words = line.split()
+            if line == "quit":
+                return
+            if words[:1] == ["auth"]:
+                authenticated = words[1:] == [server.token]
+                self.reply("Android Console: type 'help' for a list of commands\nOK\n" if authenticated
+                           else "KO: authentication token does not match\n")
+            elif not authenticated:
+                self.reply("KO: unknown command, try 'help'\n")
+            elif words[:3] == ["avd", "snapshot", "list"]:
+                rows = "".join(f"--  {name}  1.0G  2024-01-01 00:00:00  00:01:00.000\n" for name in sorted(server.snapshots))
+                self.reply(f"List of snapshots present on all disks:\nID  TAG  VM SIZE  DATE  VM CLOCK\n{rows}OK\n")
+            elif words[:3] == ["avd", "snapshot", "save"] and len(words) == 4:
+                server.snapshots.add(words[3])
+                self.reply("OK\n")
+            elif words[:3] in (["avd", "snapshot", "load"], ["avd", "snapshot", "delete"]) and len(words) == 4:
+                if words[3] not in server.snapshots:
+                    self.reply(f"KO: snapshot '{words[3]}' does not exist\n")
+                elif words[2] == "load":
+                    server.loaded = words[3]
+                    self.reply("OK\n")
+                else:
+                    server.snapshots.discard(words[3])
+                    self.reply("OK\n")
+            else:
+                self.reply("KO: unknown command\n")
+
+
+@pytest.fixture
+def fake():
+    server = FakeConsole(snapshots={"base"})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_console_port():
+    assert console_port("emulator-5556") == 5556
+    with pytest.raises(ValueError):
+        console_port("R58M1234")
+
+
+def test_auth(fake):
+    with EmulatorConsole(fake.port, token="token") as console:
+        assert console.snapshots() == ["base"]
+    assert fake.commands[0] == "auth token"
+    assert fake.commands[-1] == "quit"
+
+
+def test_auth_rejected(fake):
+    with pytest.raises(ConsoleError, match="token does not match"):
+        EmulatorConsole(fake.port, token="wrong")
+
+
+def test_list_parsing(fake):
+    fake.snapshots.update({"sphinx_golden", "a-b"})
+    with EmulatorConsole(fake.port, token="token") as console:
+        # the header rows are not snapshots
+        assert console.snapshots() == ["a-b", "base", "sphinx_golden"]
+
+
+def test_save_load_delete(fake):
+    with EmulatorConsole(fake.port, token="token") as console:
+        console.save("golden")
+        console.load("golden")
+        assert fake.loaded == "golden"
+        console.delete("golden")
+        assert console.snapshots() == ["base"]
+
+
+def test_load_missing(fake):
+    with EmulatorConsole(fake.port, token="token") as console:
+        with pytest.raises(ConsoleError, match="does not exist"):
+            console.load("missing")
+        # the connection is still usable after a KO
+        assert console.snapshots() == ["base"]
+
+
+def test_snapshot_reset(fake):
+    reset = SnapshotReset(f"emulator-{fake.port}", "golden", token="token")
+    assert not reset.exists()
+    reset.save()
+    assert reset.exists()
+    assert reset.restore(wait=False) >= 0
+    assert fake.loaded == "golden"
@@ -0,0 +1,68 @@
+import xml.etree.ElementTree as ET
+import shutil
+import pytest
+
+from infra.hierarchy import CompactUIHierarchy, UIHierarchy, load_hierarchy
+from infra.store import NodeStore, SUFFIX, convert, zstd
+from baseline import XML_FILES, baseline, read_xml
+
+
+def rows(store: NodeStore):
+    return [(store.attrib(row), int(store.depth[row]), int(store.parent[row]), store.children(row).tolist())
+            for row in range(len(store))]
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_compact_matches_baseline(path):
+    expected = baseline()[path]
+    hierarchy = CompactUIHierarchy(read_xml(path))
+    assert str(hierarchy) == expected["str"]
+    assert hierarchy.dump_widget_tree() == expected["widget_tree"]
+    assert hierarchy.dump_widget_list() == expected["widget_list"]
+    assert [str(event) for event in hierarchy.events()] == expected["events"]
+
+
+@pytest.mark.parametrize("path", XML_FILES)
+def test_store_from_string_matches_from_element(path):
+    xml = read_xml(path)
+    store = NodeStore.from_string(xml)
+    assert rows(store) == rows(NodeStore.from_element(ET.fromstring(xml)))
+    assert [store.attrib(row) for row in range(len(store))] == [node._attrib for node in UIHierarchy(xml)]
+
+
+@pytest.mark.parametrize("compress", [False, pytest.param(True, marks=pytest.mark.skipif(zstd is None, reason="zstandard"))])
+@pytest.mark.parametrize("path", XML_FILES[:3])
+def test_binary_round_trip(path, compress, tmp_path):
+    store = NodeStore.from_string(read_xml(path))
+    assert rows(NodeStore.from_buffer(store.to_bytes(compress))) == rows(store)
+    store.save(tmp_path / f"0{SUFFIX}", compress)
+    loaded = NodeStore.load(tmp_path / f"0{SUFFIX}")
+    assert rows(loaded) == rows(store)
+    assert CompactUIHierarchy(loaded).dump_widget_tree() == baseline()[path]["widget_tree"]
+
+
+def test_load_hierarchy_prefers_newer_binary(tmp_path):
+    path = XML_FILES[0]
+    shutil.copy(path, tmp_path / "0.xml")
+    assert convert(tmp_path) == 1
+    assert convert(tmp_path) == 0  # up to date
+    assert load_hierarchy(tmp_path / "0.xml").dump_widget_tree() == baseline()[path]["widget_tree"]
+    convert(tmp_path, replace=True)
+    assert not (tmp_path / "0.xml").exists()
+    assert load_hierarchy(tmp_path / "0.xml").dump_widget_tree() == baseline()[path]["widget_tree"]
+
+
+def test_compact_nodes_are_read_only():
+    hierarchy = CompactUIHierarchy(read_xml(XML_FILES[0]))
+    node = hierarchy._children[0]
+    assert node._attrib is node._attrib
+    with pytest.raises(TypeError):
+        node.add_child(node)
+
+
+def test_compact_attribute_index():
+    xml = read_xml(XML_FILES[0])
+    full, compact = UIHierarchy(xml), CompactUIHierarchy(xml)
+    rule = {"class": "android.widget.TextView"}
+    assert list(compact.attribute_index().match(rule, "equal")) == list(full.attribute_index().match(rule, "equal"))
+    assert compact.attribute_index() is compact.attribute_index()
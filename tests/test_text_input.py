@@ -0,0 +1,97 @@
+import base64
+
+import pytest
+from adbutils import AdbError
+from uiautomator2.abstract import ShellResponse
+
+from infra.text_input import KEYCODE_PASTE, SHOW_WITH_HARD_KEYBOARD
+from device import FakeDevice, connect
+
+
+ADB_IME = "com.github.uiautomator/.AdbKeyboard"
+NULL_IME = "com.wparam.nullkeyboard/.NullKeyboard"
+
+
+def keyboard(answers: bool, show_with_hard_keyboard: str = "1") -> str:
+    # the device side: `am broadcast` answers like the keyboard, or like nobody listening
+    result = -1 if answers else 0
+    return (f'am() {{ echo "Broadcasting: Intent {{ act=$2 }}"; echo "Broadcast completed: result={result}"; }}; '
+            f'ime() {{ :; }}; settings() {{ [ "$1" = get ] && echo {show_with_hard_keyboard}; true; }}; ')
+
+
+def encoded(text):
+    return base64.b64encode(text.encode("utf-8")).decode()
+
+
+def switches(commands):
+    return sum(command.count("ime set ") for command in commands)
+
+
+def test_keyboard_is_selected_once(monkeypatch):
+    device = FakeDevice(local_shell=True, prelude=keyboard(True))
+    controller = connect(monkeypatch, device)
+    controller.text_input.select()
+    select = device.shell_commands()[0]
+    assert f"settings put secure {SHOW_WITH_HARD_KEYBOARD} 0" in select
+    assert f"ime enable {ADB_IME}" in select and f"ime set {ADB_IME}" in select
+    assert controller.input("微信 hi")
+    assert controller.input("more", clear=False)
+    assert controller.clear_text()
+    commands = device.shell_commands()
+    # one round trip per input, and no input method switch
+    assert len(commands) == 4 and switches(commands[1:]) == 0
+    assert commands[1] == f"am broadcast -a ADB_KEYBOARD_SET_TEXT --es text {encoded('微信 hi')}"
+    assert commands[2].startswith("am broadcast -a ADB_KEYBOARD_INPUT_TEXT")
+    timings = list(controller.text_input.timings)
+    assert [(t.method, t.chars, t.ok) for t in timings] == [("broadcast", 5, True), ("broadcast", 4, True)]
+    controller.text_input.release()
+    release = device.shell_commands()[-1]
+    assert f"ime set {NULL_IME}" in release
+    assert f"settings put secure {SHOW_WITH_HARD_KEYBOARD} 1" in release
+    assert not controller.text_input.selected
+
+
+def test_unset_setting_is_deleted_again(monkeypatch):
+    device = FakeDevice(local_shell=True, prelude=keyboard(True, "null"))
+    controller = connect(monkeypatch, device)
+    controller.text_input.select()
+    controller.text_input.release()
+    assert f"settings delete secure {SHOW_WITH_HARD_KEYBOARD}" in device.shell_commands()[-1]
+
+
+def test_selected_on_first_input(monkeypatch):
+    device = FakeDevice(local_shell=True, prelude=keyboard(True))
+    controller = connect(monkeypatch, device)
+    assert controller.input("a") and controller.input("b")
+    assert switches(device.shell_commands()) == 1
+
+
+def test_clipboard_when_the_keyboard_does_not_answer(monkeypatch):
+    device = FakeDevice(local_shell=True, prelude=keyboard(False))
+    controller = connect(monkeypatch, device)
+    controller.text_input.select()
+    assert controller.input("hello")
+    # selected again once, in case another input method took over
+    commands = device.shell_commands()
+    assert switches(commands) == 2 and NULL_IME not in "".join(commands)
+    rpcs = [(name, args) for name, args in device.calls if name != "shell"]
+    assert ("rpc.setClipboard", (None, "hello")) in rpcs
+    assert rpcs[-1] == ("rpc.pressKeyCode", (KEYCODE_PASTE,))
+    assert controller.text_input.timings[-1].method == "clipboard"
+    # the setting from before the first select is put back
+    controller.text_input.release()
+    assert f"settings put secure {SHOW_WITH_HARD_KEYBOARD} 1" in device.shell_commands()[-1]
+
+
+def test_device_errors_are_recorded(monkeypatch):
+    def respond(command):
+        if "am broadcast" in command:
+            raise AdbError("device offline")
+        return ShellResponse("", 0)
+    controller = connect(monkeypatch, FakeDevice(respond=respond))
+    assert controller.input("hello") is False
+    timing = controller.text_input.timings[-1]
+    assert (timing.method, timing.chars, timing.ok) == ("broadcast", 5, False)
+    with pytest.raises(AdbError):
+        controller.text_input.type("hello")
+    assert len(controller.text_input.timings) == 2
@@ -0,0 +1,101 @@
+import json
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+run_benchmark = pytest.importorskip("run_benchmark")
+import run_all
+
+
+class FakeEnv:
+    instances = []
+
+    def __init__(self, fail_reset=False, trace_dir=None, **kwargs):
+        self.trace_path = trace_dir
+        self.fail_reset = fail_reset
+        self.max_steps = 3
+        self.steps = 0
+        self.events = []
+        self.controller = SimpleNamespace(device=SimpleNamespace(
+            app_stop_all=lambda: self.events.append("stop"),
+            app_uninstall_all=lambda excludes: self.events.append("uninstall")))
+        FakeEnv.instances.append(self)
+
+    def reset(self, idx, app):
+        if self.fail_reset:
+            raise RuntimeError("device lost")
+        return "home screen"
+
+    def get_instruction(self):
+        return "open the chat"
+
+    def step(self, action):
+        self.steps += 1
+        return "screen", 0, self.steps == 2, {}
+
+    def close(self):
+        # the token usage is already on disk when the env closes
+        self.events.append(("close", (self.trace_path / "token_usage.json").exists()))
+
+
+class FakeAgent:
+    def __init__(self):
+        self.token_usage = {"input": 10, "output": 2, "total": 12}
+
+    def act(self, observation):
+        return "click(1, 2)"
+
+    def update_history(self, action):
+        pass
+
+
+@pytest.fixture
+def fake_run(monkeypatch, tmp_path):
+    FakeEnv.instances = []
+    monkeypatch.setattr(run_benchmark, "get_agent", lambda *args, **kwargs: FakeAgent())
+
+    def run(fail_reset=False, **kwargs):
+        monkeypatch.setattr(run_benchmark, "AndroidEnv",
+                            lambda **env_args: FakeEnv(fail_reset, **env_args))
+        return run_benchmark.benchmark_run(1, "wechat", "ReAct", "image", "gpt4o", "emulator-5554", "image",
+                                           "coordination", trace_dir=tmp_path, **kwargs)
+    return run
+
+
+def test_token_usage_is_written_before_close(fake_run, tmp_path):
+    assert fake_run() == 0
+    env = FakeEnv.instances[0]
+    assert env.steps == 2
+    assert env.events == ["stop", "uninstall", ("close", True)]
+    with open(tmp_path / "token_usage.json") as f:
+        assert json.load(f) == {"input": 10, "output": 2, "total": 12}
+    # reset per task, not summed over the tasks of a worker
+    fake_run()
+    assert run_benchmark.total_token_usage == {"input": 10, "output": 2, "total": 12}
+
+
+def test_env_is_closed_when_the_task_fails(fake_run):
+    with pytest.raises(RuntimeError):
+        fake_run(fail_reset=True)
+    assert FakeEnv.instances[0].events == [("close", False)]
+
+
+def test_worker_runs_every_task_on_one_connection(monkeypatch):
+    runs, connections = [], []
+
+    def benchmark_run(id, app, *args, controller=None, **kwargs):
+        runs.append((id, controller))
+        if id == 2:
+            raise RuntimeError("device lost")
+    monkeypatch.setattr(run_benchmark, "benchmark_run", benchmark_run)
+    monkeypatch.setattr("infra.AndroidController", lambda port, app: connections.append(port) or object())
+    tasks = queue.Queue()
+    for id in [1, 2, 3, 4]:
+        tasks.put({"id": id, "app": "wechat", "observation_mode": "tree", "llm": "gpt4o", "tell_skill": False})
+    tasks.put(None)
+    run_all.run_worker("emulator-5554", tasks, 4)
+    assert [id for id, _ in runs] == [1, 2, 3, 4]
+    # the connection is reused, and made again after a failed task
+    assert len(connections) == 2
+    assert runs[0][1] is runs[1][1] is not runs[2][1] and runs[2][1] is runs[3][1]